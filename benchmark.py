@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+微基准测试脚本
+测量签名、Token 缓存、配置查找和进程内完整请求（ASGI，无网络）的耗时，
+以及普通/紧凑两种缓存布局每个条目的内存占用、分片缓存的多线程吞吐，结果输出为 JSON
+
+用法:
+    python benchmark.py                                  # 全部基准，结果写入 benchmark.json
+    python benchmark.py --sizes 1000,10000 --output a.json
+    python benchmark.py --only sign,cache               # 只运行部分分组
+    python benchmark.py --only memory --sizes 1000000   # 两种缓存布局的内存占用
+    python benchmark.py --only threads --threads 1,2,4,8
+                                                         # 分片缓存多线程读吞吐
+    python benchmark.py --compare base.json --threshold 0.1
+                                                         # 与基线对比，变慢超过 10% 时退出码为 1
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mqtt import config, onenet_token, onenet_token_custom, signer, token_cache
+from mqtt.compact_cache import CompactTokenCache
+from mqtt.sharded_cache import ShardedTokenCache
+
+# 每组重复测量次数，取中位数和最小值
+REPEAT = 5
+
+# 每次测量的目标耗时（秒），据此自动确定循环次数
+TARGET_SECONDS = 0.2
+
+# 多线程基准的缓存条目数和每个线程的操作数
+THREAD_CACHE_SIZE = 100000
+THREAD_OPS = 200000
+
+# 自定义参数基准使用的产品和密钥
+CUSTOM_PRODUCT_ID = "benchproduct"
+CUSTOM_ACCESS_KEY = base64.b64encode(b"benchmark-access-key-0123456789ab").decode("ascii")
+
+
+def _calibrate(fn: Callable[[int], None]) -> int:
+    """按 TARGET_SECONDS 估算单次测量的循环次数"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        fn(number)
+        elapsed = time.perf_counter() - start
+        if elapsed >= TARGET_SECONDS / 10 or number >= 1 << 24:
+            return max(1, int(number * TARGET_SECONDS / max(elapsed, 1e-9)))
+        number *= 10
+
+
+def measure(name: str, fn: Callable[[int], None], number: Optional[int] = None,
+            setup: Optional[Callable[[], None]] = None, **params: Any) -> Dict[str, Any]:
+    """
+    测量 fn 的单次操作耗时
+
+    参数:
+        name: 基准名称
+        fn: 接收循环次数 n 并执行 n 次操作的函数
+        number: 固定循环次数，None 时自动估算
+        setup: 每次测量前调用（不计时），用于恢复被 fn 修改的状态
+        params: 写入结果的参数
+
+    返回:
+        结果字典: name、params、number、ns_per_op（中位数）、ns_per_op_min、ops_per_sec
+    """
+    if number is None:
+        if setup is not None:
+            setup()
+        number = _calibrate(fn)
+
+    samples = []
+    for _ in range(REPEAT):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn(number)
+        samples.append((time.perf_counter() - start) / number)
+
+    median = statistics.median(samples)
+    result = {
+        "name": name,
+        "params": params,
+        "number": number,
+        "ns_per_op": round(median * 1e9, 1),
+        "ns_per_op_min": round(min(samples) * 1e9, 1),
+        "ops_per_sec": round(1 / median) if median else None
+    }
+    print(f"  {name:<40} {_format_params(params):<24} {result['ns_per_op']:>12.1f} ns/op", file=sys.stderr)
+    return result
+
+
+def _format_params(params: Dict[str, Any]) -> str:
+    """格式化参数用于控制台输出"""
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+def bench_sign() -> List[Dict[str, Any]]:
+    """签名相关基准"""
+    product = config.get_product_config()
+    access_key = base64.b64decode(product["access_key"])
+    res = f"products/{product['product_id']}/devices/MO"
+    expire_time = int(time.time()) + 720 * 3600
+
+    def generate_token(n: int) -> None:
+        for _ in range(n):
+            onenet_token._generate_token(res, expire_time, access_key)
+
+    def product_token(n: int) -> None:
+        for _ in range(n):
+            onenet_token.generate_product_token()
+
+    def device_token(n: int) -> None:
+        for _ in range(n):
+            onenet_token.generate_device_token("MO")
+
+    def product_token_custom(n: int) -> None:
+        for _ in range(n):
+            onenet_token_custom.generate_product_token_custom(CUSTOM_PRODUCT_ID, CUSTOM_ACCESS_KEY)
+
+    def device_token_custom(n: int) -> None:
+        for _ in range(n):
+            onenet_token_custom.generate_device_token_custom(CUSTOM_PRODUCT_ID, "device-0001", CUSTOM_ACCESS_KEY)
+
+    results = []
+    resources = [f"products/{product['product_id']}/devices/D{i:04d}" for i in range(1000)]
+    for method in signer.SIGN_METHODS:
+        prepared = signer.registry.get(access_key, method)
+
+        def sign_one(n: int) -> None:
+            for _ in range(n):
+                prepared.sign(res, expire_time)
+
+        def sign_many(n: int) -> None:
+            # 每次操作签名一块 1000 个资源，结果按单个 Token 折算
+            for _ in range(n // len(resources) or 1):
+                prepared.sign_many(resources, expire_time)
+
+        results.append(measure("PreparedSigner.sign", sign_one, method=method))
+        results.append(measure("PreparedSigner.sign_many", sign_many, number=20 * len(resources), method=method))
+
+    return results + [
+        measure("onenet_token._generate_token", generate_token),
+        measure("onenet_token.generate_product_token", product_token),
+        measure("onenet_token.generate_device_token", device_token),
+        measure("generate_product_token_custom", product_token_custom),
+        measure("generate_device_token_custom", device_token_custom),
+    ]
+
+
+def _cache_entries(size: int) -> Tuple[List[str], List[str]]:
+    """生成 size 个缓存键及与键中资源路径一致的 Token（紧凑缓存才能拆分保存，而不是原样保存）"""
+    prepared = signer.registry.get(CUSTOM_ACCESS_KEY)
+    expire_time = signer.compute_expire_time(720)
+    resources = [f"products/{CUSTOM_PRODUCT_ID}/devices/device-{i:07d}" for i in range(size)]
+    keys = [token_cache.make_key(res, CUSTOM_ACCESS_KEY, 720) for res in resources]
+    return keys, prepared.sign_many(resources, expire_time)
+
+
+def _bench_cache_ops(name: str, cache_class: type, keys: List[str], tokens: List[str]) -> List[Dict[str, Any]]:
+    """填充缓存并测量各操作，返回后缓存即可释放"""
+    size = len(keys)
+    cache = cache_class(max_entries=size)
+    for key, token in zip(keys, tokens):
+        cache.set(key, token)
+    raw = cache.stats().get("raw", 0)
+    if raw:
+        raise RuntimeError(f"{name}: {raw} 个条目未拆分保存，测量的不是紧凑布局")
+
+    def get_hit(n: int) -> None:
+        get = cache.get
+        for i in range(n):
+            get(keys[i % size])
+
+    def get_miss(n: int) -> None:
+        get = cache.get
+        for _ in range(n):
+            get("missing")
+
+    def set_existing(n: int) -> None:
+        put = cache.set
+        for i in range(n):
+            put(keys[i % size], tokens[i % size])
+
+    # refresh 会删除条目，循环次数不超过规模，每次测量前重新写回
+    refresh_number = min(size, 100000)
+
+    def refresh(n: int) -> None:
+        drop = cache.refresh
+        for i in range(n):
+            drop(keys[i])
+
+    def restore() -> None:
+        for i in range(refresh_number):
+            cache.set(keys[i], tokens[i])
+
+    return [
+        measure(f"{name}.get (hit)", get_hit, size=size),
+        measure(f"{name}.get (miss)", get_miss, size=size),
+        measure(f"{name}.set (overwrite)", set_existing, size=size),
+        measure(f"{name}.refresh", refresh, number=refresh_number, setup=restore, size=size),
+    ]
+
+
+def bench_cache(sizes: List[int]) -> List[Dict[str, Any]]:
+    """TokenCache 和 CompactTokenCache 基准，每个规模单独建缓存，两种缓存使用相同的键和 Token"""
+    results = []
+    for size in sizes:
+        keys, tokens = _cache_entries(size)
+        for cache_class in (token_cache.TokenCache, CompactTokenCache):
+            results += _bench_cache_ops(cache_class.__name__, cache_class, keys, tokens)
+    return results
+
+
+def _measure_memory(cache_class: type, size: int, prepared: signer.PreparedSigner, expire_time: int) -> Dict[str, Any]:
+    """用 tracemalloc 统计填充 size 个条目前后的内存差"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = cache_class(max_entries=size)
+    for i in range(size):
+        res = f"products/{CUSTOM_PRODUCT_ID}/devices/device-{i:07d}"
+        cache.set(token_cache.make_key(res, CUSTOM_ACCESS_KEY, 720), prepared.sign(res, expire_time))
+    total = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        "name": f"{cache_class.__name__} memory",
+        "params": {"size": size},
+        "bytes_per_entry": round(total / size, 1),
+        "total_bytes": total,
+        "reported_bytes": cache.bytes
+    }
+
+
+def bench_memory(sizes: List[int]) -> List[Dict[str, Any]]:
+    """
+    两种缓存布局的内存占用基准
+
+    每个条目使用不同设备的真实 Token，key 和 Token 在写入时生成（与服务中一样不与其他对象共享），
+    用 tracemalloc 统计填充前后的内存差
+    """
+    prepared = signer.registry.get(CUSTOM_ACCESS_KEY)
+    expire_time = signer.compute_expire_time(720)
+    results = []
+    for cache_class in (token_cache.TokenCache, CompactTokenCache):
+        for size in sizes:
+            result = _measure_memory(cache_class, size, prepared, expire_time)
+            print(f"  {result['name']:<40} {_format_params(result['params']):<24} "
+                  f"{result['bytes_per_entry']:>12.1f} B/entry", file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def _run_threads(threads: int, work: Callable[[int], None]) -> float:
+    """同时启动 threads 个线程执行 work(线程序号)，返回总耗时（秒）"""
+    barrier = threading.Barrier(threads + 1)
+
+    def run(index: int) -> None:
+        barrier.wait()
+        work(index)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def bench_threads(thread_counts: List[int]) -> List[Dict[str, Any]]:
+    """
+    分片缓存多线程压力基准
+
+    shards=1 相当于单把全局锁，与 16 个分片对比同样线程数下的总读吞吐（90% get + 10% set）；
+    另外验证 get_or_create 在所有线程同时未命中同一批 key 时每个 key 只生成一次。
+    有 GIL 的解释器上纯 Python 读操作无法并行，吞吐随线程数基本持平，分片的收益是避免锁争用；
+    在无 GIL 解释器上分片缓存的吞吐随线程数增长
+    """
+    prepared = signer.registry.get(CUSTOM_ACCESS_KEY)
+    expire_time = signer.compute_expire_time(720)
+    resources = [f"products/{CUSTOM_PRODUCT_ID}/devices/device-{i:07d}" for i in range(THREAD_CACHE_SIZE)]
+    keys = [token_cache.make_key(res, CUSTOM_ACCESS_KEY, 720) for res in resources]
+    tokens = prepared.sign_many(resources, expire_time)
+
+    results = []
+    for shards in (1, 16):
+        cache = ShardedTokenCache(shards=shards, max_entries=THREAD_CACHE_SIZE * 2)
+        for key, token in zip(keys, tokens):
+            cache.set(key, token)
+
+        for threads in thread_counts:
+            ops = THREAD_OPS // threads
+
+            def work(index: int) -> None:
+                get, put = cache.get, cache.set
+                offset = index * 7919
+                for i in range(ops):
+                    j = (offset + i * 31) % THREAD_CACHE_SIZE
+                    if i % 10:
+                        get(keys[j])
+                    else:
+                        put(keys[j], tokens[j])
+
+            elapsed = min(_run_threads(threads, work) for _ in range(REPEAT))
+            total = ops * threads
+            result = {
+                "name": "ShardedTokenCache mixed (threads)",
+                "params": {"shards": shards, "threads": threads},
+                "number": total,
+                "ns_per_op": round(elapsed / total * 1e9, 1),
+                "ops_per_sec": round(total / elapsed)
+            }
+            print(f"  {result['name']:<40} {_format_params(result['params']):<24} "
+                  f"{result['ns_per_op']:>12.1f} ns/op {result['ops_per_sec']:>10} ops/s", file=sys.stderr)
+            results.append(result)
+
+    # get_or_create: 所有线程按相同顺序请求同一批未缓存的 key
+    threads = max(thread_counts)
+    cache = ShardedTokenCache(shards=16, max_entries=THREAD_CACHE_SIZE * 2)
+    generated = [0] * len(keys)
+    count = min(len(keys), 20000)
+
+    def stampede(index: int) -> None:
+        for j in range(count):
+            def generate(j: int = j) -> str:
+                generated[j] += 1
+                return tokens[j]
+            cache.get_or_create(keys[j], generate)
+
+    elapsed = _run_threads(threads, stampede)
+    duplicates = sum(n - 1 for n in generated[:count] if n > 1)
+    result = {
+        "name": "ShardedTokenCache.get_or_create (stampede)",
+        "params": {"shards": 16, "threads": threads},
+        "number": count * threads,
+        "ns_per_op": round(elapsed / (count * threads) * 1e9, 1),
+        "duplicates": duplicates,
+        "coalesced": cache.stats()["coalesced"]
+    }
+    print(f"  {result['name']:<40} {_format_params(result['params']):<24} "
+          f"{result['ns_per_op']:>12.1f} ns/op  重复生成 {duplicates}", file=sys.stderr)
+    results.append(result)
+    return results
+
+
+def bench_config() -> List[Dict[str, Any]]:
+    """配置查找基准"""
+
+    def product_config(n: int) -> None:
+        for _ in range(n):
+            config.get_product_config()
+
+    def device_config(n: int) -> None:
+        for _ in range(n):
+            config.get_device_config("mo")
+
+    def device_names(n: int) -> None:
+        for _ in range(n):
+            config.get_all_device_names()
+
+    def cache_config(n: int) -> None:
+        for _ in range(n):
+            config.get_cache_config()
+
+    return [
+        measure("config.get_product_config", product_config),
+        measure("config.get_device_config", device_config),
+        measure("config.get_all_device_names", device_names),
+        measure("config.get_cache_config", cache_config),
+    ]
+
+
+async def _bench_asgi(requests_per_route: int) -> List[Dict[str, Any]]:
+    """通过 ASGI 传输在进程内发送完整请求，统计单请求延迟分布"""
+    import httpx
+    import main
+
+    routes = [
+        ("GET", "/health", None),
+        ("GET", "/mqtt/onenet/v1/token/product", None),
+        ("GET", "/mqtt/onenet/v1/device/MO", None),
+        ("GET", f"/mqtt/onenet/v1/token/custom/device?product_id={CUSTOM_PRODUCT_ID}"
+                f"&device_id=device-0001&access_key={CUSTOM_ACCESS_KEY}", None),
+        ("POST", "/mqtt/onenet/v1/token/device/batch", {"devices": ["MO", "MO1"]}),
+    ]
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for method, url, body in routes:
+            # 预热，填充缓存和签名器
+            for _ in range(10):
+                await client.request(method, url, json=body)
+
+            latencies = []
+            for _ in range(requests_per_route):
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{method} {url} 返回 {response.status_code}")
+
+            latencies.sort()
+            result = {
+                "name": f"asgi {method} {url.split('?')[0]}",
+                "params": {"requests": requests_per_route},
+                "number": requests_per_route,
+                "ns_per_op": round(statistics.median(latencies) * 1e9, 1),
+                "ns_per_op_min": round(latencies[0] * 1e9, 1),
+                "ns_p99": round(latencies[int(len(latencies) * 0.99) - 1] * 1e9, 1),
+                "ops_per_sec": round(len(latencies) / sum(latencies))
+            }
+            print(f"  {result['name']:<40} {'':<24} {result['ns_per_op']:>12.1f} ns/op"
+                  f"  p99 {result['ns_p99']:.1f}", file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def bench_asgi(requests_per_route: int) -> List[Dict[str, Any]]:
+    """进程内完整请求基准"""
+    return asyncio.run(_bench_asgi(requests_per_route))
+
+
+def _git_commit() -> Optional[str]:
+    """获取当前 git 提交，用于区分不同分支的结果"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> int:
+    """
+    与基线结果对比
+
+    参数:
+        results: 本次结果
+        baseline_path: 基线 JSON 文件路径
+        threshold: 允许变慢的比例（如 0.1 表示 10%）
+
+    返回:
+        变慢超过阈值的基准数
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(item["name"], json.dumps(item["params"], sort_keys=True)): item
+                    for item in json.load(f)["results"]}
+
+    regressions = 0
+    print(file=sys.stderr)
+    print(f"与基线对比: {baseline_path}", file=sys.stderr)
+    for item in results:
+        base = baseline.get((item["name"], json.dumps(item["params"], sort_keys=True)))
+        # 耗时基准比较 ns_per_op，内存基准比较 bytes_per_entry
+        metric = "ns_per_op" if "ns_per_op" in item else "bytes_per_entry"
+        if base is None or not base.get(metric):
+            continue
+        change = item[metric] / base[metric] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  ❌ 变慢" if metric == "ns_per_op" else "  ❌ 变大"
+            regressions += 1
+        print(f"  {item['name']:<40} {_format_params(item['params']):<24} {change:>+8.1%}{flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    """运行基准并输出 JSON"""
+    parser = argparse.ArgumentParser(description="Commonserv 微基准测试")
+    parser.add_argument("--output", default="benchmark.json", help="结果 JSON 文件路径，- 表示输出到标准输出")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="缓存规模，逗号分隔")
+    parser.add_argument("--only", default="sign,cache,memory,threads,config,asgi", help="要运行的分组，逗号分隔")
+    parser.add_argument("--threads", default="1,2,4,8", help="多线程基准的线程数，逗号分隔")
+    parser.add_argument("--requests", type=int, default=2000, help="ASGI 基准每个路由的请求数")
+    parser.add_argument("--compare", help="基线 JSON 文件路径")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时允许变慢的比例")
+    args = parser.parse_args()
+
+    groups = set(args.only.split(","))
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    thread_counts = [int(count) for count in args.threads.split(",") if count]
+
+    results: List[Dict[str, Any]] = []
+    if "sign" in groups:
+        print("签名", file=sys.stderr)
+        results += bench_sign()
+    if "cache" in groups:
+        print("Token 缓存", file=sys.stderr)
+        results += bench_cache(sizes)
+    if "memory" in groups:
+        print("缓存内存占用", file=sys.stderr)
+        results += bench_memory(sizes)
+    if "threads" in groups:
+        print("分片缓存多线程", file=sys.stderr)
+        results += bench_threads(thread_counts)
+    if "config" in groups:
+        print("配置查找", file=sys.stderr)
+        results += bench_config()
+    if "asgi" in groups:
+        print("进程内完整请求", file=sys.stderr)
+        results += bench_asgi(args.requests)
+
+    report = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "gil": getattr(sys, "_is_gil_enabled", lambda: True)(),
+            "repeat": REPEAT
+        },
+        "results": results
+    }
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    # 进度和对比信息输出到 stderr，stdout 只输出 JSON（--output -）
+    if args.output == "-":
+        print(data)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+        print(f"\n结果已写入 {args.output}", file=sys.stderr)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
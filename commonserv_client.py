@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Commonserv Python 客户端
+提供同步（TokenClient）和异步（AsyncTokenClient）两个版本，接口一致:
+
+    - 连接池复用 HTTP/1.1 长连接，也可以通过 Unix 域套接字连接本机服务
+    - 解析 Token 中的 et，在过期前 refresh_margin 秒内一直使用本地缓存
+    - 同一个 Token 的并发获取只发送一次请求
+    - 支持批量接口和流式批量生成接口
+
+用法:
+    with TokenClient("http://localhost:8000") as client:
+        token = client.device_token("MO")
+
+    async with AsyncTokenClient(uds="/run/commonserv.sock") as client:
+        token = await client.custom_device_token("pid", "dev-1", access_key)
+"""
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import httpx
+
+BASE_URL = "http://localhost:8000"
+
+API_PREFIX = "/mqtt/onenet/v1"
+
+# 批量接口单次请求的最大条目数（与服务端 BATCH_MAX_ITEMS 一致）
+BATCH_MAX_ITEMS = 1000
+
+# 流式批量接口单个子请求的请求体上限（字节）
+# httpx 发送完整个请求体后才读取响应，而服务端边读边返回结果；请求体不超过服务端的读缓冲
+# 和套接字缓冲时上传总能完成，不会因两端缓冲都写满而互相等待
+BULK_REQUEST_BYTES = 32 * 1024
+
+
+class TokenClientError(Exception):
+    """服务返回错误响应"""
+
+    def __init__(self, status_code: int, detail: Any):
+        """
+        初始化异常
+
+        参数:
+            status_code: HTTP 状态码
+            detail: 服务返回的错误详情
+        """
+        super().__init__(f"HTTP {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def parse_expire_time(token: str) -> Optional[int]:
+    """
+    从 Token 中解析 et 字段
+
+    参数:
+        token: Token 字符串
+
+    返回:
+        过期时间戳（秒），解析失败返回 None
+    """
+    start = token.find("&et=")
+    if start < 0:
+        return None
+    start += 4
+    end = token.find("&", start)
+    value = token[start:end] if end >= 0 else token[start:]
+    return int(value) if value.isdigit() else None
+
+
+def _device_item(item: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """将设备 ID 或 {"device_id": ...} 规范为请求体中的一行"""
+    return item if isinstance(item, dict) else {"device_id": item}
+
+
+def _bulk_bodies(devices: Iterable[Union[str, Dict[str, Any]]]) -> Iterator[Tuple[int, bytes]]:
+    """
+    将设备迭代器切分为流式批量接口的子请求体
+
+    返回:
+        (本块之前的行数, NDJSON 请求体) 迭代器，请求体不超过 BULK_REQUEST_BYTES（单行超长时单独成块）
+    """
+    lines: List[bytes] = []
+    size = 0
+    offset = 0
+    for item in devices:
+        line = json.dumps(_device_item(item), ensure_ascii=False).encode("utf-8") + b"\n"
+        if lines and size + len(line) > BULK_REQUEST_BYTES:
+            yield offset, b"".join(lines)
+            offset += len(lines)
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line)
+    if lines:
+        yield offset, b"".join(lines)
+
+
+def _bulk_result(line: str, offset: int) -> Dict[str, Any]:
+    """解析流式批量接口的一行结果，错误行的行号换算为整个输入中的行号"""
+    result = json.loads(line)
+    if "line" in result:
+        result["line"] += offset
+    return result
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    """非 2xx 响应转换为 TokenClientError"""
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = response.text
+        raise TokenClientError(response.status_code, detail)
+
+
+class _LocalCache:
+    """
+    客户端本地 Token 缓存（线程安全）
+
+    缓存到 Token 的 et 之前 margin 秒，没有 et 的 Token 不缓存
+    """
+
+    def __init__(self, margin: float, max_entries: int):
+        """
+        初始化缓存
+
+        参数:
+            margin: 在 et 之前多少秒视为过期
+            max_entries: 最多缓存的 Token 数，超出时清除已过期条目，仍超出则清空
+        """
+        self.margin = margin
+        self.max_entries = max_entries
+        self._tokens: Dict[Tuple, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[str]:
+        """获取未过期的 Token"""
+        cached = self._tokens.get(key)
+        if cached is not None and time.time() < cached[1]:
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple, token: str) -> None:
+        """写入 Token，本地失效时间为 et - margin"""
+        expire_time = parse_expire_time(token)
+        if expire_time is None:
+            return
+        valid_until = expire_time - self.margin
+        now = time.time()
+        if valid_until <= now:
+            return
+        with self._lock:
+            if len(self._tokens) >= self.max_entries and key not in self._tokens:
+                self._tokens = {k: v for k, v in self._tokens.items() if v[1] > now}
+                if len(self._tokens) >= self.max_entries:
+                    self._tokens.clear()
+            self._tokens[key] = (token, valid_until)
+
+    def discard(self, key: Tuple) -> None:
+        """删除 Token"""
+        with self._lock:
+            self._tokens.pop(key, None)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._tokens.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取本地缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._tokens),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class _ClientBase:
+    """同步和异步客户端共用的请求构造和缓存逻辑"""
+
+    def __init__(self, base_url: str, uds: Optional[str], refresh_margin: float, max_cached: int):
+        # 使用 Unix 域套接字时主机名只用于 Host 头
+        self.base_url = "http://commonserv" if uds else base_url.rstrip("/")
+        self.uds = uds
+        self.cache = _LocalCache(refresh_margin, max_cached)
+        # 等待其他请求结果而未单独发送请求的次数
+        self.coalesced = 0
+
+    @staticmethod
+    def _product_request(product_id: Optional[str], access_key: Optional[str], expire_hours: Optional[int],
+                         method: Optional[str]) -> Tuple[Tuple, str, Dict[str, Any]]:
+        """产品 Token 请求: (缓存键, 路径, 查询参数)"""
+        params: Dict[str, Any] = {}
+        if product_id and access_key:
+            params.update(product_id=product_id, access_key=access_key)
+        if expire_hours is not None:
+            params["expire_hours"] = expire_hours
+        if method is not None:
+            params["method"] = method
+        key = ("product", product_id, access_key, expire_hours, method)
+        return key, f"{API_PREFIX}/token/product", params
+
+    @staticmethod
+    def _device_request(device_name: str) -> Tuple[Tuple, str, Dict[str, Any]]:
+        """已配置设备 Token 请求"""
+        return ("device", device_name.upper()), f"{API_PREFIX}/device/{device_name}", {}
+
+    @staticmethod
+    def _custom_request(product_id: str, device_id: str, access_key: str, expire_hours: Optional[int],
+                        method: Optional[str]) -> Tuple[Tuple, str, Dict[str, Any]]:
+        """自定义参数设备 Token 请求"""
+        params: Dict[str, Any] = {"product_id": product_id, "device_id": device_id, "access_key": access_key}
+        if expire_hours is not None:
+            params["expire_hours"] = expire_hours
+        if method is not None:
+            params["method"] = method
+        key = ("custom", product_id, device_id, access_key, expire_hours, method)
+        return key, f"{API_PREFIX}/token/custom/device", params
+
+    @staticmethod
+    def _bulk_params(product_id: str, access_key: str, expire_hours: Optional[int],
+                     method: Optional[str]) -> Dict[str, Any]:
+        """流式批量接口查询参数"""
+        params: Dict[str, Any] = {"product_id": product_id, "access_key": access_key, "format": "ndjson"}
+        if expire_hours is not None:
+            params["expire_hours"] = expire_hours
+        if method is not None:
+            params["method"] = method
+        return params
+
+    @staticmethod
+    def _batch_body(devices: List[str], custom: List[Dict[str, Any]],
+                    expire_hours: Optional[int]) -> Dict[str, Any]:
+        """批量接口请求体"""
+        if len(devices) + len(custom) > BATCH_MAX_ITEMS:
+            raise ValueError(f"单次最多 {BATCH_MAX_ITEMS} 个设备")
+        body: Dict[str, Any] = {"devices": devices, "custom": custom}
+        if expire_hours is not None:
+            body["expire_hours"] = expire_hours
+        return body
+
+    def _store_batch(self, devices: List[str], custom: List[Dict[str, Any]], results: List[Dict[str, Any]],
+                     expire_hours: Optional[int]) -> None:
+        """把批量接口的成功结果写入本地缓存，结果顺序与请求一致（先 devices 后 custom）"""
+        for device_name, result in zip(devices, results):
+            # 按名称访问的接口使用服务端默认有效期，只有默认有效期的结果可以共用
+            if expire_hours is None and "token" in result:
+                self.cache.put(self._device_request(device_name)[0], result["token"])
+        for item, result in zip(custom, results[len(devices):]):
+            if "token" in result:
+                key = self._custom_request(item["product_id"], item["device_id"], item["access_key"],
+                                           expire_hours, item.get("method"))[0]
+                self.cache.put(key, result["token"])
+
+    def stats(self) -> Dict[str, Any]:
+        """获取本地缓存和请求合并统计"""
+        return {**self.cache.stats(), "coalesced": self.coalesced}
+
+
+class TokenClient(_ClientBase):
+    """同步客户端（线程安全）"""
+
+    def __init__(self, base_url: str = BASE_URL, uds: Optional[str] = None, timeout: float = 10.0,
+                 refresh_margin: float = 300, max_connections: int = 100, max_cached: int = 100000):
+        """
+        初始化客户端
+
+        参数:
+            base_url: 服务地址
+            uds: Unix 域套接字路径，设置后忽略 base_url
+            timeout: 请求超时（秒）
+            refresh_margin: 在 Token 的 et 之前多少秒重新获取
+            max_connections: 连接池最大连接数
+            max_cached: 本地最多缓存的 Token 数
+        """
+        super().__init__(base_url, uds, refresh_margin, max_cached)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        transport = httpx.HTTPTransport(uds=uds, limits=limits) if uds else None
+        self._http = httpx.Client(base_url=self.base_url, timeout=timeout, limits=limits, transport=transport)
+        self._inflight: Dict[Tuple, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def __enter__(self) -> "TokenClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """关闭连接池"""
+        self._http.close()
+
+    def product_token(self, product_id: Optional[str] = None, access_key: Optional[str] = None,
+                      expire_hours: Optional[int] = None, method: Optional[str] = None,
+                      refresh: bool = False) -> str:
+        """
+        获取产品级 Token
+
+        参数:
+            product_id: 产品 ID，与 access_key 一起传入时使用自定义参数，否则使用服务端配置
+            access_key: 访问密钥（Base64 编码）
+            expire_hours: Token 有效期（小时），不传使用服务端默认值
+            method: 签名方法，不传使用服务端默认值
+            refresh: 是否跳过本地缓存并要求服务端重新生成
+
+        返回:
+            Token 字符串
+
+        异常:
+            TokenClientError: 服务返回错误
+        """
+        return self._token(*self._product_request(product_id, access_key, expire_hours, method), refresh)
+
+    def device_token(self, device_name: str, refresh: bool = False) -> str:
+        """
+        获取已配置设备的 Token
+
+        参数:
+            device_name: 设备名称（不区分大小写）
+            refresh: 是否跳过本地缓存并要求服务端重新生成
+
+        返回:
+            Token 字符串
+
+        异常:
+            TokenClientError: 设备不存在或服务返回错误
+        """
+        return self._token(*self._device_request(device_name), refresh)
+
+    def custom_device_token(self, product_id: str, device_id: str, access_key: str,
+                            expire_hours: Optional[int] = None, method: Optional[str] = None,
+                            refresh: bool = False) -> str:
+        """
+        获取自定义参数设备的 Token
+
+        参数:
+            product_id: 产品 ID
+            device_id: 设备 ID
+            access_key: 访问密钥（Base64 编码）
+            expire_hours: Token 有效期（小时）
+            method: 签名方法
+            refresh: 是否跳过本地缓存并要求服务端重新生成
+
+        返回:
+            Token 字符串
+
+        异常:
+            TokenClientError: 参数无效或服务返回错误
+        """
+        return self._token(*self._custom_request(product_id, device_id, access_key, expire_hours, method), refresh)
+
+    def device_tokens(self, devices: Iterable[str] = (), custom: Iterable[Dict[str, Any]] = (),
+                      expire_hours: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        调用批量接口获取设备 Token，成功的结果同时写入本地缓存
+
+        参数:
+            devices: 已配置的设备名称
+            custom: 自定义参数设备，每项包含 product_id、device_id、access_key，可选 method
+            expire_hours: Token 有效期（小时）
+
+        返回:
+            与请求顺序一致的结果列表，成功项包含 token，失败项包含 error
+        """
+        devices, custom = list(devices), list(custom)
+        body = self._batch_body(devices, custom, expire_hours)
+        response = self._http.post(f"{API_PREFIX}/token/device/batch", json=body)
+        _raise_for_status(response)
+        results = response.json()["data"]["results"]
+        self._store_batch(devices, custom, results, expire_hours)
+        return results
+
+    def bulk_tokens(self, product_id: str, access_key: str, devices: Iterable[Union[str, Dict[str, Any]]],
+                    expire_hours: Optional[int] = None, method: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        调用流式批量接口，内存占用与设备数无关
+
+        设备 ID 按 BULK_REQUEST_BYTES 切分为多个子请求在同一个长连接上依次发送，
+        读完一个子请求的结果再发送下一个；错误行的 line 为在整个输入中的行号
+
+        参数:
+            product_id: 产品 ID
+            access_key: 访问密钥（Base64 编码）
+            devices: 设备 ID（或 {"device_id": ...}）迭代器
+            expire_hours: Token 有效期（小时）
+            method: 签名方法
+
+        返回:
+            结果迭代器，每项 {"device": ..., "token": ...} 或 {"line": ..., "error": ...}
+        """
+        params = self._bulk_params(product_id, access_key, expire_hours, method)
+        for offset, body in _bulk_bodies(devices):
+            with self._http.stream("POST", f"{API_PREFIX}/token/custom/device/bulk", params=params,
+                                   content=body, headers={"Content-Type": "application/x-ndjson"},
+                                   timeout=None) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    _raise_for_status(response)
+                for line in response.iter_lines():
+                    if line:
+                        yield _bulk_result(line, offset)
+
+    def verify(self, token: str, access_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        校验 Token
+
+        参数:
+            token: Token 字符串
+            access_key: 访问密钥，不传则由服务端按 res 查找已配置产品的密钥
+
+        返回:
+            校验结果: valid、res、et，失败时包含 error
+        """
+        response = self._http.post(f"{API_PREFIX}/token/verify", json={"token": token, "access_key": access_key})
+        _raise_for_status(response)
+        return response.json()["data"]
+
+    def _token(self, key: Tuple, path: str, params: Dict[str, Any], refresh: bool) -> str:
+        """本地缓存 -> 合并并发请求 -> 请求服务端"""
+        if refresh:
+            self.cache.discard(key)
+        else:
+            token = self.cache.get(key)
+            if token is not None:
+                return token
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self.coalesced += 1
+            return future.result()
+
+        try:
+            response = self._http.get(path, params={**params, "refresh": "true"} if refresh else params)
+            _raise_for_status(response)
+            token = response.json()["data"]["token"]
+            self.cache.put(key, token)
+            future.set_result(token)
+            return token
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+
+class AsyncTokenClient(_ClientBase):
+    """异步客户端（在单个事件循环中使用）"""
+
+    def __init__(self, base_url: str = BASE_URL, uds: Optional[str] = None, timeout: float = 10.0,
+                 refresh_margin: float = 300, max_connections: int = 100, max_cached: int = 100000):
+        """
+        初始化客户端
+
+        参数:
+            base_url: 服务地址
+            uds: Unix 域套接字路径，设置后忽略 base_url
+            timeout: 请求超时（秒）
+            refresh_margin: 在 Token 的 et 之前多少秒重新获取
+            max_connections: 连接池最大连接数
+            max_cached: 本地最多缓存的 Token 数
+        """
+        super().__init__(base_url, uds, refresh_margin, max_cached)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        transport = httpx.AsyncHTTPTransport(uds=uds, limits=limits) if uds else None
+        self._http = httpx.AsyncClient(base_url=self.base_url, timeout=timeout, limits=limits, transport=transport)
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+
+    async def __aenter__(self) -> "AsyncTokenClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """关闭连接池"""
+        await self._http.aclose()
+
+    async def product_token(self, product_id: Optional[str] = None, access_key: Optional[str] = None,
+                            expire_hours: Optional[int] = None, method: Optional[str] = None,
+                            refresh: bool = False) -> str:
+        """获取产品级 Token（参数同 TokenClient.product_token）"""
+        return await self._token(*self._product_request(product_id, access_key, expire_hours, method), refresh)
+
+    async def device_token(self, device_name: str, refresh: bool = False) -> str:
+        """获取已配置设备的 Token（参数同 TokenClient.device_token）"""
+        return await self._token(*self._device_request(device_name), refresh)
+
+    async def custom_device_token(self, product_id: str, device_id: str, access_key: str,
+                                  expire_hours: Optional[int] = None, method: Optional[str] = None,
+                                  refresh: bool = False) -> str:
+        """获取自定义参数设备的 Token（参数同 TokenClient.custom_device_token）"""
+        return await self._token(*self._custom_request(product_id, device_id, access_key, expire_hours, method),
+                                 refresh)
+
+    async def device_tokens(self, devices: Iterable[str] = (), custom: Iterable[Dict[str, Any]] = (),
+                            expire_hours: Optional[int] = None) -> List[Dict[str, Any]]:
+        """调用批量接口获取设备 Token（参数同 TokenClient.device_tokens）"""
+        devices, custom = list(devices), list(custom)
+        body = self._batch_body(devices, custom, expire_hours)
+        response = await self._http.post(f"{API_PREFIX}/token/device/batch", json=body)
+        _raise_for_status(response)
+        results = response.json()["data"]["results"]
+        self._store_batch(devices, custom, results, expire_hours)
+        return results
+
+    async def bulk_tokens(self, product_id: str, access_key: str, devices: Iterable[Union[str, Dict[str, Any]]],
+                          expire_hours: Optional[int] = None,
+                          method: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """调用流式批量接口（参数同 TokenClient.bulk_tokens），返回异步迭代器"""
+        params = self._bulk_params(product_id, access_key, expire_hours, method)
+        for offset, body in _bulk_bodies(devices):
+            async with self._http.stream("POST", f"{API_PREFIX}/token/custom/device/bulk", params=params,
+                                         content=body, headers={"Content-Type": "application/x-ndjson"},
+                                         timeout=None) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    _raise_for_status(response)
+                async for line in response.aiter_lines():
+                    if line:
+                        yield _bulk_result(line, offset)
+
+    async def verify(self, token: str, access_key: Optional[str] = None) -> Dict[str, Any]:
+        """校验 Token（参数同 TokenClient.verify）"""
+        response = await self._http.post(f"{API_PREFIX}/token/verify", json={"token": token, "access_key": access_key})
+        _raise_for_status(response)
+        return response.json()["data"]
+
+    async def _token(self, key: Tuple, path: str, params: Dict[str, Any], refresh: bool) -> str:
+        """本地缓存 -> 合并并发请求 -> 请求服务端"""
+        if refresh:
+            self.cache.discard(key)
+        else:
+            token = self.cache.get(key)
+            if token is not None:
+                return token
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: 等待者被取消时不影响发起请求的协程
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self._http.get(path, params={**params, "refresh": "true"} if refresh else params)
+            _raise_for_status(response)
+            token = response.json()["data"]["token"]
+            self.cache.put(key, token)
+            future.set_result(token)
+            return token
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
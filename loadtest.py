@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+并发压测脚本
+通过 HTTP/1.1 长连接向本地服务发送混合请求，统计吞吐、延迟分位数、错误率和服务端缓存命中率
+
+只依赖标准库（asyncio），客户端开销低，不会成为瓶颈
+
+用法:
+    python loadtest.py                                       # 默认 64 并发、10 秒、不限速
+    python loadtest.py -c 200 -d 30 --rps 20000
+    python loadtest.py --mix product=1,device=2,custom=1,mo=6 --devices MO,MO1
+    python loadtest.py --json result.json
+
+延迟从计划发送时间开始计算（限速模式下），服务变慢时排队时间也计入，避免协同遗漏
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import re
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+BASE_URL = "http://localhost:8000"
+
+# 自定义参数路由使用的产品和密钥
+CUSTOM_PRODUCT_ID = "loadtest"
+CUSTOM_ACCESS_KEY = base64.b64encode(b"loadtest-access-key-0123456789abc").decode("ascii")
+
+
+class LatencyHistogram:
+    """
+    HDR 风格的对数-线性直方图
+
+    按 2 的幂分段，每段再等分为 2^sub_bucket_bits 个子桶，相对误差不超过 1/2^sub_bucket_bits，
+    记录一个值只需几次整数运算，内存与样本数无关
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_value_us: int = 60_000_000):
+        """
+        初始化直方图
+
+        参数:
+            sub_bucket_bits: 每个数量级的子桶位数，7 表示约 0.8% 精度
+            max_value_us: 可记录的最大值（微秒），更大的值按最大值记录
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.max_value_us = max_value_us
+        self.counts = [0] * ((max_value_us.bit_length() + 1) * self.sub_bucket_count)
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        """值对应的桶下标，小于子桶数的值精确记录，更大的值右移到子桶范围的上半段"""
+        shift = max(value.bit_length() - self.sub_bucket_bits, 0)
+        return (shift << self.sub_bucket_bits) + (value >> shift)
+
+    def record(self, seconds: float) -> None:
+        """
+        记录一个延迟
+
+        参数:
+            seconds: 延迟（秒）
+        """
+        value = min(int(seconds * 1e6), self.max_value_us)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """合并另一个直方图"""
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> float:
+        """
+        获取分位数
+
+        参数:
+            percent: 百分位（如 99.9）
+
+        返回:
+            延迟（毫秒），取所在桶的上界，不超过记录到的最大值
+        """
+        if not self.total:
+            return 0.0
+        target = max(1, int(round(self.total * percent / 100)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest(index), self.max) / 1000
+        return self.max / 1000
+
+    def _highest(self, index: int) -> int:
+        """桶下标对应的最大值"""
+        shift = index >> self.sub_bucket_bits
+        if shift == 0:
+            return index
+        return (((index & (self.sub_bucket_count - 1)) + 1) << shift) - 1
+
+    def summary(self) -> Dict[str, Any]:
+        """分位数摘要（毫秒）"""
+        return {
+            "count": self.total,
+            "min_ms": (self.min or 0) / 1000,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "p999_ms": self.percentile(99.9),
+            "max_ms": self.max / 1000
+        }
+
+
+# 单个请求失败时计为错误而不是终止压测的异常: 连接错误、重连后再次断开、
+# 状态行或头部无法解析、头部超长
+REQUEST_ERRORS = (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError)
+
+
+class HttpConnection:
+    """最小化的 HTTP/1.1 长连接客户端"""
+
+    def __init__(self, host: str, port: int):
+        """
+        初始化连接
+
+        参数:
+            host: 服务地址
+            port: 端口
+        """
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        """
+        发送请求并读取完整响应，连接断开时自动重连一次
+
+        参数:
+            method: HTTP 方法
+            path: 路径（含查询串）
+            body: 请求体（JSON）
+
+        返回:
+            (状态码, 响应体)
+        """
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        data = (head + "\r\n").encode("latin-1") + (body or b"")
+
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(data)
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+        raise ConnectionError("unreachable")
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        """读取状态行、头部和响应体（支持 Content-Length 和 chunked）"""
+        header = await self.reader.readuntil(b"\r\n\r\n")
+        lines = header.split(b"\r\n")
+        status = int(lines[0].split(b" ", 2)[1])
+        length = None
+        chunked = False
+        close = False
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding" and b"chunked" in value.lower():
+                chunked = True
+            elif name == b"connection" and b"close" in value.lower():
+                close = True
+
+        if chunked:
+            parts = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readuntil(b"\r\n")
+                    break
+                parts.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            body = b"".join(parts)
+        elif length is not None:
+            body = await self.reader.readexactly(length)
+        else:
+            body = await self.reader.read()
+            close = True
+
+        if close:
+            self.close()
+        return status, body
+
+    def close(self) -> None:
+        """关闭连接"""
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def build_routes(mix: Dict[str, int], devices: List[str], custom_devices: int) -> List[Tuple[str, Any]]:
+    """
+    构建按权重展开的路由表
+
+    参数:
+        mix: 路由类别 -> 权重（product、device、custom、mo、batch）
+        devices: device 类别使用的设备名称
+        custom_devices: custom 类别轮换的设备 ID 数量
+
+    返回:
+        (类别, 请求生成函数) 列表，请求生成函数返回 (method, path, body)
+    """
+    key = quote(CUSTOM_ACCESS_KEY, safe="")
+    factories = {
+        "product": lambda i: ("GET", "/mqtt/onenet/v1/token/product", None),
+        "device": lambda i: ("GET", f"/mqtt/onenet/v1/token/device/{devices[i % len(devices)]}", None),
+        "custom": lambda i: ("GET", f"/mqtt/onenet/v1/token/custom/device?product_id={CUSTOM_PRODUCT_ID}"
+                                    f"&device_id=dev-{i % custom_devices:06d}&access_key={key}", None),
+        "mo": lambda i: ("GET", "/mqtt/onenet/v1/device/MO", None),
+        "batch": lambda i: ("POST", "/mqtt/onenet/v1/token/device/batch",
+                            json.dumps({"devices": devices}).encode("utf-8")),
+    }
+    routes = []
+    for name, weight in mix.items():
+        if name not in factories:
+            raise ValueError(f"未知的路由类别: {name}（可选 {', '.join(factories)}）")
+        routes += [(name, factories[name])] * weight
+    if not routes:
+        raise ValueError("路由权重不能全部为 0")
+    return routes
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """解析 name=weight,... 形式的路由权重"""
+    mix = {}
+    for item in text.split(","):
+        if item:
+            name, _, weight = item.partition("=")
+            mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+_CACHE_COUNTER = re.compile(rb"^commonserv_token_cache_(hits|misses)_total (\d+)", re.MULTILINE)
+
+
+async def fetch_cache_counters(host: str, port: int) -> Optional[Dict[str, int]]:
+    """从 /metrics 读取服务端 Token 缓存命中/未命中计数"""
+    conn = HttpConnection(host, port)
+    try:
+        status, body = await conn.request("GET", "/metrics")
+    except REQUEST_ERRORS:
+        return None
+    finally:
+        conn.close()
+    if status != 200:
+        return None
+    return {name.decode(): int(value) for name, value in _CACHE_COUNTER.findall(body)}
+
+
+class Stats:
+    """单个路由类别的统计"""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.cached = 0
+        self.statuses: Dict[int, int] = {}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """执行压测并返回结果"""
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    routes = build_routes(parse_mix(args.mix), args.devices.split(","), args.custom_devices)
+    stats = {name: Stats() for name, _ in routes}
+
+    loop = asyncio.get_running_loop()
+    start = loop.time() + args.warmup
+    deadline = start + args.duration
+    interval = 1 / args.rps if args.rps else 0.0
+    sequence = 0
+
+    async def worker(worker_id: int) -> None:
+        nonlocal sequence
+        conn = HttpConnection(host, port)
+        rng = random.Random(worker_id)
+        try:
+            while True:
+                i = sequence
+                sequence += 1
+                if interval:
+                    # 开环限速：第 i 个请求的计划发送时间固定，延迟从计划时间开始计算
+                    scheduled = start - args.warmup + i * interval
+                    delay = scheduled - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    scheduled = loop.time()
+                if scheduled >= deadline:
+                    return
+
+                name, factory = rng.choice(routes)
+                method, path, body = factory(i)
+                try:
+                    status, content = await conn.request(method, path, body)
+                except REQUEST_ERRORS:
+                    # 连接断开或响应无法解析: 计为错误（状态 0），丢弃连接，下一个请求重新连接
+                    conn.close()
+                    status, content = 0, b""
+                finished = loop.time()
+                if scheduled < start:
+                    # 预热阶段不计入统计
+                    continue
+
+                item = stats[name]
+                item.histogram.record(finished - scheduled)
+                item.statuses[status] = item.statuses.get(status, 0) + 1
+                if status != 200:
+                    item.errors += 1
+                elif b'"cached":true' in content:
+                    item.cached += 1
+        finally:
+            conn.close()
+
+    async def snapshot_after_warmup() -> Optional[Dict[str, int]]:
+        # 预热结束时读取服务端计数，命中率只反映统计阶段的请求
+        await asyncio.sleep(max(start - loop.time(), 0))
+        return await fetch_cache_counters(host, port)
+
+    snapshot = asyncio.create_task(snapshot_after_warmup())
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    elapsed = max(loop.time() - start, 1e-9)
+
+    before = await snapshot
+    after = await fetch_cache_counters(host, port)
+
+    total = LatencyHistogram()
+    result_routes = {}
+    for name, item in stats.items():
+        total.merge(item.histogram)
+        count = item.histogram.total
+        result_routes[name] = {
+            **item.histogram.summary(),
+            "errors": item.errors,
+            "error_rate": round(item.errors / count, 6) if count else 0.0,
+            "cached_ratio": round(item.cached / (count - item.errors), 4) if count > item.errors else 0.0,
+            "statuses": {str(status): n for status, n in sorted(item.statuses.items())}
+        }
+
+    errors = sum(item.errors for item in stats.values())
+    server_cache = None
+    if before and after and {"hits", "misses"} <= before.keys() & after.keys():
+        hits = after["hits"] - before["hits"]
+        misses = after["misses"] - before["misses"]
+        server_cache = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0
+        }
+
+    return {
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "target_rps": args.rps,
+            "mix": parse_mix(args.mix)
+        },
+        "requests": total.total,
+        "elapsed": round(elapsed, 3),
+        "throughput_rps": round(total.total / elapsed, 1),
+        "errors": errors,
+        "error_rate": round(errors / total.total, 6) if total.total else 0.0,
+        "latency": total.summary(),
+        "routes": result_routes,
+        "server_cache": server_cache
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    """输出文本报告"""
+    latency = result["latency"]
+    print("=" * 72)
+    print(f"请求数: {result['requests']}  耗时: {result['elapsed']}s  吞吐: {result['throughput_rps']} req/s")
+    print(f"错误数: {result['errors']}  错误率: {result['error_rate']:.4%}")
+    print(f"延迟(ms): p50 {latency['p50_ms']:.3f}  p90 {latency['p90_ms']:.3f}  p99 {latency['p99_ms']:.3f}"
+          f"  p999 {latency['p999_ms']:.3f}  max {latency['max_ms']:.3f}")
+    if result["server_cache"]:
+        cache = result["server_cache"]
+        print(f"服务端缓存: 命中 {cache['hits']}  未命中 {cache['misses']}  命中率 {cache['hit_ratio']:.2%}")
+    else:
+        print("服务端缓存: 无法读取 /metrics")
+    print("-" * 72)
+    print(f"{'路由':<10}{'请求数':>10}{'p50':>10}{'p99':>10}{'p999':>10}{'错误率':>10}{'cached':>10}")
+    for name, item in result["routes"].items():
+        print(f"{name:<10}{item['count']:>10}{item['p50_ms']:>10.3f}{item['p99_ms']:>10.3f}"
+              f"{item['p999_ms']:>10.3f}{item['error_rate']:>10.2%}{item['cached_ratio']:>10.2%}")
+    print("=" * 72)
+
+
+def main():
+    """解析参数并运行压测"""
+    parser = argparse.ArgumentParser(description="Commonserv 并发压测")
+    parser.add_argument("--url", default=BASE_URL, help="服务地址")
+    parser.add_argument("-c", "--concurrency", type=int, default=64, help="并发连接数")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="压测时长（秒）")
+    parser.add_argument("--rps", type=float, default=0, help="目标总 RPS，0 表示不限速")
+    parser.add_argument("--warmup", type=float, default=1, help="预热时长（秒），不计入统计")
+    parser.add_argument("--mix", default="product=1,device=1,custom=1,mo=1",
+                        help="路由权重: product、device、custom、mo、batch")
+    parser.add_argument("--devices", default="MO,MO1", help="device/batch 路由使用的设备名称，逗号分隔")
+    parser.add_argument("--custom-devices", type=int, default=1000, help="custom 路由轮换的设备 ID 数量")
+    parser.add_argument("--json", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    try:
+        result = asyncio.run(run(args))
+    except (ValueError, OSError) as e:
+        print(f"❌ 压测失败: {e}")
+        sys.exit(1)
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
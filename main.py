@@ -6,17 +6,67 @@ OneNET MQTT Token 生成服务
 提供产品级和设备级 Token 生成接口
 """
 
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
-from mqtt import onenet_token, onenet_token_custom, token_cache
+import asyncio
+import base64
+import hashlib
+import json
+from contextlib import asynccontextmanager
+from typing import Any, Callable, List, Optional, Tuple
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field
+from mqtt import onenet_token, onenet_token_custom, token_cache, token_refresher, signer, single_flight, bulk, device_registry, token_verifier, metrics, warmup, admission
+import time
 import uvicorn
 
+try:
+    import orjson
+except ImportError:  # 未安装时回退到标准库 json
+    orjson = None
+
+# 批量接口单次请求允许的最大条目数
+BATCH_MAX_ITEMS = 1000
+
+# 设备列表单页最大数量
+DEVICE_PAGE_MAX = 1000
+
+# 设备列表 ndjson 流式输出时每次写出的行数
+DEVICE_STREAM_BATCH = 1000
+
+# 缓存条目列表单页最大数量
+CACHE_PAGE_MAX = 1000
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动和停止 Token 提前刷新、设备注册表热加载、启动预热任务和事件循环延迟采样，退出时写入缓存快照"""
+    token_refresher.refresher.start()
+    device_registry.registry.start()
+    warmup.warmer.start()
+    admission.controller.start()
+    yield
+    await admission.controller.stop()
+    await warmup.warmer.stop()
+    await device_registry.registry.stop()
+    await token_refresher.refresher.stop()
+    bulk.shutdown_pool()
+    token_cache.cache.close()
+
+
 app = FastAPI(
     title="Commonserv 微服务平台",
     description="OneNET MQTT Token 生成服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# 纯 ASGI 中间件（后添加的在外层）：准入控制在路由之前拒绝过载请求，
+# 请求统计在最外层，被拒绝的请求同样计入延迟和状态码
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 @app.get("/")
 async def root():
@@ -26,6 +76,7 @@ async def root():
         "version": "1.0.0",
         "docs": "/docs",
         "health": "/health",
+        "ready": "/ready",
         "routes": "/routes"
     }
 
@@ -33,7 +84,6 @@ async def root():
 @app.get("/routes")
 async def list_routes():
     """列出所有可用路由"""
-    from fastapi.routing import APIRoute
     routes = []
     for route in app.routes:
         if isinstance(route, APIRoute):
@@ -58,8 +108,143 @@ async def health_check():
     return {"status": "ok", "service": "commonserv"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：启动预热完成前返回 503，负载均衡器据此决定是否转发流量"""
+    stats = warmup.warmer.stats()
+    if not stats["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming", "service": "commonserv", "warmup": stats})
+    return {"status": "ready", "service": "commonserv", "warmup": stats}
+
+
+def _dumps(content: Any) -> bytes:
+    """序列化 JSON 响应体，安装了 orjson 时使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _token_body(token: str, cached: bool, token_type: str, device: Optional[str]) -> bytes:
+    """序列化 Token 接口的响应体"""
+    data = {"token": token}
+    if device is not None:
+        data["device"] = device
+    data["type"] = token_type
+    data["cached"] = cached
+    return _dumps({"code": 0, "msg": "success", "data": data})
+
+
+async def _load_token(cache_key: str, generate: Callable[[], str], track: bool = True) -> Tuple[str, bool]:
+    """
+    缓存未命中时生成 Token 并写入缓存
+
+    签名在线程池中执行，生成期间事件循环继续处理请求，同一缓存键的并发未命中只生成一次，
+    其余请求等待同一个结果
+
+    参数:
+        cache_key: 缓存键
+        generate: Token 生成函数
+        track: 是否由后台任务提前刷新；调用方传入密钥的自定义 Token 不跟踪，
+               服务端不保留其密钥，过期后由下一次请求重新生成
+
+    返回:
+        (Token 字符串, 是否复用了并发请求的结果)
+    """
+    async def load() -> str:
+        # 生成新 Token 并存入缓存（回到事件循环线程写入），由后台任务在过期前刷新
+        token = await asyncio.to_thread(generate)
+        token_cache.cache.set(cache_key, token)
+        if track:
+            token_refresher.refresher.track(cache_key, generate)
+        return token
+
+    return await single_flight.flights.do(cache_key, load)
+
+
+def _check_method(method: str) -> None:
+    """校验签名方法，不支持时返回 400"""
+    try:
+        signer.check_method(method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _token_etag(token: str) -> str:
+    """根据 Token 计算弱 ETag（响应中的 cached 字段可能不同，内容语义相同）"""
+    return f'W/"{hashlib.blake2b(token.encode("utf-8"), digest_size=12).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """按弱比较判断 If-None-Match 是否包含 etag"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def _cache_headers(token: str) -> dict:
+    """
+    生成 Token 响应的缓存头
+
+    max-age 取缓存条目的剩余有效期（Token 的 et 减去缓存安全余量），
+    客户端和代理在服务端刷新 Token 之前可以直接复用响应
+    """
+    cache = token_cache.cache
+    now = time.time()
+    expire_at = token_cache.compute_expire_at(token, now, cache.margin_seconds, cache.margin_ratio,
+                                              cache.expire_days * 24 * 3600)
+    return {
+        "ETag": _token_etag(token),
+        "Cache-Control": f"max-age={max(int(expire_at - now), 0)}"
+    }
+
+
+async def _token_response(cache_key: str, generate: Callable[[], str], token_type: str,
+                          device: Optional[str] = None, refresh: bool = False,
+                          if_none_match: Optional[str] = None, track: bool = True) -> Response:
+    """
+    获取 Token 并返回 JSON 响应
+
+    缓存命中时直接返回与 Token 一起缓存的预序列化响应体，不再构建字典和编码 JSON；
+    未命中时生成 Token 并用 orjson 序列化。响应带 ETag 和 Cache-Control，
+    If-None-Match 与当前 Token 匹配时返回 304
+
+    参数:
+        cache_key: 缓存键
+        generate: 缓存未命中时调用的 Token 生成函数
+        token_type: 响应中的 type 字段（product 或 device）
+        device: 响应中的 device 字段，产品 Token 为 None
+        refresh: 是否强制刷新缓存
+        if_none_match: 请求的 If-None-Match 头
+        track: 是否由后台任务提前刷新（见 _load_token）
+
+    返回:
+        JSON 响应或 304 响应
+    """
+    # 如果强制刷新，删除缓存
+    if refresh:
+        token_cache.cache.refresh(cache_key)
+
+    variant = device or ""
+    token, body = token_cache.cache.get_response(cache_key, variant)
+    if token is None:
+        token, shared = await _load_token(cache_key, generate, track)
+        body = _token_body(token, shared, token_type, device)
+    elif body is None:
+        body = _token_body(token, True, token_type, device)
+        token_cache.cache.set_response(cache_key, token, variant, body)
+
+    headers = _cache_headers(token)
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
 @app.get("/mqtt/onenet/v1/token/product")
-async def get_product_token(product_id: str = None, access_key: str = None, expire_hours: int = None):
+async def get_product_token(product_id: str = None, access_key: str = None, expire_hours: int = None,
+                            method: str = Query(signer.TOKEN_METHOD, description="签名方法: sha1、sha256 或 md5"),
+                            refresh: bool = Query(False, description="强制刷新缓存"),
+                            if_none_match: Optional[str] = Header(None)):
     """
     获取产品级 Token
 
@@ -67,57 +252,177 @@ async def get_product_token(product_id: str = None, access_key: str = None, expi
         product_id: 产品 ID，不传则使用配置文件中的默认值
         access_key: 访问密钥（Base64 编码），不传则使用配置文件中的默认值
         expire_hours: Token 有效期（小时），默认 720 小时（30天）
+        method: 签名方法，仅对传入的 product_id/access_key 生效，配置产品使用其配置的方法
+        refresh: 是否强制刷新缓存，默认 False
+
+    请求头:
+        If-None-Match: 与当前 Token 的 ETag 匹配时返回 304
     """
     try:
+        if expire_hours is None:
+            expire_hours = 720
+
         # 如果传入了参数，使用传入的参数生成 Token
         if product_id and access_key:
-            from mqtt import onenet_token_custom
-            if expire_hours is None:
-                expire_hours = 720
-            token = onenet_token_custom.generate_product_token_custom(product_id, access_key, expire_hours)
-        else:
-            # 使用配置文件中的默认值
-            token = onenet_token.generate_product_token(expire_hours if expire_hours else 720)
-
-        return {
-            "code": 0,
-            "msg": "success",
-            "data": {
-                "token": token,
-                "type": "product"
-            }
-        }
+            _check_method(method)
+            return await _token_response(
+                onenet_token_custom.product_cache_key_custom(product_id, access_key, expire_hours, method),
+                lambda: onenet_token_custom.generate_product_token_custom(product_id, access_key, expire_hours, method),
+                "product",
+                refresh=refresh,
+                if_none_match=if_none_match,
+                track=False
+            )
+
+        # 使用配置文件中的默认值
+        return await _token_response(
+            onenet_token.product_cache_key(expire_hours),
+            lambda: onenet_token.generate_product_token(expire_hours),
+            "product",
+            refresh=refresh,
+            if_none_match=if_none_match
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/mqtt/onenet/v1/token/device/{device_name}")
-async def get_device_token(device_name: str):
+async def get_device_token(device_name: str, refresh: bool = Query(False, description="强制刷新缓存"),
+                           if_none_match: Optional[str] = Header(None)):
     """
     获取指定设备的 Token
 
     参数:
         device_name: 设备名称（如 mo, mo1, MO, MO1）
+        refresh: 是否强制刷新缓存，默认 False
+
+    请求头:
+        If-None-Match: 与当前 Token 的 ETag 匹配时返回 304
+    """
+    try:
+        return await _token_response(
+            onenet_token.device_cache_key(device_name),
+            lambda: onenet_token.generate_device_token(device_name),
+            "device",
+            device_name,
+            refresh,
+            if_none_match
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class CustomDeviceItem(BaseModel):
+    """自定义参数设备"""
+    product_id: str
+    device_id: str
+    access_key: str
+    method: str = signer.TOKEN_METHOD
+
+
+class BatchDeviceTokenRequest(BaseModel):
+    """批量设备 Token 请求"""
+    devices: List[str] = Field(default_factory=list, max_length=BATCH_MAX_ITEMS)
+    custom: List[CustomDeviceItem] = Field(default_factory=list, max_length=BATCH_MAX_ITEMS)
+    expire_hours: Optional[int] = None
+
+
+@app.post("/mqtt/onenet/v1/token/device/batch")
+async def get_device_tokens_batch(request: BatchDeviceTokenRequest):
     """
+    批量获取设备 Token
+
+    请求体:
+        devices: 已配置的设备名称列表（如 ["MO", "MO1"]）
+        custom: 自定义参数设备列表，每项包含 product_id、device_id、access_key，可选 method（默认 sha1）
+        expire_hours: Token 有效期（小时），可选，默认 720 小时
+
+    单个设备失败时在对应结果项中返回 error，不影响整批请求
+    """
+    if len(request.devices) + len(request.custom) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {BATCH_MAX_ITEMS} 个设备")
+
     try:
-        token = onenet_token.generate_device_token(device_name)
+        expire_hours = request.expire_hours if request.expire_hours else 720
+        results = onenet_token.generate_device_tokens(request.devices, expire_hours)
+        results.extend(onenet_token_custom.generate_device_tokens_custom(
+            [(item.product_id, item.device_id, item.access_key, item.method) for item in request.custom],
+            expire_hours
+        ))
+        failed = sum(1 for result in results if "error" in result)
         return {
             "code": 0,
             "msg": "success",
             "data": {
-                "token": token,
-                "device": device_name,
+                "results": results,
+                "count": len(results),
+                "failed": failed,
                 "type": "device"
             }
         }
-    except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class VerifyTokenRequest(BaseModel):
+    """Token 校验请求"""
+    token: str
+    access_key: Optional[str] = None
+
+
+class BatchVerifyTokenRequest(BaseModel):
+    """批量 Token 校验请求"""
+    tokens: List[str] = Field(max_length=BATCH_MAX_ITEMS)
+    access_key: Optional[str] = None
+
+
+@app.post("/mqtt/onenet/v1/token/verify")
+async def verify_token(request: VerifyTokenRequest):
+    """
+    校验 Token
+
+    请求体:
+        token: Token 字符串
+        access_key: 访问密钥（Base64 编码），可选，不传则按 res 使用已配置产品的密钥
+    """
+    return {
+        "code": 0,
+        "msg": "success",
+        "data": token_verifier.verifier.verify(request.token, request.access_key)
+    }
+
+
+@app.post("/mqtt/onenet/v1/token/verify/batch")
+async def verify_tokens_batch(request: BatchVerifyTokenRequest):
+    """
+    批量校验 Token
+
+    请求体:
+        tokens: Token 字符串列表
+        access_key: 访问密钥（Base64 编码），可选，不传则按 res 使用已配置产品的密钥
+    """
+    verify = token_verifier.verifier.verify
+    results = [verify(token, request.access_key) for token in request.tokens]
+    return {
+        "code": 0,
+        "msg": "success",
+        "data": {
+            "results": results,
+            "count": len(results),
+            "valid": sum(1 for result in results if result["valid"])
+        }
+    }
+
+
 @app.get("/mqtt/onenet/v1/token/custom/device")
-async def get_device_token_custom(product_id: str, device_id: str, access_key: str, expire_hours: int = None):
+async def get_device_token_custom(product_id: str, device_id: str, access_key: str, expire_hours: int = None,
+                                  method: str = Query(signer.TOKEN_METHOD, description="签名方法: sha1、sha256 或 md5"),
+                                  refresh: bool = Query(False, description="强制刷新缓存"),
+                                  if_none_match: Optional[str] = Header(None)):
     """
     自定义参数生成设备级 Token
 
@@ -126,156 +431,296 @@ async def get_device_token_custom(product_id: str, device_id: str, access_key: s
         device_id: 设备 ID
         access_key: 访问密钥（Base64 编码）
         expire_hours: Token 有效期（小时），可选，默认 720 小时
+        method: 签名方法，可选，默认 sha1
+        refresh: 是否强制刷新缓存，默认 False
+
+    请求头:
+        If-None-Match: 与当前 Token 的 ETag 匹配时返回 304
     """
+    _check_method(method)
     try:
         if expire_hours is None:
             expire_hours = 720
-        token = onenet_token_custom.generate_device_token_custom(product_id, device_id, access_key, expire_hours)
-        return {
-            "code": 0,
-            "msg": "success",
-            "data": {
-                "token": token,
-                "device": device_id,
-                "type": "device"
-            }
-        }
+        return await _token_response(
+            onenet_token_custom.device_cache_key_custom(product_id, device_id, access_key, expire_hours, method),
+            lambda: onenet_token_custom.generate_device_token_custom(product_id, device_id, access_key, expire_hours,
+                                                                     method),
+            "device",
+            device_id,
+            refresh,
+            if_none_match,
+            track=False
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/mqtt/onenet/v1/device/MO")
-@app.get("/mqtt/onenet/v1/device/mo")
-async def get_mo_token(refresh: bool = Query(False, description="强制刷新缓存")):
+class RequestStreamingResponse(StreamingResponse):
+    """
+    边读请求体边输出的流式响应
+
+    StreamingResponse 会并发监听 receive() 上的断开消息，与 request.stream()
+    争抢请求体；这里只发送响应，客户端断开由 request.stream() 抛出 ClientDisconnect
     """
-    获取 MO 设备的 Token（固定接口）
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+@app.post("/mqtt/onenet/v1/token/custom/device/bulk")
+async def get_device_tokens_bulk(request: Request, product_id: str, access_key: str, expire_hours: int = None,
+                                 format: str = Query(None, description="请求体格式: ndjson 或 csv"),
+                                 method: str = Query(signer.TOKEN_METHOD, description="签名方法: sha1、sha256 或 md5")):
+    """
+    流式批量生成设备级 Token（用于工厂预置）
 
     参数:
-        refresh: 是否强制刷新缓存，默认 False
+        product_id: 产品 ID
+        access_key: 访问密钥（Base64 编码）
+        expire_hours: Token 有效期（小时），可选，默认 720 小时
+        format: 请求体格式，不传时根据 Content-Type 判断（text/csv 为 csv，其余为 ndjson）
+        method: 签名方法，可选，默认 sha1
+
+    请求体:
+        ndjson: 每行一个 {"device_id": "..."} 或 JSON 字符串
+        csv: 每行第一列为设备 ID，可带 device_id 表头
+
+    返回:
+        application/x-ndjson，每行 {"device": ..., "token": ...}，无效行为 {"line": ..., "error": ...}
     """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format 仅支持 ndjson 或 csv")
+    _check_method(method)
+
     try:
-        cache_key = "device_MO"
-
-        # 如果强制刷新，删除缓存
-        if refresh:
-            token_cache.cache.refresh(cache_key)
-
-        # 尝试从缓存获取
-        cached_token = token_cache.cache.get(cache_key)
-        if cached_token:
-            return {
-                "code": 0,
-                "msg": "success",
-                "data": {
-                    "token": cached_token,
-                    "device": "MO",
-                    "type": "device",
-                    "cached": True
-                }
-            }
+        signer.registry.get(access_key, method)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"access_key 无效: {e}")
 
-        # 缓存未命中，生成新 Token
-        token = onenet_token.generate_device_token("MO")
-        # 存入缓存
-        token_cache.cache.set(cache_key, token)
+    if expire_hours is None:
+        expire_hours = 720
+    expire_time = signer.compute_expire_time(expire_hours)
 
-        return {
-            "code": 0,
-            "msg": "success",
-            "data": {
-                "token": token,
-                "device": "MO",
-                "type": "device",
-                "cached": False
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return RequestStreamingResponse(
+        bulk.stream_tokens(request.stream(), format, product_id, access_key, expire_time, method),
+        media_type="application/x-ndjson"
+    )
 
 
-@app.get("/mqtt/onenet/v1/device/MO1")
-@app.get("/mqtt/onenet/v1/device/mo1")
-async def get_mo1_token(refresh: bool = Query(False, description="强制刷新缓存")):
+@app.get("/mqtt/onenet/v1/device/{device_name}")
+async def get_cached_device_token(device_name: str, refresh: bool = Query(False, description="强制刷新缓存"),
+                                  if_none_match: Optional[str] = Header(None)):
     """
-    获取 MO1 设备的 Token（固定接口）
+    获取已配置设备的 Token（带缓存，/device/MO、/device/mo1 等原固定接口均由此路由处理）
 
     参数:
+        device_name: 设备名称（不区分大小写）
         refresh: 是否强制刷新缓存，默认 False
-    """
-    try:
-        cache_key = "device_MO1"
-
-        # 如果强制刷新，删除缓存
-        if refresh:
-            token_cache.cache.refresh(cache_key)
-
-        # 尝试从缓存获取
-        cached_token = token_cache.cache.get(cache_key)
-        if cached_token:
-            return {
-                "code": 0,
-                "msg": "success",
-                "data": {
-                    "token": cached_token,
-                    "device": "MO1",
-                    "type": "device",
-                    "cached": True
-                }
-            }
 
-        # 缓存未命中，生成新 Token
-        token = onenet_token.generate_device_token("MO1")
-        # 存入缓存
-        token_cache.cache.set(cache_key, token)
+    请求头:
+        If-None-Match: 与当前 Token 的 ETag 匹配时返回 304
+    """
+    device = device_registry.registry.get_device(device_name)
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"设备 '{device_name}' 不存在")
 
-        return {
-            "code": 0,
-            "msg": "success",
-            "data": {
-                "token": token,
-                "device": "MO1",
-                "type": "device",
-                "cached": False
-            }
-        }
+    try:
+        return await _token_response(
+            onenet_token.device_cache_key(device.name),
+            lambda: onenet_token.generate_device_token(device.name),
+            "device",
+            device.name,
+            refresh,
+            if_none_match
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _encode_cursor(name: str) -> str:
+    """将设备名称编码为不透明的分页游标"""
+    return base64.urlsafe_b64encode(name.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> str:
+    """解码分页游标，不是合法的 URL 安全 Base64 或解码结果为空时返回 400"""
+    try:
+        value = base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except ValueError:
+        value = ""
+    if not value:
+        raise HTTPException(status_code=400, detail="cursor 无效")
+    return value
+
+
 @app.get("/mqtt/onenet/v1/devices")
-async def list_devices():
-    """列出所有已配置的设备"""
-    from mqtt.config import get_all_device_names
-    devices = get_all_device_names()
+async def list_devices(
+    limit: int = Query(100, ge=1, le=DEVICE_PAGE_MAX, description="每页数量"),
+    cursor: str = Query(None, description="上一页返回的 next_cursor"),
+    prefix: str = Query("", description="设备名称前缀（不区分大小写）"),
+    product_id: str = Query(None, description="产品 ID，不传则使用默认产品"),
+    format: str = Query("json", description="json 分页返回，ndjson 流式返回从 cursor 开始的所有设备")
+):
+    """
+    分页列出已配置的设备
+
+    参数:
+        limit: 每页数量，默认 100
+        cursor: 分页游标
+        prefix: 设备名称前缀过滤
+        product_id: 产品 ID
+        format: json 或 ndjson
+    """
+    index = device_registry.registry.index
+    if product_id and product_id not in index.products:
+        raise HTTPException(status_code=404, detail=f"产品 '{product_id}' 不存在")
+    after = _decode_cursor(cursor) if cursor else None
+
+    if format == "ndjson":
+        def stream():
+            # 每次 yield 一批行，StreamingResponse 对同步迭代器的每次取值都要切换一次线程池
+            lines = []
+            for record in index.iter_range(product_id, prefix, after):
+                lines.append(json.dumps({
+                    "device": record.name,
+                    "device_id": record.device_id,
+                    "product_id": record.product_id
+                }, ensure_ascii=False) + "\n")
+                if len(lines) >= DEVICE_STREAM_BATCH:
+                    yield "".join(lines)
+                    lines = []
+            if lines:
+                yield "".join(lines)
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format 仅支持 json 或 ndjson")
+
+    records, next_name = index.page(product_id, prefix, after, limit)
     return {
         "code": 0,
         "msg": "success",
         "data": {
-            "devices": devices,
-            "count": len(devices)
+            "devices": [record.name for record in records],
+            "count": len(records),
+            "total": index.count_prefix(product_id, prefix),
+            "next_cursor": _encode_cursor(next_name) if next_name else None
         }
     }
 
 
 @app.get("/mqtt/onenet/v1/cache")
-async def get_cache_info():
-    """获取缓存信息"""
-    cache_info = token_cache.cache.get_all()
+async def get_cache_info(
+    limit: int = Query(100, ge=1, le=CACHE_PAGE_MAX, description="每页数量"),
+    cursor: str = Query(None, description="上一页返回的 next_cursor"),
+    prefix: str = Query("", description="缓存键前缀，如资源名 products/{pid}/devices/{name}"),
+    stats_only: bool = Query(False, description="只返回统计信息，不列出条目")
+):
+    """
+    获取缓存统计信息并分页列出未过期的条目（不含 Token）
+
+    每次调用最多检查固定数量的槽位，耗时与缓存规模无关；前缀匹配较少时可能返回空页，
+    只要 next_cursor 不为空就继续请求。过期时间分布按采样估算
+
+    参数:
+        limit: 每页数量，默认 100
+        cursor: 分页游标
+        prefix: 缓存键前缀过滤
+        stats_only: 是否只返回统计信息
+    """
+    cache = token_cache.cache
+    data = {
+        "expire_days": cache.expire_days,
+        "stats": cache.stats(),
+        "expiry": cache.expiry_distribution(),
+        "refresher": token_refresher.refresher.stats(),
+        "single_flight": single_flight.flights.stats()
+    }
+    if not stats_only:
+        start = 0
+        if cursor:
+            try:
+                start = int(_decode_cursor(cursor))
+            except ValueError:
+                start = -1
+            if start < 0:
+                raise HTTPException(status_code=400, detail="cursor 无效")
+        entries, next_cursor = cache.scan(start, limit, prefix)
+        data.update({
+            "entries": entries,
+            "count": len(entries),
+            "next_cursor": _encode_cursor(str(next_cursor)) if next_cursor is not None else None
+        })
+    return {"code": 0, "msg": "success", "data": data}
+
+
+@app.get("/mqtt/onenet/v1/signer")
+async def get_signer_info():
+    """获取签名器和 Token 校验缓存命中率"""
     return {
         "code": 0,
         "msg": "success",
         "data": {
-            "cache": cache_info,
-            "expire_days": 29,
-            "count": len(cache_info)
+            **signer.registry.stats(),
+            "verifier": token_verifier.verifier.stats()
         }
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 文本格式的监控指标"""
+    cache_stats = token_cache.cache.stats()
+    signer_stats = signer.registry.stats()
+    verifier_stats = token_verifier.verifier.stats()
+    refresher_stats = token_refresher.refresher.stats()
+    flight_stats = single_flight.flights.stats()
+
+    lines = metrics.http_requests.render()
+    lines += metrics.render_histogram("commonserv_token_sign_seconds", "Token 签名耗时",
+                                      [({}, metrics.sign_seconds)])
+    for name, key, help_text in (
+        ("commonserv_token_cache_hits_total", "hits", "Token 缓存命中数"),
+        ("commonserv_token_cache_misses_total", "misses", "Token 缓存未命中数"),
+        ("commonserv_token_cache_evictions_total", "evictions", "Token 缓存淘汰数"),
+    ):
+        lines += metrics.render_samples(name, "counter", help_text, [({}, cache_stats[key])])
+    lines += metrics.render_samples("commonserv_token_cache_entries", "gauge", "Token 缓存条目数",
+                                    [({}, cache_stats["count"])])
+    lines += metrics.render_samples("commonserv_token_cache_bytes", "gauge", "Token 缓存近似内存占用（字节）",
+                                    [({}, cache_stats["bytes"])])
+    lines += metrics.render_samples("commonserv_signer_cache_hits_total", "counter", "签名器缓存命中数",
+                                    [({}, signer_stats["hits"])])
+    lines += metrics.render_samples("commonserv_signer_cache_misses_total", "counter", "签名器缓存未命中数",
+                                    [({}, signer_stats["misses"])])
+    lines += metrics.render_samples("commonserv_verifier_cache_hits_total", "counter", "Token 校验缓存命中数",
+                                    [({}, verifier_stats["hits"])])
+    lines += metrics.render_samples("commonserv_verifier_cache_misses_total", "counter", "Token 校验缓存未命中数",
+                                    [({}, verifier_stats["misses"])])
+    lines += metrics.render_samples("commonserv_refresher_tracked", "gauge", "提前刷新跟踪的缓存键数",
+                                    [({}, refresher_stats["tracked"])])
+    lines += metrics.render_samples("commonserv_refresher_refreshed_total", "counter", "提前刷新成功次数",
+                                    [({}, refresher_stats["refreshed"])])
+    lines += metrics.render_samples("commonserv_refresher_failures_total", "counter", "提前刷新失败次数",
+                                    [({}, refresher_stats["failures"])])
+    lines += metrics.render_samples("commonserv_single_flight_coalesced_total", "counter", "合并的并发未命中数",
+                                    [({}, flight_stats["coalesced"])])
+    lines += metrics.render_samples("commonserv_device_registry_devices", "gauge", "设备注册表设备数",
+                                    [({}, device_registry.registry.index.count)])
+    lines += admission.controller.render()
+    lines.append("")
+    return PlainTextResponse("\n".join(lines), media_type="text/plain; version=0.0.4")
+
+
 @app.delete("/mqtt/onenet/v1/cache")
 async def clear_cache():
     """清空所有缓存"""
     token_cache.cache.clear()
+    token_refresher.refresher.clear()
+    token_verifier.verifier.clear()
     return {
         "code": 0,
         "msg": "success",
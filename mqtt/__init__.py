@@ -10,5 +10,14 @@ from mqtt import onenet_token
 from mqtt import onenet_token_custom
 from mqtt import config
 from mqtt import token_cache
+from mqtt import signer
+from mqtt import token_refresher
+from mqtt import single_flight
+from mqtt import bulk
+from mqtt import device_registry
+from mqtt import token_verifier
+from mqtt import metrics
+from mqtt import warmup
+from mqtt import admission
 
-__all__ = ["onenet_token", "onenet_token_custom", "config", "token_cache"]
+__all__ = ["onenet_token", "onenet_token_custom", "config", "token_cache", "signer", "token_refresher", "single_flight", "bulk", "device_registry", "token_verifier", "metrics", "warmup", "admission"]
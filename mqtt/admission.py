@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+准入控制模块
+按路由类别限制并发请求数，超出时立即返回 503 和 Retry-After；
+同步处理的路由在事件循环中几乎不重叠，过载时请求排在事件循环而不是并发数上，
+因此同时采样事件循环延迟，超过该类路由的容忍值时收紧并发上限并按比例随机拒绝新请求；
+可选按客户端令牌桶限速（超出返回 429）。重连风暴时让客户端快速重试而不是在队列中等待数秒
+
+健康检查、就绪检查和监控接口不受限制
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from mqtt.config import get_admission_config
+from mqtt.metrics import render_samples
+
+# 路由类别规则: (路径前缀, 类别)，按顺序匹配第一条
+ROUTE_CLASSES = (
+    ("/mqtt/onenet/v1/token/custom/device/bulk", "bulk"),
+    ("/mqtt/onenet/v1/token/custom/", "custom"),
+    ("/mqtt/onenet/v1/token/device/batch", "custom"),
+    ("/mqtt/onenet/v1/token/verify", "custom"),
+    ("/mqtt/onenet/v1/token/", "cached"),
+    ("/mqtt/onenet/v1/device/", "cached"),
+)
+
+# 不受准入控制的路径
+EXEMPT_PATHS = frozenset(("/", "/health", "/ready", "/metrics"))
+
+
+def route_class(path: str) -> Optional[str]:
+    """
+    获取请求路径所属的路由类别
+
+    参数:
+        path: 请求路径
+
+    返回:
+        类别名称，不受限制的路径返回 None
+    """
+    if path in EXEMPT_PATHS:
+        return None
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return "default"
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, rate: float, capacity: float, now: float) -> float:
+        """
+        取一个令牌
+
+        参数:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量
+            now: 当前单调时间
+
+        返回:
+            0 表示成功，否则为需要等待的秒数
+        """
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class AdmissionController:
+    """并发上限、事件循环延迟和客户端限速的状态"""
+
+    def __init__(self, enabled: bool = True, limits: Optional[Dict[str, int]] = None,
+                 max_loop_lag: Union[float, Dict[str, float]] = 0.1, lag_interval: float = 0.05, retry_after: int = 1,
+                 client_rate: float = 0, client_burst: int = 50, client_header: str = "x-client-id",
+                 max_clients: int = 10000):
+        """
+        初始化准入控制
+
+        参数:
+            enabled: 是否启用
+            limits: 路由类别 -> 最大并发请求数，未列出的类别使用 default
+            max_loop_lag: 事件循环延迟容忍值（秒），可按路由类别分别设置（未列出的类别使用 default）；
+                          延迟超过容忍值时并发上限乘以 容忍值 / 当前延迟，并以 1 - 容忍值 / 当前延迟 的概率拒绝新请求
+            lag_interval: 事件循环延迟采样间隔（秒）
+            retry_after: 过载拒绝时的 Retry-After（秒）
+            client_rate: 每个客户端每秒请求数，0 表示不限速
+            client_burst: 每个客户端的令牌桶容量
+            client_header: 识别客户端的请求头，没有时按来源 IP
+            max_clients: 最多跟踪的客户端数
+        """
+        self.enabled = enabled
+        self.limits = dict(limits or {})
+        self.limits.setdefault("default", 256)
+        if not isinstance(max_loop_lag, dict):
+            max_loop_lag = {"default": max_loop_lag}
+        self.max_loop_lag = dict(max_loop_lag)
+        self.max_loop_lag.setdefault("default", 0.1)
+        self.lag_interval = lag_interval
+        self.retry_after = retry_after
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.client_header = client_header.lower().encode("latin-1")
+        self.max_clients = max_clients
+
+        self.in_flight: Dict[str, int] = {name: 0 for name in self.limits}
+        self.admitted: Dict[str, int] = {name: 0 for name in self.limits}
+        # (类别, 原因) -> 拒绝次数，原因: concurrency、loop_lag、rate_limit
+        self.rejected: Dict[Tuple[str, str], int] = {}
+        self.loop_lag = 0.0
+        self.max_observed_lag = 0.0
+        self._clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """在当前事件循环中启动延迟采样任务"""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._monitor())
+
+    async def stop(self) -> None:
+        """停止延迟采样任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _monitor(self) -> None:
+        """
+        定期测量 sleep 的实际唤醒延迟，即就绪回调在事件循环中的排队时间；
+        取新样本与衰减后旧值的较大者，短暂的尖峰会持续影响几个采样周期
+        """
+        loop = asyncio.get_running_loop()
+        interval = self.lag_interval
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.loop_lag = max(lag, self.loop_lag * 0.5)
+            self.max_observed_lag = max(self.max_observed_lag, lag)
+
+    def limit(self, name: str) -> int:
+        """
+        获取路由类别当前的并发上限
+
+        参数:
+            name: 路由类别
+
+        返回:
+            并发上限，事件循环延迟超过阈值时按比例缩小，至少为 1
+        """
+        limit = self.limits.get(name) or self.limits["default"]
+        max_lag = self.max_loop_lag.get(name) or self.max_loop_lag["default"]
+        if self.loop_lag > max_lag:
+            limit = max(1, int(limit * max_lag / self.loop_lag))
+        return limit
+
+    def admit(self, name: str, client: Optional[str]) -> Optional[Tuple[int, str, int]]:
+        """
+        判断是否接收请求，接收时计入并发数（完成后必须调用 release）
+
+        参数:
+            name: 路由类别
+            client: 客户端标识，None 表示不限速
+
+        返回:
+            None 表示接收，否则为 (状态码, 拒绝原因, Retry-After 秒数)
+        """
+        in_flight = self.in_flight.get(name, 0)
+        if in_flight >= self.limit(name):
+            reason = "loop_lag" if in_flight < (self.limits.get(name) or self.limits["default"]) else "concurrency"
+            return self._reject(name, reason, 503, self.retry_after)
+
+        lag = self.loop_lag
+        max_lag = self.max_loop_lag.get(name) or self.max_loop_lag["default"]
+        if lag > max_lag and random.random() >= max_lag / lag:
+            return self._reject(name, "loop_lag", 503, self.retry_after)
+
+        if client is not None and self.client_rate > 0:
+            wait = self._bucket(client).take(self.client_rate, self.client_burst, time.monotonic())
+            if wait:
+                return self._reject(name, "rate_limit", 429, max(1, math.ceil(wait)))
+
+        self.in_flight[name] = in_flight + 1
+        self.admitted[name] = self.admitted.get(name, 0) + 1
+        return None
+
+    def release(self, name: str) -> None:
+        """请求完成，释放并发数"""
+        self.in_flight[name] -= 1
+
+    def client_id(self, scope: Dict[str, Any]) -> Optional[str]:
+        """
+        获取请求的客户端标识
+
+        参数:
+            scope: ASGI scope
+
+        返回:
+            client_header 请求头的值，没有时为来源 IP；未启用限速时返回 None
+        """
+        if self.client_rate <= 0:
+            return None
+        for name, value in scope.get("headers", ()):
+            if name == self.client_header:
+                return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def stats(self) -> Dict[str, Any]:
+        """获取准入控制统计"""
+        return {
+            "enabled": self.enabled,
+            "loop_lag": round(self.loop_lag, 6),
+            "max_observed_lag": round(self.max_observed_lag, 6),
+            "classes": {
+                name: {
+                    "limit": self.limits.get(name) or self.limits["default"],
+                    "effective_limit": self.limit(name),
+                    "in_flight": self.in_flight.get(name, 0),
+                    "admitted": self.admitted.get(name, 0),
+                    "rejected": {reason: count for (cls, reason), count in self.rejected.items() if cls == name}
+                }
+                for name in sorted(set(self.limits) | set(self.in_flight))
+            },
+            "clients": len(self._clients)
+        }
+
+    def render(self) -> List[str]:
+        """输出准入控制指标的 Prometheus 文本行"""
+        names = sorted(set(self.limits) | set(self.in_flight))
+        lines = render_samples(
+            "commonserv_admission_in_flight", "gauge", "各路由类别正在处理的请求数",
+            [({"class": name}, self.in_flight.get(name, 0)) for name in names]
+        )
+        lines += render_samples(
+            "commonserv_admission_limit", "gauge", "各路由类别当前的并发上限（含事件循环延迟收紧）",
+            [({"class": name}, self.limit(name)) for name in names]
+        )
+        lines += render_samples(
+            "commonserv_admission_rejected_total", "counter", "准入控制拒绝的请求数",
+            [({"class": name, "reason": reason}, count) for (name, reason), count in sorted(self.rejected.items())]
+        )
+        lines += render_samples(
+            "commonserv_event_loop_lag_seconds", "gauge", "事件循环调度延迟（衰减最大值）", [({}, self.loop_lag)]
+        )
+        return lines
+
+    def _reject(self, name: str, reason: str, status: int, retry_after: int) -> Tuple[int, str, int]:
+        """记录拒绝并返回 (状态码, 原因, Retry-After)"""
+        key = (name, reason)
+        self.rejected[key] = self.rejected.get(key, 0) + 1
+        return status, reason, retry_after
+
+    def _bucket(self, client: str) -> TokenBucket:
+        """获取客户端的令牌桶，超出 max_clients 时淘汰最久未出现的客户端"""
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = self._clients[client] = TokenBucket(self.client_burst, time.monotonic())
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return bucket
+
+
+# 创建全局准入控制
+controller = AdmissionController(**get_admission_config())
+
+# 拒绝原因对应的错误信息
+_MESSAGES = {
+    "concurrency": "服务繁忙，请稍后重试",
+    "loop_lag": "服务繁忙，请稍后重试",
+    "rate_limit": "请求过于频繁，请稍后重试"
+}
+
+
+class AdmissionMiddleware:
+    """
+    纯 ASGI 准入控制中间件
+
+    在路由和请求体解析之前判断，拒绝的请求不读取请求体、不进入业务代码；
+    错误响应格式与 HTTPException 一致（{"detail": ...}）
+    """
+
+    def __init__(self, app, admission: Optional[AdmissionController] = None):
+        """
+        初始化中间件
+
+        参数:
+            app: 下游 ASGI 应用
+            admission: 准入控制状态，默认使用全局 controller
+        """
+        self.app = app
+        self.controller = admission or controller
+
+    async def __call__(self, scope, receive, send) -> None:
+        controller = self.controller
+        if scope["type"] != "http" or not controller.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = controller.admit(name, controller.client_id(scope))
+        if rejection is not None:
+            status, reason, retry_after = rejection
+            body = json.dumps({"detail": _MESSAGES[reason]}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("ascii")),
+                    (b"retry-after", str(retry_after).encode("ascii")),
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(name)
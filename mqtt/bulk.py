@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量 Token 生成模块
+流式读取设备 ID，按块分发到进程池签名，并按输入顺序流式输出 NDJSON
+"""
+
+import asyncio
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from mqtt.signer import TOKEN_METHOD, registry
+
+# 每个签名任务处理的设备数
+CHUNK_SIZE = 1000
+
+# 单行输入的最大字节数，超出的行输出错误且不缓存其内容
+MAX_LINE_BYTES = 4096
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """获取签名进程池（首次调用时创建，进程数与 CPU 核数一致）"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    """关闭签名进程池"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def sign_chunk(product_id: str, access_key: str, expire_time: int, items: List[Tuple[int, Optional[str], str]],
+               method: str = TOKEN_METHOD) -> bytes:
+    """
+    在工作进程中为一块设备生成 Token
+
+    参数:
+        product_id: 产品 ID
+        access_key: 访问密钥（Base64 编码）
+        expire_time: 过期时间戳（秒），整个批量请求共用
+        items: (行号, 设备 ID, 解析错误) 列表，设备 ID 为 None 时输出错误
+        method: 签名方法（sha1、sha256 或 md5）
+
+    返回:
+        NDJSON 编码的结果（每个设备一行）
+    """
+    prefix = f"products/{product_id}/devices/"
+    tokens = iter(registry.get(access_key, method).sign_many(
+        [prefix + device_id for _, device_id, _ in items if device_id is not None], expire_time
+    ))
+    lines = []
+    for line_no, device_id, error in items:
+        if device_id is None:
+            result = {"line": line_no, "error": error}
+        else:
+            result = {"device": device_id, "token": next(tokens)}
+        lines.append(json.dumps(result, ensure_ascii=False, separators=(",", ":")))
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
+
+
+def parse_device_line(line: str, fmt: str) -> str:
+    """
+    解析一行输入中的设备 ID
+
+    参数:
+        line: 去除换行后的文本行
+        fmt: ndjson 或 csv
+
+    返回:
+        设备 ID
+
+    异常:
+        ValueError: 行格式无效时抛出
+    """
+    if fmt == "ndjson":
+        value = json.loads(line)
+        if isinstance(value, dict):
+            value = value.get("device_id")
+        if not isinstance(value, str) or not value:
+            raise ValueError("缺少 device_id")
+        return value
+
+    device_id = next(csv.reader([line]))[0].strip()
+    if not device_id:
+        raise ValueError("缺少 device_id")
+    return device_id
+
+
+def _decode_line(line_no: int, raw: bytes) -> Optional[Tuple[int, Optional[str], str]]:
+    """
+    解码一行输入
+
+    返回:
+        (行号, 文本, 错误)，解码失败时文本为 None；空行返回 None
+    """
+    try:
+        text = raw.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        return line_no, None, f"第 {line_no} 行无效: 不是有效的 UTF-8"
+    return (line_no, text, "") if text else None
+
+
+async def iter_lines(stream: AsyncIterator[bytes],
+                     max_line: int = MAX_LINE_BYTES) -> AsyncIterator[Tuple[int, Optional[str], str]]:
+    """
+    将字节流切分为文本行，只保留当前未结束的一行在内存中（不超过 max_line 字节）
+
+    参数:
+        stream: 请求体字节流
+        max_line: 单行最大字节数
+
+    返回:
+        (行号, 文本, 错误) 异步迭代器；行号按原始行计数（含空行），空行不输出，
+        无法解码或超长的行文本为 None 并带错误信息
+    """
+    buffer = bytearray()
+    too_long = False
+    line_no = 0
+    async for data in stream:
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            line_no += 1
+            if too_long or len(buffer) + end - start > max_line:
+                yield line_no, None, f"第 {line_no} 行无效: 超过 {max_line} 字节"
+            else:
+                buffer += data[start:end]
+                result = _decode_line(line_no, bytes(buffer))
+                if result is not None:
+                    yield result
+            buffer.clear()
+            too_long = False
+            start = end + 1
+        if not too_long:
+            if len(buffer) + len(data) - start > max_line:
+                too_long = True
+                buffer.clear()
+            else:
+                buffer += data[start:]
+
+    if too_long or buffer:
+        line_no += 1
+        if too_long:
+            yield line_no, None, f"第 {line_no} 行无效: 超过 {max_line} 字节"
+        else:
+            result = _decode_line(line_no, bytes(buffer))
+            if result is not None:
+                yield result
+
+
+async def stream_tokens(stream: AsyncIterator[bytes], fmt: str, product_id: str, access_key: str,
+                        expire_time: int, method: str = TOKEN_METHOD) -> AsyncIterator[bytes]:
+    """
+    流式生成批量 Token
+
+    同时在途的签名任务数受限，内存占用与输入大小无关
+
+    参数:
+        stream: 请求体字节流
+        fmt: ndjson 或 csv
+        product_id: 产品 ID
+        access_key: 访问密钥（Base64 编码）
+        expire_time: 过期时间戳（秒）
+        method: 签名方法
+
+    返回:
+        NDJSON 字节块异步迭代器，顺序与输入一致
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    max_inflight = 2 * (os.cpu_count() or 1)
+    pending: deque = deque()
+    chunk: List[Tuple[int, Optional[str], str]] = []
+    first = True
+
+    async for line_no, line, error in iter_lines(stream):
+        if line is None:
+            chunk.append((line_no, None, error))
+        elif fmt == "csv" and first and line.lower().startswith("device_id"):
+            pass
+        else:
+            try:
+                chunk.append((line_no, parse_device_line(line, fmt), ""))
+            except Exception as e:
+                chunk.append((line_no, None, f"第 {line_no} 行无效: {e}"))
+        first = False
+
+        if len(chunk) >= CHUNK_SIZE:
+            pending.append(loop.run_in_executor(pool, sign_chunk, product_id, access_key, expire_time, chunk, method))
+            chunk = []
+            # 在途任务达到上限时等待最早的任务，形成背压
+            while len(pending) >= max_inflight or (pending and pending[0].done()):
+                yield await pending.popleft()
+
+    if chunk:
+        pending.append(loop.run_in_executor(pool, sign_chunk, product_id, access_key, expire_time, chunk, method))
+    while pending:
+        yield await pending.popleft()
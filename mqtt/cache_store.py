@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token 缓存持久化模块
+基于 SQLite（WAL 模式）保存缓存快照，重启后按需加载
+"""
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteTokenStore:
+    """SQLite Token 持久化存储（异步批量写入，按需读取）"""
+
+    def __init__(self, path: str, flush_interval: float = 0.5, compact_interval: int = 300,
+                 mmap_size: int = 256 * 1024 * 1024):
+        """
+        初始化存储并启动后台写入线程
+
+        参数:
+            path: SQLite 数据库文件路径
+            flush_interval: 批量写入间隔（秒）
+            compact_interval: 清理过期记录并截断 WAL 的间隔（秒）
+            mmap_size: 读连接使用的 mmap 大小（字节）
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+
+        # 待写入的变更：key -> (token, 失效时间)，None 表示删除
+        self._pending: Dict[str, Optional[Tuple[str, float]]] = {}
+        self._clear_pending = False
+        # 正在写入（已从 _pending 取出但尚未提交）的变更
+        self._flushing: Dict[str, Optional[Tuple[str, float]]] = {}
+        self._clear_flushing = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self.loads = 0
+        self.writes = 0
+
+        writer = self._connect()
+        writer.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "key TEXT PRIMARY KEY, token TEXT NOT NULL, expire_at REAL NOT NULL)"
+        )
+        writer.commit()
+
+        self._reader = self._connect()
+        self._reader.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self._reader_lock = threading.Lock()
+
+        self._thread = threading.Thread(
+            target=self._writer_loop, args=(writer,), name="token-cache-store", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def load(self, key: str) -> Optional[Tuple[str, float]]:
+        """
+        读取单个缓存条目（优先返回尚未写入磁盘的变更）
+
+        参数:
+            key: 缓存键
+
+        返回:
+            (token, 失效时间)，不存在或已过期时返回 None
+        """
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if self._clear_pending:
+                return None
+            if key in self._flushing:
+                return self._flushing[key]
+            if self._clear_flushing:
+                return None
+
+        with self._reader_lock:
+            row = self._reader.execute(
+                "SELECT token, expire_at FROM tokens WHERE key = ? AND expire_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        self.loads += 1
+        return row[0], row[1]
+
+    def put(self, key: str, token: str, expire_at: float) -> None:
+        """
+        写入缓存条目（异步批量落盘，不阻塞调用方）
+
+        参数:
+            key: 缓存键
+            token: Token 字符串
+            expire_at: 失效时间戳
+        """
+        with self._lock:
+            self._pending[key] = (token, expire_at)
+
+    def delete(self, key: str) -> None:
+        """
+        删除缓存条目（异步落盘）
+
+        参数:
+            key: 缓存键
+        """
+        with self._lock:
+            self._pending[key] = None
+
+    def clear(self) -> None:
+        """清空所有缓存条目（异步落盘）"""
+        with self._lock:
+            self._pending.clear()
+            self._clear_pending = True
+        self._wakeup.set()
+
+    def close(self) -> None:
+        """写入所有待处理变更并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=10)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "path": self.path,
+            "pending": pending,
+            "loads": self.loads,
+            "writes": self.writes
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        """创建 WAL 模式连接"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _flush(self, conn: sqlite3.Connection) -> None:
+        """将待处理变更批量写入数据库"""
+        with self._lock:
+            if not self._pending and not self._clear_pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            self._clear_flushing, self._clear_pending = self._clear_pending, False
+
+        upserts = [(key, value[0], value[1]) for key, value in self._flushing.items() if value is not None]
+        deletes = [(key,) for key, value in self._flushing.items() if value is None]
+        try:
+            with conn:
+                if self._clear_flushing:
+                    conn.execute("DELETE FROM tokens")
+                if upserts:
+                    conn.executemany("INSERT OR REPLACE INTO tokens (key, token, expire_at) VALUES (?, ?, ?)", upserts)
+                if deletes:
+                    conn.executemany("DELETE FROM tokens WHERE key = ?", deletes)
+            self.writes += len(upserts) + len(deletes)
+        finally:
+            with self._lock:
+                self._flushing = {}
+                self._clear_flushing = False
+
+    def _compact(self, conn: sqlite3.Connection) -> None:
+        """删除过期记录并截断 WAL 文件"""
+        with conn:
+            conn.execute("DELETE FROM tokens WHERE expire_at <= ?", (time.time(),))
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _writer_loop(self, conn: sqlite3.Connection) -> None:
+        """后台写入线程主循环"""
+        next_compact = time.time() + self.compact_interval
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._flush(conn)
+                if time.time() >= next_compact:
+                    self._compact(conn)
+                    next_compact = time.time() + self.compact_interval
+            except Exception:
+                logger.exception("Token 缓存持久化失败")
+            if self._closed:
+                break
+        conn.close()
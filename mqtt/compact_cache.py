@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+紧凑 Token 缓存模块
+面向百万级设备的内存缓存，接口与 TokenCache 一致
+
+每个条目只保存无法重建的部分: 设备序号（资源路径表下标）、key 后缀序号、签名方法、et 和原始签名，
+全部放在按槽位索引的 array/bytearray 中，key 和 Token 字符串在需要时重建；
+缓存键按 make_key 的格式拆成 "{res}" 和 "|{指纹}|{有效期}h[|{方法}]" 两部分，同一设备的多个条目共用资源路径；
+淘汰使用 CLOCK 近似 LRU（每个槽位 1 字节访问位），不为每个条目分配 dict 或链表节点
+"""
+
+import base64
+import binascii
+import re
+import sys
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from mqtt.cache_store import SQLiteTokenStore
+from mqtt.signer import SIGN_METHODS, TOKEN_VERSION
+from mqtt.token_cache import EXPIRY_SAMPLE, SCAN_MAX_SLOTS, compute_expire_at, expiry_distribution
+
+# 签名方法编号（与 _METHODS 下标一致），_RAW 表示无法原样重建、整串保存的 Token
+_METHODS = tuple(SIGN_METHODS)
+_METHOD_CODES = {method: code for code, method in enumerate(_METHODS)}
+_DIGEST_SIZES = tuple(SIGN_METHODS[method]().digest_size for method in _METHODS)
+_RAW = 254
+_FREE = 255
+
+# 每个槽位的签名区长度（sha256 为 32 字节，sha1/md5 更短）
+_SIGN_SIZE = max(_DIGEST_SIZES)
+
+_TOKEN_HEAD = f"version={TOKEN_VERSION}&res="
+
+# URL 编码时保持不变的字符（加上 "/"），只含这些字符的资源路径只需替换 "/"
+_PLAIN_RES = re.compile(r"[A-Za-z0-9_.~/-]*")
+
+# 签名结果 Base64 后需要 URL 编码的字符
+_SIGN_QUOTE = str.maketrans({"+": "%2B", "/": "%2F", "=": "%3D"})
+_SIGN_UNQUOTE = (("%2B", "+"), ("%2F", "/"), ("%3D", "="))
+
+# 每个条目的近似内存开销（字节）: 槽位数组 4+4+1+8+8+8+32+1，设备到槽位的映射约 40
+_SLOT_OVERHEAD = 110
+
+# 资源路径表每个设备除字符串本身外的近似开销（字节）: dict 条目、序号整数和列表指针
+_RESOURCE_OVERHEAD = 100
+
+# 每次 purge_expired 扫描的槽位数，保证单次调用耗时有界
+_PURGE_WINDOW = 65536
+
+
+def _split_token(token: str) -> Optional[Tuple[int, int, bytes]]:
+    """
+    拆分规范格式的 Token
+
+    参数:
+        token: Token 字符串
+
+    返回:
+        (et, 方法编号, 原始签名)，格式不规范时返回 None
+    """
+    if not token.startswith(_TOKEN_HEAD):
+        return None
+    parts = token[len(_TOKEN_HEAD):].split("&")
+    if len(parts) != 4:
+        return None
+    _, et, method, sign = parts
+    if not (et.startswith("et=") and method.startswith("method=") and sign.startswith("sign=")):
+        return None
+    et, code = et[3:], _METHOD_CODES.get(method[7:])
+    if code is None or not et.isdigit():
+        return None
+    sign = sign[5:]
+    for quoted, char in _SIGN_UNQUOTE:
+        sign = sign.replace(quoted, char)
+    try:
+        digest = base64.b64decode(sign, validate=True)
+    except ValueError:
+        return None
+    if len(digest) != _DIGEST_SIZES[code]:
+        return None
+    return int(et), code, digest
+
+
+def _join_token(res: str, et: int, code: int, digest: bytes) -> str:
+    """由资源路径（未编码）、et、方法编号和原始签名重建 Token"""
+    sign = binascii.b2a_base64(digest, newline=False).decode("ascii").translate(_SIGN_QUOTE)
+    res = res.replace("/", "%2F") if _PLAIN_RES.fullmatch(res) else quote(res, safe="")
+    return f"{_TOKEN_HEAD}{res}&et={et}&method={_METHODS[code]}&sign={sign}"
+
+
+class CompactTokenCache:
+    """紧凑内存 Token 缓存（接口与 TokenCache 一致，不保存预序列化响应体）"""
+
+    def __init__(self, expire_days: int = 29, max_entries: int = 100000,
+                 max_bytes: Optional[int] = None, margin_seconds: int = 86400,
+                 margin_ratio: float = 0.1, store: Optional[SQLiteTokenStore] = None):
+        """
+        初始化缓存
+
+        参数:
+            expire_days: Token 中无法解析 et 时使用的缓存过期天数，默认 29 天
+            max_entries: 最大条目数，超出时按 CLOCK 顺序淘汰
+            max_bytes: 近似最大内存占用（字节），None 表示不限制
+            margin_seconds: 在 Token 的 et 之前提前失效的秒数，默认 1 天
+            margin_ratio: 提前失效时间占 Token 有效期的最大比例
+            store: 可选的持久化存储，内存未命中时按需加载，写入异步落盘
+        """
+        self.expire_days = expire_days
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.margin_seconds = margin_seconds
+        self.margin_ratio = margin_ratio
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        """初始化（或清空）所有槽位和资源路径表"""
+        self.count = 0
+        self.bytes = 0
+        # 资源路径表，设备序号即表中下标；设备 -> 槽位（只有一个条目时为槽位号，否则为 {后缀序号: 槽位}）
+        self._resources: List[str] = []
+        self._resource_index: Dict[str, int] = {}
+        self._device_slots: List[Union[None, int, Dict[int, int]]] = []
+        # key 后缀表（指纹、有效期和签名方法的组合，自定义密钥时每个密钥一个），
+        # 按引用计数回收，释放的序号放入 _free_suffixes 复用
+        self._suffixes: List[Optional[str]] = []
+        self._suffix_index: Dict[str, int] = {}
+        self._suffix_refs = array("I")
+        self._free_suffixes: List[int] = []
+        # 槽位数组
+        self._devices = array("I")
+        self._suffix_of = array("I")
+        self._methods = bytearray()
+        self._et = array("q")
+        self._expire_at = array("d")
+        self._timestamp = array("d")
+        self._signs = bytearray()
+        self._referenced = bytearray()
+        self._free: List[int] = []
+        # 无法原样重建的 Token: 槽位 -> Token
+        self._raw: Dict[int, str] = {}
+        self._hand = 0
+        self._purge_cursor = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        获取缓存的 Token
+
+        参数:
+            key: 缓存键
+
+        返回:
+            Token 字符串，如果不存在或已过期则返回 None
+        """
+        slot = self._find(key)
+        if slot is None and self.store is not None:
+            slot = self._load(key)
+        if slot is None:
+            self.misses += 1
+            return None
+
+        if time.time() >= self._expire_at[slot]:
+            self._remove(slot)
+            self.misses += 1
+            return None
+
+        self._referenced[slot] = 1
+        self.hits += 1
+        return self._token(slot)
+
+    def set(self, key: str, token: str) -> None:
+        """
+        设置缓存
+
+        参数:
+            key: 缓存键
+            token: Token 字符串
+        """
+        now = time.time()
+        expire_at = compute_expire_at(token, now, self.margin_seconds, self.margin_ratio,
+                                      self.expire_days * 24 * 3600)
+        if expire_at <= now:
+            return
+
+        self._insert(key, token, now, expire_at)
+        if self.store is not None:
+            self.store.put(key, token, expire_at)
+
+    def get_or_create(self, key: str, generate: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        获取缓存的 Token，不存在时调用 generate 生成并写入（单线程使用，多线程请使用 ShardedTokenCache）
+
+        参数:
+            key: 缓存键
+            generate: 生成 Token 的函数
+
+        返回:
+            (Token, 是否命中缓存)
+        """
+        token = self.get(key)
+        if token is not None:
+            return token, True
+        token = generate()
+        self.set(key, token)
+        return token, False
+
+    def get_response(self, key: str, variant: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        获取缓存的 Token（紧凑模式不保存响应体，响应体始终为 None）
+
+        参数:
+            key: 缓存键
+            variant: 响应体变体
+
+        返回:
+            (Token, None)，Token 不存在时为 (None, None)
+        """
+        return self.get(key), None
+
+    def set_response(self, key: str, token: str, variant: str, body: bytes) -> None:
+        """紧凑模式不保存预序列化响应体"""
+
+    def refresh(self, key: str) -> bool:
+        """
+        删除缓存中的指定 key
+
+        参数:
+            key: 缓存键
+
+        返回:
+            True 如果删除成功，False 如果不存在
+        """
+        if self.store is not None:
+            self.store.delete(key)
+        slot = self._find(key)
+        if slot is None:
+            return False
+        self._remove(slot)
+        return True
+
+    def clear(self) -> None:
+        """清空所有缓存"""
+        self._reset()
+        if self.store is not None:
+            self.store.clear()
+
+    def close(self) -> None:
+        """关闭持久化存储，写入所有待处理变更"""
+        if self.store is not None:
+            self.store.close()
+
+    def get_expire_at(self, key: str) -> Optional[float]:
+        """
+        获取缓存条目的失效时间
+
+        参数:
+            key: 缓存键
+
+        返回:
+            失效时间戳，不存在时返回 None
+        """
+        slot = self._find(key)
+        return self._expire_at[slot] if slot is not None else None
+
+    def purge_expired(self) -> int:
+        """
+        删除已过期的条目，每次从上次位置继续扫描 _PURGE_WINDOW 个槽位，保证单次调用耗时有界
+
+        返回:
+            删除的条目数
+        """
+        total = len(self._methods)
+        if not total:
+            return 0
+        now = time.time()
+        start = self._purge_cursor % total
+        end = min(start + _PURGE_WINDOW, total)
+        expire_at = self._expire_at
+        methods = self._methods
+        removed = 0
+        for slot in range(start, end):
+            if methods[slot] != _FREE and expire_at[slot] <= now:
+                self._remove(slot)
+                self.evictions += 1
+                removed += 1
+        self._purge_cursor = end % total
+        return removed
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有缓存信息（不含已过期条目）"""
+        now = time.time()
+        methods = self._methods
+        return {
+            self._key(slot): {
+                'token': self._token(slot),
+                'timestamp': self._timestamp[slot],
+                'expire_at': self._expire_at[slot],
+                'size': self._entry_size(slot)
+            }
+            for slot in range(len(methods)) if methods[slot] != _FREE and self._expire_at[slot] > now
+        }
+
+    def scan(self, cursor: int = 0, limit: int = 100, prefix: str = "",
+             max_scan: int = SCAN_MAX_SLOTS) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        按槽位顺序分页列出未过期的条目（不含 Token），语义同 TokenCache.scan
+
+        参数:
+            cursor: 上一页返回的游标，0 表示从头开始
+            limit: 最多返回的条目数
+            prefix: key 前缀过滤
+            max_scan: 最多检查的槽位数
+
+        返回:
+            (条目列表, 下一页游标)，遍历结束时游标为 None
+        """
+        now = time.time()
+        methods = self._methods
+        expire_at = self._expire_at
+        end = min(len(methods), cursor + max_scan)
+        entries = []
+        slot = cursor
+        while slot < end and len(entries) < limit:
+            current = slot
+            slot += 1
+            if methods[current] == _FREE or expire_at[current] <= now:
+                continue
+            key = self._key(current)
+            if not key.startswith(prefix):
+                continue
+            entries.append({
+                "key": key,
+                "timestamp": self._timestamp[current],
+                "expire_at": expire_at[current],
+                "size": self._entry_size(current)
+            })
+        return entries, slot if slot < len(methods) else None
+
+    def expiry_distribution(self, sample: int = EXPIRY_SAMPLE) -> Dict[str, Any]:
+        """
+        按槽位等间隔采样估算条目的剩余有效期分布
+
+        参数:
+            sample: 最多采样的槽位数
+
+        返回:
+            见 token_cache.expiry_distribution
+        """
+        methods = self._methods
+        expire_at = self._expire_at
+        step = max(1, len(methods) // sample)
+        expire_times = (expire_at[slot] for slot in range(0, len(methods), step) if methods[slot] != _FREE)
+        return expiry_distribution(expire_times, time.time(), self.count)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "compact": True,
+            "devices": len(self._resources),
+            "suffixes": len(self._suffix_index),
+            "raw": len(self._raw),
+            "store": self.store.stats() if self.store is not None else None
+        }
+
+    def _find(self, key: str) -> Optional[int]:
+        """按 key 查找槽位"""
+        res, sep, suffix = key.partition("|")
+        device = self._resource_index.get(res)
+        if device is None:
+            return None
+        suffix_id = self._suffix_index.get(sep + suffix)
+        if suffix_id is None:
+            return None
+        slots = self._device_slots[device]
+        if slots is None:
+            return None
+        if isinstance(slots, int):
+            return slots if self._suffix_of[slots] == suffix_id else None
+        return slots.get(suffix_id)
+
+    def _key(self, slot: int) -> str:
+        """由槽位重建缓存键"""
+        return self._resources[self._devices[slot]] + self._suffixes[self._suffix_of[slot]]
+
+    def _token(self, slot: int) -> str:
+        """由槽位数据重建 Token"""
+        code = self._methods[slot]
+        if code == _RAW:
+            return self._raw[slot]
+        offset = slot * _SIGN_SIZE
+        digest = bytes(self._signs[offset:offset + _DIGEST_SIZES[code]])
+        return _join_token(self._resources[self._devices[slot]], self._et[slot], code, digest)
+
+    def _entry_size(self, slot: int) -> int:
+        """条目的近似内存占用（资源路径按设备共用，单独计入 bytes）"""
+        if self._methods[slot] == _RAW:
+            return _SLOT_OVERHEAD + sys.getsizeof(self._raw[slot])
+        return _SLOT_OVERHEAD
+
+    def _intern(self, key: str) -> Tuple[int, int]:
+        """获取 key 对应的设备序号和后缀序号，不存在时追加到资源路径表和后缀表"""
+        res, sep, suffix = key.partition("|")
+        device = self._resource_index.get(res)
+        if device is None:
+            device = self._resource_index[res] = len(self._resources)
+            self._resources.append(res)
+            self._device_slots.append(None)
+            self.bytes += sys.getsizeof(res) + _RESOURCE_OVERHEAD
+        suffix = sep + suffix
+        suffix_id = self._suffix_index.get(suffix)
+        if suffix_id is None:
+            if self._free_suffixes:
+                suffix_id = self._free_suffixes.pop()
+                self._suffixes[suffix_id] = suffix
+            else:
+                suffix_id = len(self._suffixes)
+                self._suffixes.append(suffix)
+                self._suffix_refs.append(0)
+            self._suffix_index[suffix] = suffix_id
+            self.bytes += sys.getsizeof(suffix) + _RESOURCE_OVERHEAD
+        return device, suffix_id
+
+    def _release_suffix(self, suffix_id: int) -> None:
+        """减少后缀的引用计数，没有条目引用时回收"""
+        self._suffix_refs[suffix_id] -= 1
+        if self._suffix_refs[suffix_id]:
+            return
+        suffix = self._suffixes[suffix_id]
+        del self._suffix_index[suffix]
+        self._suffixes[suffix_id] = None
+        self._free_suffixes.append(suffix_id)
+        self.bytes -= sys.getsizeof(suffix) + _RESOURCE_OVERHEAD
+
+    def _insert(self, key: str, token: str, timestamp: float, expire_at: float) -> Optional[int]:
+        """写入槽位并按上限淘汰"""
+        slot = self._find(key)
+        if slot is not None:
+            self._remove(slot)
+
+        device, suffix_id = self._intern(key)
+        res = self._resources[device]
+        parts = _split_token(token)
+        # 只有能由资源路径原样重建的 Token 才拆分保存
+        if parts is not None and _join_token(res, *parts) != token:
+            parts = None
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._methods)
+            self._devices.append(0)
+            self._suffix_of.append(0)
+            self._methods.append(_FREE)
+            self._et.append(0)
+            self._expire_at.append(0.0)
+            self._timestamp.append(0.0)
+            self._signs.extend(bytes(_SIGN_SIZE))
+            self._referenced.append(0)
+
+        self._devices[slot] = device
+        self._suffix_of[slot] = suffix_id
+        self._suffix_refs[suffix_id] += 1
+        if parts is None:
+            self._methods[slot] = _RAW
+            self._raw[slot] = token
+            self._et[slot] = 0
+        else:
+            et, code, digest = parts
+            self._methods[slot] = code
+            self._et[slot] = et
+            offset = slot * _SIGN_SIZE
+            self._signs[offset:offset + len(digest)] = digest
+        self._expire_at[slot] = expire_at
+        self._timestamp[slot] = timestamp
+        self._referenced[slot] = 1
+
+        slots = self._device_slots[device]
+        if slots is None:
+            self._device_slots[device] = slot
+        elif isinstance(slots, int):
+            self._device_slots[device] = {self._suffix_of[slots]: slots, suffix_id: slot}
+        else:
+            slots[suffix_id] = slot
+        self.count += 1
+        self.bytes += self._entry_size(slot)
+
+        self._evict()
+        self._compact_resources()
+        return self._find(key)
+
+    def _load(self, key: str) -> Optional[int]:
+        """从持久化存储按需加载条目到内存"""
+        row = self.store.load(key)
+        if row is None:
+            return None
+        token, expire_at = row
+        return self._insert(key, token, time.time(), expire_at)
+
+    def _remove(self, slot: int) -> None:
+        """释放槽位并更新内存统计"""
+        self.bytes -= self._entry_size(slot)
+        device = self._devices[slot]
+        slots = self._device_slots[device]
+        if isinstance(slots, int):
+            self._device_slots[device] = None
+        else:
+            del slots[self._suffix_of[slot]]
+            if len(slots) == 1:
+                self._device_slots[device] = next(iter(slots.values()))
+        if self._methods[slot] == _RAW:
+            del self._raw[slot]
+        self._release_suffix(self._suffix_of[slot])
+        self._methods[slot] = _FREE
+        self._referenced[slot] = 0
+        self._free.append(slot)
+        self.count -= 1
+
+    def _evict(self) -> None:
+        """按 CLOCK 顺序淘汰超出条目数或内存上限的条目: 访问位为 1 的条目清零后跳过一轮"""
+        methods = self._methods
+        referenced = self._referenced
+        total = len(methods)
+        while self.count and (
+            self.count > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            slot = self._hand
+            self._hand = (slot + 1) % total
+            if methods[slot] == _FREE:
+                continue
+            if referenced[slot]:
+                referenced[slot] = 0
+                continue
+            self._remove(slot)
+            self.evictions += 1
+
+    def _compact_resources(self) -> None:
+        """资源路径表中没有条目的设备过多时重建，保持表大小与条目数同阶"""
+        if len(self._resources) <= 2 * self.count + 1024:
+            return
+        resources: List[str] = []
+        index: Dict[str, int] = {}
+        device_slots: List[Union[None, int, Dict[int, int]]] = []
+        devices = self._devices
+        for slots in self._device_slots:
+            if slots is None:
+                continue
+            first = slots if isinstance(slots, int) else next(iter(slots.values()))
+            res = self._resources[devices[first]]
+            device = index[res] = len(resources)
+            resources.append(res)
+            device_slots.append(slots)
+            for slot in ([slots] if isinstance(slots, int) else slots.values()):
+                devices[slot] = device
+        self.bytes = sum(self._entry_size(slot) for slots in device_slots
+                         for slot in ([slots] if isinstance(slots, int) else slots.values()))
+        self.bytes += sum(sys.getsizeof(res) + _RESOURCE_OVERHEAD for res in resources)
+        self.bytes += sum(sys.getsizeof(suffix) + _RESOURCE_OVERHEAD for suffix in self._suffix_index)
+        self._resources = resources
+        self._resource_index = index
+        self._device_slots = device_slots
@@ -6,6 +6,8 @@ OneNET 设备配置文件
 包含产品信息和预配置的设备信息
 """
 
+import os
+
 # OneNET 产品配置
 PRODUCT_CONFIG = {
     "product_id": "v6IkuqD6vh",
@@ -25,26 +27,130 @@ PRODUCT_CONFIG = {
     }
 }
 
+# Token 生成配置
+TOKEN_CONFIG = {
+    # et 向上对齐的时间桶（秒），如 3600 表示按整点对齐，同一时间桶内相同资源和密钥生成相同 Token；
+    # 0 表示不对齐（et 精确到秒）
+    "expire_bucket_seconds": int(os.environ.get("COMMONSERV_EXPIRE_BUCKET") or 0)
+}
+
+# Token 缓存配置
+CACHE_CONFIG = {
+    "expire_days": 29,              # 无法解析 et 时的缓存天数
+    "max_entries": 100000,          # 最大缓存条目数
+    "max_bytes": 64 * 1024 * 1024,  # 近似最大内存占用：64MB
+    "margin_seconds": 86400,        # 在 Token 过期前 1 天失效
+    # 持久化快照文件路径（SQLite），为空时只使用内存缓存
+    "persist_path": os.environ.get("COMMONSERV_CACHE_DB") or None,
+    # 共享内存名称，非空时同一主机上的所有 worker 共用一张 Token 表
+    "shm_name": os.environ.get("COMMONSERV_CACHE_SHM") or None,
+    # 紧凑模式：只保存设备序号、et 和原始签名，读取时重建 Token，适合百万级设备
+    "compact": os.environ.get("COMMONSERV_CACHE_COMPACT", "0") == "1",
+    # 分片数，大于 1 时使用分片加锁的线程安全缓存（线程池或无 GIL 解释器下部署时启用）
+    "shards": int(os.environ.get("COMMONSERV_CACHE_SHARDS") or 0)
+}
+
+# Token 提前刷新配置
+REFRESH_CONFIG = {
+    "margin_seconds": 3600,   # 在缓存失效前 1 小时开始刷新
+    "jitter_seconds": 1800,   # 随机提前 0~30 分钟，避免大量设备同时刷新
+    "purge_interval": 60      # 过期条目清理间隔（秒）
+}
+
+# 设备注册表配置
+REGISTRY_CONFIG = {
+    # 外部注册表文件（.json/.csv/.db），为空时使用上面的 PRODUCT_CONFIG
+    "path": os.environ.get("COMMONSERV_DEVICE_REGISTRY") or None,
+    "poll_interval": 5        # 检查文件修改的间隔（秒）
+}
+
+# 启动预热配置
+WARMUP_CONFIG = {
+    # 设置 COMMONSERV_WARMUP=0 关闭预热
+    "enabled": os.environ.get("COMMONSERV_WARMUP", "1") != "0",
+    "expire_hours": 720,      # 预热 Token 的有效期（小时），与接口默认值一致
+    "max_devices": None       # 最多预热的设备数，None 表示不超过缓存容量
+}
+
+# 准入控制（过载保护）配置
+ADMISSION_CONFIG = {
+    # 设置 COMMONSERV_ADMISSION=0 关闭准入控制
+    "enabled": os.environ.get("COMMONSERV_ADMISSION", "1") != "0",
+    # 每类路由的最大并发请求数: cached 为配置产品/设备（通常命中缓存），
+    # custom 为自定义参数、批量和校验（需要签名），bulk 为流式批量生成
+    "limits": {"cached": 1024, "custom": 128, "bulk": 4, "default": 256},
+    # 每类路由可容忍的事件循环延迟（秒），超过时按比例收紧并发上限并随机拒绝部分新请求，
+    # 命中缓存的路由容忍度更高，优先拒绝需要签名的请求
+    "max_loop_lag": {"cached": 0.2, "custom": 0.05, "bulk": 0.05, "default": 0.1},
+    "lag_interval": 0.05,     # 事件循环延迟采样间隔（秒）
+    "retry_after": 1,         # 过载拒绝时的 Retry-After（秒）
+    # 每个客户端每秒请求数，0 表示不限速；客户端按 client_header 请求头识别，没有时按来源 IP
+    "client_rate": float(os.environ.get("COMMONSERV_CLIENT_RATE") or 0),
+    "client_burst": 50,       # 每个客户端的令牌桶容量
+    "client_header": "x-client-id",
+    "max_clients": 10000      # 最多跟踪的客户端数，超出时淘汰最久未出现的客户端
+}
+
 
 def get_product_config():
     """获取产品配置"""
     return PRODUCT_CONFIG
 
 
+def get_token_config():
+    """获取 Token 生成配置"""
+    return TOKEN_CONFIG
+
+
+def get_cache_config():
+    """获取 Token 缓存配置"""
+    return CACHE_CONFIG
+
+
+def get_refresh_config():
+    """获取 Token 提前刷新配置"""
+    return REFRESH_CONFIG
+
+
+def get_registry_config():
+    """获取设备注册表配置"""
+    return REGISTRY_CONFIG
+
+
+def get_warmup_config():
+    """获取启动预热配置"""
+    return WARMUP_CONFIG
+
+
+def get_admission_config():
+    """获取准入控制配置"""
+    return ADMISSION_CONFIG
+
+
 def get_device_config(device_name):
     """
-    获取指定设备的配置
+    获取指定设备的配置（从设备注册表查找）
 
     参数:
-        device_name: 设备名称（MO 或 MO1）
+        device_name: 设备名称（如 MO 或 MO1，不区分大小写）
 
     返回:
         设备配置字典，如果设备不存在则返回None
     """
-    devices = PRODUCT_CONFIG.get("devices", {})
-    return devices.get(device_name.upper())
+    # device_registry 导入时读取本模块的配置，在调用时导入以避免循环导入
+    from mqtt import device_registry
+
+    record = device_registry.registry.get_device(device_name)
+    if record is None:
+        return None
+    return {
+        "device_id": record.device_id,
+        "description": record.description
+    }
 
 
 def get_all_device_names():
     """获取所有已配置的设备名称列表"""
-    return list(PRODUCT_CONFIG.get("devices", {}).keys())
+    from mqtt import device_registry
+
+    return device_registry.registry.index.names()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+设备注册表模块
+从外部 JSON/CSV/SQLite 文件加载产品和设备，构建不区分大小写的索引，文件变化时热加载
+
+文件格式:
+    JSON: 与 PRODUCT_CONFIG 相同的结构，或 {"default_product_id": ..., "products": [PRODUCT_CONFIG, ...]}，
+          产品可选 method（sha1、sha256、md5，默认 sha1）
+    CSV: 表头包含 device_name，可选 device_id、product_id、access_key、method、description
+    SQLite: products(product_id, access_key, default_expire_hours[, method]) 和
+            devices(product_id, device_name, device_id, description) 两张表
+"""
+
+import asyncio
+import bisect
+import csv
+import json
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from mqtt.config import PRODUCT_CONFIG, get_registry_config
+from mqtt.signer import TOKEN_METHOD, check_method
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRecord(NamedTuple):
+    """设备记录"""
+    name: str
+    product_id: str
+    device_id: str
+    description: str
+
+
+class RegistryIndex:
+    """不可变的设备索引，热加载时整体替换"""
+
+    __slots__ = ("products", "default_product_id", "_devices", "_by_name", "_sorted", "count")
+
+    def __init__(self, products: Dict[str, Dict[str, Any]], default_product_id: str,
+                 devices: Dict[str, Dict[str, DeviceRecord]]):
+        """
+        初始化索引
+
+        参数:
+            products: product_id -> 产品配置（product_id、access_key、method、default_expire_hours）
+            default_product_id: 默认产品 ID
+            devices: product_id -> {大写设备名称: DeviceRecord}
+        """
+        self.products = products
+        self.default_product_id = default_product_id
+        self._devices = devices
+        self.count = sum(len(items) for items in devices.values())
+
+        # 不指定产品时的全局名称索引，名称冲突时默认产品优先
+        self._by_name: Dict[str, DeviceRecord] = {}
+        for product_id in sorted(devices, key=lambda item: item != default_product_id):
+            for key, record in devices[product_id].items():
+                self._by_name.setdefault(key, record)
+
+        # 每个产品按名称排序的索引，分页和前缀过滤只需二分查找
+        self._sorted: Dict[str, List[str]] = {product_id: sorted(items) for product_id, items in devices.items()}
+
+    def get(self, device_name: str, product_id: Optional[str] = None) -> Optional[DeviceRecord]:
+        """
+        按名称查找设备（不区分大小写）
+
+        参数:
+            device_name: 设备名称
+            product_id: 产品 ID，不传则在所有产品中查找（默认产品优先）
+
+        返回:
+            DeviceRecord，不存在时返回 None
+        """
+        devices = self._devices.get(product_id) if product_id else self._by_name
+        if devices is None:
+            return None
+        record = devices.get(device_name)
+        if record is None:
+            record = devices.get(device_name.upper())
+        return record
+
+    def names(self, product_id: Optional[str] = None) -> List[str]:
+        """
+        获取产品下所有设备名称
+
+        参数:
+            product_id: 产品 ID，不传则使用默认产品
+
+        返回:
+            设备名称列表
+        """
+        devices = self._devices.get(product_id or self.default_product_id, {})
+        return [record.name for record in devices.values()]
+
+    def count_prefix(self, product_id: Optional[str] = None, prefix: str = "") -> int:
+        """
+        统计产品下名称以 prefix 开头的设备数（O(log n)）
+
+        参数:
+            product_id: 产品 ID，不传则使用默认产品
+            prefix: 名称前缀（不区分大小写）
+
+        返回:
+            设备数
+        """
+        names = self._sorted.get(product_id or self.default_product_id, [])
+        prefix = prefix.upper()
+        if not prefix:
+            return len(names)
+        upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return bisect.bisect_left(names, upper_bound) - bisect.bisect_left(names, prefix)
+
+    def iter_range(self, product_id: Optional[str] = None, prefix: str = "",
+                   after: Optional[str] = None) -> Iterator[DeviceRecord]:
+        """
+        按名称顺序遍历设备
+
+        参数:
+            product_id: 产品 ID，不传则使用默认产品
+            prefix: 名称前缀（不区分大小写）
+            after: 从该名称之后开始（不含）
+
+        返回:
+            DeviceRecord 迭代器
+        """
+        product_id = product_id or self.default_product_id
+        names = self._sorted.get(product_id, [])
+        devices = self._devices.get(product_id, {})
+        prefix = prefix.upper()
+        start = bisect.bisect_left(names, prefix)
+        if after is not None:
+            start = max(start, bisect.bisect_right(names, after.upper()))
+        for i in range(start, len(names)):
+            name = names[i]
+            if not name.startswith(prefix):
+                break
+            yield devices[name]
+
+    def page(self, product_id: Optional[str] = None, prefix: str = "", after: Optional[str] = None,
+             limit: int = 100) -> Tuple[List[DeviceRecord], Optional[str]]:
+        """
+        获取一页设备，耗时与页大小成正比
+
+        参数:
+            product_id: 产品 ID，不传则使用默认产品
+            prefix: 名称前缀（不区分大小写）
+            after: 上一页最后一个设备名称
+            limit: 每页数量
+
+        返回:
+            (设备列表, 下一页起始名称)，没有更多数据时下一页为 None
+        """
+        records = []
+        for record in self.iter_range(product_id, prefix, after):
+            if len(records) == limit:
+                return records, records[-1].name
+            records.append(record)
+        return records, None
+
+
+def _product_entry(product: Dict[str, Any]) -> Dict[str, Any]:
+    """提取产品配置中的签名相关字段"""
+    return {
+        "product_id": product["product_id"],
+        "access_key": product["access_key"],
+        "method": check_method(product.get("method") or TOKEN_METHOD),
+        "default_expire_hours": product.get("default_expire_hours", 720)
+    }
+
+
+def _add_device(devices: Dict[str, Dict[str, DeviceRecord]], product_id: str, name: str,
+                device_id: Optional[str], description: str) -> None:
+    """向索引中添加设备"""
+    devices.setdefault(product_id, {})[name.upper()] = DeviceRecord(
+        name.upper(), product_id, device_id or name, description
+    )
+
+
+def build_index(config: Dict[str, Any]) -> RegistryIndex:
+    """
+    从 PRODUCT_CONFIG 结构构建索引
+
+    参数:
+        config: 单个产品配置，或包含 products 列表的多产品配置
+
+    返回:
+        RegistryIndex 实例
+    """
+    product_list = config["products"] if "products" in config else [config]
+    products: Dict[str, Dict[str, Any]] = {}
+    devices: Dict[str, Dict[str, DeviceRecord]] = {}
+    for product in product_list:
+        entry = _product_entry(product)
+        product_id = entry["product_id"]
+        products[product_id] = entry
+        devices.setdefault(product_id, {})
+        for name, device in product.get("devices", {}).items():
+            _add_device(devices, product_id, name, device.get("device_id"), device.get("description", ""))
+
+    default_product_id = config.get("default_product_id") or product_list[0]["product_id"]
+    return RegistryIndex(products, default_product_id, devices)
+
+
+def _load_csv(path: str) -> RegistryIndex:
+    """从 CSV 文件加载索引，未指定 product_id 的行归入内置默认产品"""
+    default = _product_entry(PRODUCT_CONFIG)
+    products = {default["product_id"]: default}
+    devices: Dict[str, Dict[str, DeviceRecord]] = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            name = (row.get("device_name") or "").strip()
+            if not name:
+                continue
+            product_id = (row.get("product_id") or "").strip() or default["product_id"]
+            access_key = (row.get("access_key") or "").strip()
+            if product_id not in products:
+                if not access_key:
+                    raise ValueError(f"产品 '{product_id}' 缺少 access_key")
+                products[product_id] = _product_entry({
+                    "product_id": product_id,
+                    "access_key": access_key,
+                    "method": (row.get("method") or "").strip()
+                })
+            _add_device(devices, product_id, name, (row.get("device_id") or "").strip(),
+                        row.get("description") or "")
+    return RegistryIndex(products, default["product_id"], devices)
+
+
+def _load_sqlite(path: str) -> RegistryIndex:
+    """从 SQLite 文件加载索引，第一个产品为默认产品"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        products: Dict[str, Dict[str, Any]] = {}
+        # method 列可选，旧文件没有该列时使用默认签名方法
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+        method_column = "method" if "method" in columns else "NULL"
+        for product_id, access_key, expire_hours, method in conn.execute(
+            f"SELECT product_id, access_key, default_expire_hours, {method_column} FROM products ORDER BY rowid"
+        ):
+            products[product_id] = _product_entry({
+                "product_id": product_id,
+                "access_key": access_key,
+                "method": method,
+                "default_expire_hours": expire_hours or 720
+            })
+        if not products:
+            raise ValueError("products 表为空")
+
+        devices: Dict[str, Dict[str, DeviceRecord]] = {product_id: {} for product_id in products}
+        for product_id, name, device_id, description in conn.execute(
+            "SELECT product_id, device_name, device_id, description FROM devices"
+        ):
+            _add_device(devices, product_id, name, device_id, description or "")
+    finally:
+        conn.close()
+    return RegistryIndex(products, next(iter(products)), devices)
+
+
+def load_index(path: str) -> RegistryIndex:
+    """
+    根据文件扩展名加载索引
+
+    参数:
+        path: .json、.csv、.db/.sqlite/.sqlite3 文件路径
+
+    返回:
+        RegistryIndex 实例
+
+    异常:
+        ValueError: 文件格式不支持或内容无效时抛出
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        with open(path, encoding="utf-8") as f:
+            return build_index(json.load(f))
+    if ext == ".csv":
+        return _load_csv(path)
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        return _load_sqlite(path)
+    raise ValueError(f"不支持的设备注册表格式: {path}")
+
+
+class DeviceRegistry:
+    """设备注册表（支持文件热加载）"""
+
+    def __init__(self, path: Optional[str] = None, poll_interval: float = 5):
+        """
+        初始化注册表
+
+        参数:
+            path: 注册表文件路径，None 时使用内置 PRODUCT_CONFIG
+            poll_interval: 检查文件修改时间的间隔（秒）
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.reloads = 0
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.index = build_index(PRODUCT_CONFIG)
+        if path:
+            self.reload()
+
+    def get_device(self, device_name: str, product_id: Optional[str] = None) -> Optional[DeviceRecord]:
+        """
+        查找设备
+
+        参数:
+            device_name: 设备名称（不区分大小写）
+            product_id: 产品 ID，不传则在所有产品中查找（默认产品优先）
+
+        返回:
+            DeviceRecord，不存在时返回 None
+        """
+        return self.index.get(device_name, product_id)
+
+    def get_product(self, product_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取产品配置
+
+        参数:
+            product_id: 产品 ID，不传则返回默认产品
+
+        返回:
+            产品配置字典，不存在时返回 None
+        """
+        index = self.index
+        return index.products.get(product_id or index.default_product_id)
+
+    def reload(self) -> bool:
+        """
+        文件修改时间变化时重新加载并原子替换索引
+
+        返回:
+            True 如果已重新加载
+        """
+        if not self.path:
+            return False
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return False
+        # 先记录修改时间，加载失败时等待文件再次修改后重试
+        self._mtime = mtime
+        self.index = load_index(self.path)
+        self.reloads += 1
+        return True
+
+    def start(self) -> None:
+        """在当前事件循环中启动文件监视任务"""
+        if self.path and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self) -> None:
+        """停止文件监视任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """获取注册表统计信息"""
+        index = self.index
+        return {
+            "path": self.path,
+            "products": len(index.products),
+            "devices": index.count,
+            "reloads": self.reloads
+        }
+
+    async def _watch(self) -> None:
+        """轮询文件修改时间，在线程中构建新索引，不阻塞请求处理"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception:
+                logger.exception("设备注册表加载失败，继续使用旧索引: %s", self.path)
+
+
+# 创建全局设备注册表
+registry = DeviceRegistry(**get_registry_config())
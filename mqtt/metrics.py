@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+监控指标模块
+预分配桶的延迟直方图、按路由统计的请求中间件和 Prometheus 文本格式输出
+
+请求计数只在事件循环线程中更新，不使用锁；直方图的 observe 加锁，
+签名耗时直方图会在执行签名的工作线程中更新
+"""
+
+import bisect
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 请求延迟桶上界（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# 签名耗时桶上界（秒）
+SIGN_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+
+
+class Histogram:
+    """固定桶直方图，observe 只做一次二分查找和两次加法（持锁，可在任意线程调用）"""
+
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        初始化直方图
+
+        参数:
+            buckets: 升序的桶上界，最后自动追加 +Inf 桶
+        """
+        self.buckets = buckets
+        # 每个桶单独计数（非累计），输出时再累加
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, count: int = 1) -> None:
+        """
+        记录观测值
+
+        参数:
+            value: 观测值（秒）
+            count: 相同观测值的次数（批量操作按平均耗时记录）
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += count
+            self.sum += value * count
+
+    @property
+    def count(self) -> int:
+        """观测总数"""
+        return sum(self.counts)
+
+
+# 签名耗时直方图，由 PreparedSigner.sign/sign_many 更新
+sign_seconds = Histogram(SIGN_BUCKETS)
+
+
+def _escape(value: str) -> str:
+    """转义 Prometheus 标签值"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    """格式化标签集合"""
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _format_value(value: float) -> str:
+    """格式化样本值"""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def render_histogram(name: str, help_text: str,
+                     series: Iterable[Tuple[Dict[str, str], Histogram]]) -> List[str]:
+    """
+    输出一组直方图的 Prometheus 文本
+
+    参数:
+        name: 指标名称
+        help_text: 指标说明
+        series: (标签, 直方图) 列表
+
+    返回:
+        文本行列表
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, hist in series:
+        prefix = _labels(labels)
+        sep = "," if prefix else ""
+        # 先复制计数，避免输出过程中被并发更新导致累计值不单调
+        counts = list(hist.counts)
+        cumulative = 0
+        for bound, count in zip(hist.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}{sep}le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{{{prefix}{sep}le="+Inf"}} {cumulative}')
+        suffix = f"{{{prefix}}}" if prefix else ""
+        lines.append(f"{name}_sum{suffix} {_format_value(hist.sum)}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+    return lines
+
+
+def render_samples(name: str, metric_type: str, help_text: str,
+                   samples: Iterable[Tuple[Dict[str, str], Any]]) -> List[str]:
+    """
+    输出 counter/gauge 的 Prometheus 文本
+
+    参数:
+        name: 指标名称
+        metric_type: counter 或 gauge
+        help_text: 指标说明
+        samples: (标签, 数值) 列表，数值为 None 的样本跳过
+
+    返回:
+        文本行列表
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        if value is None:
+            continue
+        suffix = f"{{{_labels(labels)}}}" if labels else ""
+        lines.append(f"{name}{suffix} {_format_value(value)}")
+    return lines
+
+
+class RequestMetrics:
+    """按路由统计的请求指标"""
+
+    def __init__(self):
+        """初始化统计"""
+        # (method, route) -> 延迟直方图
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        # (method, route, status) -> 响应数
+        self.responses: Dict[Tuple[str, str, int], int] = {}
+        # 当前处理中的请求数
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        """
+        记录一个已完成的请求
+
+        参数:
+            method: HTTP 方法
+            route: 路由模板（如 /mqtt/onenet/v1/device/{device_name}）
+            status: 响应状态码
+            seconds: 处理耗时（秒）
+        """
+        hist = self.latency.get((method, route))
+        if hist is None:
+            hist = self.latency[(method, route)] = Histogram()
+        hist.observe(seconds)
+        key = (method, route, status)
+        self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self) -> List[str]:
+        """输出请求相关指标的 Prometheus 文本行"""
+        lines = render_histogram(
+            "commonserv_http_request_duration_seconds", "HTTP 请求处理耗时",
+            [({"method": method, "route": route}, hist)
+             for (method, route), hist in sorted(self.latency.items())]
+        )
+        lines += render_samples(
+            "commonserv_http_responses_total", "counter", "HTTP 响应数",
+            [({"method": method, "route": route, "status": str(status)}, count)
+             for (method, route, status), count in sorted(self.responses.items())]
+        )
+        lines += render_samples(
+            "commonserv_http_requests_in_flight", "gauge", "正在处理的 HTTP 请求数", [({}, self.in_flight)]
+        )
+        return lines
+
+
+# 全局请求统计
+http_requests = RequestMetrics()
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 请求统计中间件
+
+    不包装请求/响应对象，每个请求只增加两次计时、一次字典查找和一次直方图更新；
+    路由模板在路由匹配后从 scope["endpoint"] 反查，不会因路径参数产生无限多的标签
+    """
+
+    def __init__(self, app, metrics: Optional[RequestMetrics] = None):
+        """
+        初始化中间件
+
+        参数:
+            app: 下游 ASGI 应用
+            metrics: 统计对象，默认使用全局 http_requests
+        """
+        self.app = app
+        self.metrics = metrics or http_requests
+        self._routes: Dict[Any, str] = {}
+
+    def _route_path(self, scope: Dict[str, Any]) -> str:
+        """根据匹配到的 endpoint 获取路由模板，未匹配时返回 unmatched"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            path = "unmatched"
+            router = scope.get("router")
+            for route in getattr(router, "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._routes[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        status = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.in_flight -= 1
+            metrics.observe(scope["method"], self._route_path(scope), status, elapsed)
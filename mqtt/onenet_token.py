@@ -7,12 +7,16 @@ OneNET MQTT Token 生成模块
 Token 格式: version=2018-10-31&res=xxx&et=xxx&method=sha1&sign=xxx
 """
 
-import hmac
-import hashlib
-import base64
-import time
-from urllib.parse import quote
-from mqtt.config import get_product_config, get_device_config
+from itertools import islice
+from typing import Any, Dict, List, Tuple
+from mqtt import device_registry
+from mqtt.device_registry import DeviceRecord
+from mqtt.signer import SIGN_METHODS, TOKEN_METHOD, TOKEN_VERSION, compute_expire_time, registry
+from mqtt.token_cache import make_key
+from mqtt.token_verifier import check_signature, parse_token
+
+# 设备不存在时错误信息中最多列出的设备数
+_ERROR_DEVICE_LIMIT = 20
 
 
 def generate_product_token(expire_hours: int = 720) -> str:
@@ -23,22 +27,18 @@ def generate_product_token(expire_hours: int = 720) -> str:
         expire_hours: Token 有效期（小时），默认 720 小时（30天）
 
     返回:
-        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}&et={expire_time}&method=sha1&sign={sign}
+        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}&et={expire_time}&method={method}&sign={sign}
     """
-    config = get_product_config()
-    product_id = config["product_id"]
-    access_key = base64.b64decode(config["access_key"])
+    product = device_registry.registry.get_product()
 
     # Token 有效期时间戳（秒）
-    expire_time = int(time.time()) + expire_hours * 3600
+    expire_time = compute_expire_time(expire_hours)
 
     # 产品级资源路径
-    res = f"products/{product_id}"
+    res = f"products/{product['product_id']}"
 
     # 生成 Token
-    token = _generate_token(res, expire_time, access_key)
-
-    return token
+    return registry.get(product["access_key"], product["method"]).sign(res, expire_time)
 
 
 def generate_device_token(device_name: str, expire_hours: int = 720) -> str:
@@ -46,84 +46,148 @@ def generate_device_token(device_name: str, expire_hours: int = 720) -> str:
     生成设备级 Token
 
     参数:
-        device_name: 设备名称（MO 或 MO1）
+        device_name: 设备名称（如 MO 或 MO1，不区分大小写）
         expire_hours: Token 有效期（小时），默认 720 小时（30天）
 
     返回:
-        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}%2Fdevices%2F{device_id}&et={expire_time}&method=sha1&sign={sign}
+        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}%2Fdevices%2F{device_id}&et={expire_time}&method={method}&sign={sign}
 
     异常:
         ValueError: 设备不存在时抛出
     """
-    device_config = get_device_config(device_name)
-    if device_config is None:
-        available_devices = get_product_config().get("devices", {}).keys()
-        raise ValueError(
-            f"设备 '{device_name}' 不存在。"
-            f"可用设备: {', '.join(available_devices)}"
-        )
-
-    config = get_product_config()
-    product_id = config["product_id"]
-    access_key = base64.b64decode(config["access_key"])
-    device_id = device_config["device_id"]
+    product, device = _resolve_device(device_name)
 
     # Token 有效期时间戳（秒）
-    expire_time = int(time.time()) + expire_hours * 3600
+    expire_time = compute_expire_time(expire_hours)
 
     # 设备级资源路径
-    res = f"products/{product_id}/devices/{device_id}"
+    res = f"products/{product['product_id']}/devices/{device.device_id}"
 
     # 生成 Token
-    token = _generate_token(res, expire_time, access_key)
+    return registry.get(product["access_key"], product["method"]).sign(res, expire_time)
 
-    return token
 
+def generate_device_tokens(device_names: List[str], expire_hours: int = 720) -> List[Dict[str, Any]]:
+    """
+    批量生成设备级 Token
 
-def _generate_token(res: str, expire_time: int, access_key: bytes) -> str:
+    每个产品密钥在整批请求中只取一次签名器，单个设备失败不影响其它设备。
+
+    参数:
+        device_names: 设备名称列表
+        expire_hours: Token 有效期（小时），默认 720 小时（30天）
+
+    返回:
+        与 device_names 顺序一致的结果列表，成功项包含 token，失败项包含 error
     """
-    生成 OneNET MQTT Token 的内部函数
+    index = device_registry.registry.index
+    signers = {}
+
+    # 整批使用同一个过期时间
+    expire_time = compute_expire_time(expire_hours)
+
+    results = []
+    for device_name in device_names:
+        device = index.get(device_name)
+        if device is None:
+            results.append({
+                "device": device_name,
+                "error": f"设备 '{device_name}' 不存在"
+            })
+            continue
+
+        signer = signers.get(device.product_id)
+        if signer is None:
+            product = index.products[device.product_id]
+            signer = signers[device.product_id] = registry.get(product["access_key"], product["method"])
+
+        res = f"products/{device.product_id}/devices/{device.device_id}"
+        results.append({
+            "device": device_name,
+            "token": signer.sign(res, expire_time)
+        })
+
+    return results
+
+
+def product_cache_key(expire_hours: int = 720) -> str:
+    """
+    获取配置产品 Token 的缓存键
 
     参数:
-        res: 资源路径
-        expire_time: 过期时间戳（秒）
-        access_key: 解码后的访问密钥
+        expire_hours: Token 有效期（小时）
 
     返回:
-        Token 字符串
+        缓存键字符串
+    """
+    product = device_registry.registry.get_product()
+    return make_key(f"products/{product['product_id']}", product["access_key"], expire_hours, product["method"])
+
+
+def device_cache_key(device_name: str, expire_hours: int = 720) -> str:
+    """
+    获取配置设备 Token 的缓存键
+
+    参数:
+        device_name: 设备名称（如 MO 或 MO1，不区分大小写）
+        expire_hours: Token 有效期（小时）
+
+    返回:
+        缓存键字符串
+
+    异常:
+        ValueError: 设备不存在时抛出
     """
-    # Token 版本
-    version = "2018-10-31"
+    product, device = _resolve_device(device_name)
+    res = f"products/{product['product_id']}/devices/{device.device_id}"
+    return make_key(res, product["access_key"], expire_hours, product["method"])
 
-    # 签名方法
-    method = "sha1"
 
-    # 计算签名
-    # 签名顺序: et + "\n" + method + "\n" + res + "\n" + version
-    et = str(expire_time)
-    text_to_sign = f"{et}\n{method}\n{res}\n{version}"
-    signature = hmac.new(
-        access_key,
-        text_to_sign.encode("utf-8"),
-        hashlib.sha1
-    ).digest()
+def _resolve_device(device_name: str) -> Tuple[Dict[str, Any], DeviceRecord]:
+    """
+    从设备注册表查找设备及其所属产品
+
+    参数:
+        device_name: 设备名称（不区分大小写）
+
+    返回:
+        (产品配置, 设备记录)
+
+    异常:
+        ValueError: 设备不存在时抛出
+    """
+    index = device_registry.registry.index
+    device = index.get(device_name)
+    if device is None:
+        # 只按名称顺序取前几个设备，耗时与设备总数无关
+        available_devices = [record.name for record in islice(index.iter_range(), _ERROR_DEVICE_LIMIT)]
+        raise ValueError(
+            f"设备 '{device_name}' 不存在。"
+            f"可用设备: {', '.join(available_devices)}"
+            f"{' 等' if index.count_prefix() > _ERROR_DEVICE_LIMIT else ''}"
+        )
+    return index.products[device.product_id], device
 
-    # Base64 编码签名
-    sign_base64 = base64.b64encode(signature).decode("utf-8")
 
-    # URL 编码
-    res_encoded = quote(res, safe='')
-    sign_encoded = quote(sign_base64, safe='')
+def _generate_token(res: str, expire_time: int, access_key: bytes, method: str = TOKEN_METHOD) -> str:
+    """
+    生成 OneNET MQTT Token 的内部函数
 
-    # 组装 Token
-    token = f"version={version}&res={res_encoded}&et={et}&method={method}&sign={sign_encoded}"
+    参数:
+        res: 资源路径
+        expire_time: 过期时间戳（秒）
+        access_key: 解码后的访问密钥
+        method: 签名方法（sha1、sha256 或 md5）
 
-    return token
+    返回:
+        Token 字符串
+    """
+    return registry.get(access_key, method).sign(res, expire_time)
 
 
 def decode_token(token: str, access_key: str) -> dict:
     """
-    解码并验证 Token（仅用于测试和验证）
+    解码并验证 Token
 
     参数:
         token: Token 字符串
@@ -136,38 +200,20 @@ def decode_token(token: str, access_key: str) -> dict:
         ValueError: Token 无效或签名不匹配时抛出
     """
     try:
-        # 解析 Token
-        parts = {}
-        for param in token.split("&"):
-            key, value = param.split("=", 1)
-            parts[key] = value
-
-        # 验证版本
-        if parts.get("version") != "2018-10-31":
+        version, res, et, method, sign = parse_token(token)
+
+        # 验证版本和签名方法
+        if version != TOKEN_VERSION:
             raise ValueError("Token 版本不支持")
+        if method not in SIGN_METHODS:
+            raise ValueError(f"不支持的签名方法: {method}")
 
-        # URL 解码
-        res = parts["res"]
-        et = int(parts["et"])
-        method = parts["method"]
-        sign = parts["sign"]
-
-        # 重新计算签名
-        access_key_decoded = base64.b64decode(access_key)
-        text_to_sign = f"{et}\n{res}\n{method}"
-        expected_signature = hmac.new(
-            access_key_decoded,
-            text_to_sign.encode("utf-8"),
-            hashlib.sha1
-        ).digest()
-        expected_sign_base64 = base64.b64encode(expected_signature).decode("utf-8")
-
-        # 验证签名
-        if sign != quote(expected_sign_base64):
+        # 签名顺序与生成时一致: et + "\n" + method + "\n" + res + "\n" + version，常量时间比较
+        if not check_signature(res, et, sign, access_key, method):
             raise ValueError("Token 签名无效")
 
         return {
-            "version": parts["version"],
+            "version": version,
             "res": res,
             "expire_time": et,
             "method": method,
@@ -6,14 +6,14 @@ OneNET MQTT Token 自定义生成模块
 支持传入参数生成 Token
 """
 
-import hmac
-import hashlib
-import base64
-import time
-from urllib.parse import quote
+from typing import Any, Dict, List, Tuple
 
+from mqtt.signer import TOKEN_METHOD, PreparedSigner, check_method, compute_expire_time, registry
+from mqtt.token_cache import make_key
 
-def generate_product_token_custom(product_id: str, access_key: str, expire_hours: int = 720) -> str:
+
+def generate_product_token_custom(product_id: str, access_key: str, expire_hours: int = 720,
+                                  method: str = TOKEN_METHOD) -> str:
     """
     生成产品级 Token（自定义参数）
 
@@ -21,49 +21,22 @@ def generate_product_token_custom(product_id: str, access_key: str, expire_hours
         product_id: 产品 ID
         access_key: 访问密钥（Base64 编码）
         expire_hours: Token 有效期（小时），默认 720 小时（30天）
+        method: 签名方法（sha1、sha256 或 md5），默认 sha1
 
     返回:
-        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}&et={expire_time}&method=sha1&sign={sign}
+        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}&et={expire_time}&method={method}&sign={sign}
     """
     # Token 有效期时间戳（秒）
-    expire_time = int(time.time()) + expire_hours * 3600
+    expire_time = compute_expire_time(expire_hours)
 
     # 产品级资源路径
     res = f"products/{product_id}"
 
-    # 解码 access_key
-    key = base64.b64decode(access_key)
-
-    # Token 版本
-    version = "2018-10-31"
-
-    # 签名方法
-    method = "sha1"
-
-    # 计算签名
-    # 签名顺序: et + "\n" + method + "\n" + res + "\n" + version
-    et = str(expire_time)
-    text_to_sign = f"{et}\n{method}\n{res}\n{version}"
-    signature = hmac.new(
-        key,
-        text_to_sign.encode("utf-8"),
-        hashlib.sha1
-    ).digest()
-
-    # Base64 编码签名
-    sign_base64 = base64.b64encode(signature).decode("utf-8")
-
-    # URL 编码
-    res_encoded = quote(res, safe='')
-    sign_encoded = quote(sign_base64, safe='')
-
-    # 组装 Token
-    token = f"version={version}&res={res_encoded}&et={et}&method={method}&sign={sign_encoded}"
-
-    return token
+    return registry.get(access_key, method).sign(res, expire_time)
 
 
-def generate_device_token_custom(product_id: str, device_id: str, access_key: str, expire_hours: int = 720) -> str:
+def generate_device_token_custom(product_id: str, device_id: str, access_key: str, expire_hours: int = 720,
+                                 method: str = TOKEN_METHOD) -> str:
     """
     生成设备级 Token（自定义参数）
 
@@ -72,43 +45,100 @@ def generate_device_token_custom(product_id: str, device_id: str, access_key: st
         device_id: 设备 ID
         access_key: 访问密钥（Base64 编码）
         expire_hours: Token 有效期（小时），默认 720 小时（30天）
+        method: 签名方法（sha1、sha256 或 md5），默认 sha1
 
     返回:
-        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}%2Fdevices%2F{device_id}&et={expire_time}&method=sha1&sign={sign}
+        Token 字符串，格式: version=2018-10-31&res=products%2F{product_id}%2Fdevices%2F{device_id}&et={expire_time}&method={method}&sign={sign}
     """
     # Token 有效期时间戳（秒）
-    expire_time = int(time.time()) + expire_hours * 3600
+    expire_time = compute_expire_time(expire_hours)
 
     # 设备级资源路径
     res = f"products/{product_id}/devices/{device_id}"
 
-    # 解码 access_key
-    key = base64.b64decode(access_key)
+    return registry.get(access_key, method).sign(res, expire_time)
+
+
+def product_cache_key_custom(product_id: str, access_key: str, expire_hours: int = 720,
+                             method: str = TOKEN_METHOD) -> str:
+    """
+    获取自定义参数产品 Token 的缓存键
+
+    参数:
+        product_id: 产品 ID
+        access_key: 访问密钥（Base64 编码）
+        expire_hours: Token 有效期（小时）
+        method: 签名方法
+
+    返回:
+        缓存键字符串
+    """
+    return make_key(f"products/{product_id}", access_key, expire_hours, method)
+
+
+def device_cache_key_custom(product_id: str, device_id: str, access_key: str, expire_hours: int = 720,
+                            method: str = TOKEN_METHOD) -> str:
+    """
+    获取自定义参数设备 Token 的缓存键
 
-    # Token 版本
-    version = "2018-10-31"
+    参数:
+        product_id: 产品 ID
+        device_id: 设备 ID
+        access_key: 访问密钥（Base64 编码）
+        expire_hours: Token 有效期（小时）
+        method: 签名方法
 
-    # 签名方法
-    method = "sha1"
+    返回:
+        缓存键字符串
+    """
+    return make_key(f"products/{product_id}/devices/{device_id}", access_key, expire_hours, method)
 
-    # 计算签名
-    # 签名顺序: et + "\n" + method + "\n" + res + "\n" + version
-    et = str(expire_time)
-    text_to_sign = f"{et}\n{method}\n{res}\n{version}"
-    signature = hmac.new(
-        key,
-        text_to_sign.encode("utf-8"),
-        hashlib.sha1
-    ).digest()
 
-    # Base64 编码签名
-    sign_base64 = base64.b64encode(signature).decode("utf-8")
+def generate_device_tokens_custom(items: List[Tuple[str, ...]], expire_hours: int = 720) -> List[Dict[str, Any]]:
+    """
+    批量生成设备级 Token（自定义参数）
 
-    # URL 编码
-    res_encoded = quote(res, safe='')
-    sign_encoded = quote(sign_base64, safe='')
+    每个不同的 (access_key, method) 在整批请求中只取一次签名器，
+    单项失败（如密钥格式错误、签名方法不支持）以 error 字段返回，不影响其它项。
 
-    # 组装 Token
-    token = f"version={version}&res={res_encoded}&et={et}&method={method}&sign={sign_encoded}"
+    参数:
+        items: (product_id, device_id, access_key[, method]) 元组列表，method 默认 sha1
+        expire_hours: Token 有效期（小时），默认 720 小时（30天）
 
-    return token
+    返回:
+        与 items 顺序一致的结果列表，成功项包含 token，失败项包含 error
+    """
+    # 整批使用同一个过期时间
+    expire_time = compute_expire_time(expire_hours)
+
+    # 先为每个不同的 (access_key, method) 创建一次签名器，失败时记录错误信息
+    signers: Dict[Tuple[str, str], PreparedSigner] = {}
+    errors: Dict[Tuple[str, str], str] = {}
+    for item in items:
+        pair = (item[2], item[3] if len(item) > 3 else TOKEN_METHOD)
+        if pair in signers or pair in errors:
+            continue
+        access_key, method = pair
+        try:
+            check_method(method)
+        except ValueError as e:
+            errors[pair] = str(e)
+            continue
+        try:
+            signers[pair] = registry.get(access_key, method)
+        except Exception as e:
+            errors[pair] = f"access_key 无效: {e}"
+
+    results = []
+    for item in items:
+        product_id, device_id, access_key = item[:3]
+        pair = (access_key, item[3] if len(item) > 3 else TOKEN_METHOD)
+        result = {"product_id": product_id, "device": device_id}
+        signer = signers.get(pair)
+        if signer is None:
+            result["error"] = errors[pair]
+        else:
+            result["token"] = signer.sign(f"products/{product_id}/devices/{device_id}", expire_time)
+        results.append(result)
+
+    return results
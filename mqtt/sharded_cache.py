@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+分片线程安全 Token 缓存模块
+按 key 哈希分成多个分片，每个分片是一个独立的 TokenCache（或 CompactTokenCache）并有自己的锁，
+不同分片上的读写互不阻塞；用于同步 def 路由、线程池或无 GIL 解释器下的部署，接口与 TokenCache 一致
+
+get_or_create 保证同一个 key 并发未命中时只调用一次生成函数，其他线程等待其结果，
+生成过程中只持有该 key 的等待对象，不持有分片锁
+"""
+
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from mqtt.cache_store import SQLiteTokenStore
+from mqtt.token_cache import EXPIRY_SAMPLE, SCAN_MAX_SLOTS, TokenCache
+
+# scan 游标中分片序号的权重: 游标 = 分片序号 * _SHARD_CURSOR + 分片内游标
+_SHARD_CURSOR = 1 << 40
+
+
+class _Shard:
+    """单个分片: 缓存、锁和正在生成的 key"""
+
+    __slots__ = ("cache", "lock", "pending", "coalesced")
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Future] = {}
+        self.coalesced = 0
+
+
+class ShardedTokenCache:
+    """分片线程安全 Token 缓存（接口与 TokenCache 一致）"""
+
+    def __init__(self, shards: int = 16, cache_class: Type = TokenCache, expire_days: int = 29,
+                 max_entries: int = 100000, max_bytes: Optional[int] = None, margin_seconds: int = 86400,
+                 margin_ratio: float = 0.1, store: Optional[SQLiteTokenStore] = None):
+        """
+        初始化缓存
+
+        参数:
+            shards: 分片数，向上取整为 2 的幂
+            cache_class: 分片使用的缓存类（TokenCache 或 CompactTokenCache）
+            expire_days: Token 中无法解析 et 时使用的缓存过期天数
+            max_entries: 总条目数上限，平均分配到各分片
+            max_bytes: 近似总内存上限（字节），平均分配到各分片，None 表示不限制
+            margin_seconds: 在 Token 的 et 之前提前失效的秒数
+            margin_ratio: 提前失效时间占 Token 有效期的最大比例
+            store: 可选的持久化存储（线程安全），所有分片共用
+        """
+        count = 1
+        while count < shards:
+            count *= 2
+        self.expire_days = expire_days
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.margin_seconds = margin_seconds
+        self.margin_ratio = margin_ratio
+        self.store = store
+        self._mask = count - 1
+        self._shards: List[_Shard] = [
+            _Shard(cache_class(
+                expire_days=expire_days,
+                max_entries=max(1, -(-max_entries // count)),
+                max_bytes=-(-max_bytes // count) if max_bytes is not None else None,
+                margin_seconds=margin_seconds,
+                margin_ratio=margin_ratio,
+                store=store
+            ))
+            for _ in range(count)
+        ]
+
+    def _shard(self, key: str) -> _Shard:
+        """按 key 哈希选择分片"""
+        return self._shards[hash(key) & self._mask]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        获取缓存的 Token
+
+        参数:
+            key: 缓存键
+
+        返回:
+            Token 字符串，如果不存在或已过期则返回 None
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.cache.get(key)
+
+    def set(self, key: str, token: str) -> None:
+        """
+        设置缓存
+
+        参数:
+            key: 缓存键
+            token: Token 字符串
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            shard.cache.set(key, token)
+
+    def get_or_create(self, key: str, generate: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        获取缓存的 Token，不存在时生成并写入；同一 key 的并发未命中只生成一次
+
+        参数:
+            key: 缓存键
+            generate: 生成 Token 的函数，在调用线程中执行，不持有分片锁
+
+        返回:
+            (Token, 是否命中缓存)，等待其他线程生成的结果视为命中
+
+        异常:
+            generate 抛出的异常会传给所有等待该 key 的线程
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            token = shard.cache.get(key)
+            if token is not None:
+                return token, True
+            future = shard.pending.get(key)
+            leader = future is None
+            if leader:
+                future = shard.pending[key] = Future()
+            else:
+                shard.coalesced += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            token = generate()
+        except BaseException as e:
+            with shard.lock:
+                del shard.pending[key]
+            future.set_exception(e)
+            raise
+        with shard.lock:
+            shard.cache.set(key, token)
+            del shard.pending[key]
+        future.set_result(token)
+        return token, False
+
+    def get_response(self, key: str, variant: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        获取缓存的 Token 及其预序列化响应体
+
+        参数:
+            key: 缓存键
+            variant: 响应体变体
+
+        返回:
+            (Token, 响应体)，Token 不存在时均为 None
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.cache.get_response(key, variant)
+
+    def set_response(self, key: str, token: str, variant: str, body: bytes) -> None:
+        """
+        为已缓存的 Token 保存预序列化响应体
+
+        参数:
+            key: 缓存键
+            token: 响应体对应的 Token
+            variant: 响应体变体
+            body: 序列化后的响应体
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            shard.cache.set_response(key, token, variant, body)
+
+    def refresh(self, key: str) -> bool:
+        """
+        删除缓存中的指定 key
+
+        参数:
+            key: 缓存键
+
+        返回:
+            True 如果删除成功，False 如果不存在
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.cache.refresh(key)
+
+    def clear(self) -> None:
+        """清空所有缓存（逐个分片加锁）"""
+        for shard in self._shards:
+            with shard.lock:
+                shard.cache.clear()
+
+    def close(self) -> None:
+        """关闭持久化存储"""
+        if self.store is not None:
+            self.store.close()
+
+    def get_expire_at(self, key: str) -> Optional[float]:
+        """
+        获取缓存条目的失效时间
+
+        参数:
+            key: 缓存键
+
+        返回:
+            失效时间戳，不存在时返回 None
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.cache.get_expire_at(key)
+
+    def purge_expired(self) -> int:
+        """
+        删除所有分片中已过期的条目（逐个分片加锁）
+
+        返回:
+            删除的条目数
+        """
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                removed += shard.cache.purge_expired()
+        return removed
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有缓存信息（不含已过期条目）"""
+        result = {}
+        for shard in self._shards:
+            with shard.lock:
+                result.update(shard.cache.get_all())
+        return result
+
+    def scan(self, cursor: int = 0, limit: int = 100, prefix: str = "",
+             max_scan: int = SCAN_MAX_SLOTS) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        逐个分片分页列出未过期的条目（不含 Token），语义同 TokenCache.scan；
+        扫描完一个分片即返回，检查的槽位数不超过 max_scan，每个分片只在扫描它时加锁
+
+        参数:
+            cursor: 上一页返回的游标，0 表示从头开始
+            limit: 最多返回的条目数
+            prefix: key 前缀过滤
+            max_scan: 最多检查的槽位数
+
+        返回:
+            (条目列表, 下一页游标)，遍历结束时游标为 None
+        """
+        index, position = divmod(cursor, _SHARD_CURSOR)
+        if index >= len(self._shards):
+            return [], None
+        shard = self._shards[index]
+        with shard.lock:
+            entries, position = shard.cache.scan(position, limit, prefix, max_scan)
+        if position is None:
+            index, position = index + 1, 0
+            if index == len(self._shards):
+                return entries, None
+        return entries, index * _SHARD_CURSOR + position
+
+    def expiry_distribution(self, sample: int = EXPIRY_SAMPLE) -> Dict[str, Any]:
+        """
+        汇总各分片的剩余有效期分布，采样数平均分配到各分片
+
+        参数:
+            sample: 最多采样的槽位数
+
+        返回:
+            见 token_cache.expiry_distribution
+        """
+        per_shard = max(1, sample // len(self._shards))
+        sampled = 0
+        buckets = Counter()
+        for shard in self._shards:
+            with shard.lock:
+                distribution = shard.cache.expiry_distribution(per_shard)
+            sampled += distribution["sampled"]
+            buckets.update(distribution["buckets"])
+        return {"sampled": sampled, "buckets": dict(buckets)}
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（各分片汇总）"""
+        shard_stats = []
+        coalesced = 0
+        for shard in self._shards:
+            with shard.lock:
+                shard_stats.append(shard.cache.stats())
+                coalesced += shard.coalesced
+        hits = sum(item["hits"] for item in shard_stats)
+        misses = sum(item["misses"] for item in shard_stats)
+        total = hits + misses
+        counts = [item["count"] for item in shard_stats]
+        return {
+            "count": sum(counts),
+            "bytes": sum(item["bytes"] for item in shard_stats),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "evictions": sum(item["evictions"] for item in shard_stats),
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "shards": len(self._shards),
+            "max_shard_count": max(counts),
+            "coalesced": coalesced,
+            "store": self.store.stats() if self.store is not None else None
+        }
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+跨进程共享内存 Token 缓存模块
+基于 multiprocessing.shared_memory 的固定槽位哈希表，同一主机上的所有 worker 共用
+读操作通过每个槽位的 seqlock 无锁完成，写操作通过文件锁串行化
+"""
+
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from mqtt.token_cache import (
+    EXPIRY_SAMPLE, MAX_RESPONSE_BODIES, SCAN_MAX_SLOTS, compute_expire_at, expiry_distribution
+)
+
+# 共享内存头部: magic, 槽位数, 槽位大小, 代号（清空时递增）, 条目数, 淘汰次数
+_MAGIC = b"CSTOKEN1"
+_HEADER = struct.Struct("<8sIIQqQ")
+_HEADER_SIZE = 64
+_GEN_OFFSET = 16
+_COUNT_OFFSET = 24
+_EVICT_OFFSET = 32
+
+# 槽位头部: seq, 代号, key 哈希, 失效时间, 写入时间, key 长度, token 长度
+_SLOT = struct.Struct("<QQQddHH")
+_SLOT_HEAD_SIZE = 48
+_KEY_MAX = 176
+_TOKEN_MAX = 288
+SLOT_SIZE = _SLOT_HEAD_SIZE + _KEY_MAX + _TOKEN_MAX
+
+_U64 = struct.Struct("<Q")
+_I64 = struct.Struct("<q")
+
+# seqlock 读重试次数
+_READ_RETRIES = 16
+
+# 每次 purge_expired 扫描的槽位数，保证单次调用耗时有界
+_PURGE_WINDOW = 4096
+
+
+def _hash_key(key: bytes) -> int:
+    """计算跨进程稳定的 key 哈希（内置 hash() 在每个进程中随机化）"""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class SharedMemoryTokenCache:
+    """跨进程共享内存 Token 缓存（接口与 TokenCache 一致）"""
+
+    def __init__(self, name: str, expire_days: int = 29, max_entries: int = 100000,
+                 max_bytes: Optional[int] = None, margin_seconds: int = 86400,
+                 margin_ratio: float = 0.1, probe: int = 8):
+        """
+        创建或连接共享内存缓存
+
+        参数:
+            name: 共享内存名称，同名的所有进程共用一张表
+            expire_days: Token 中无法解析 et 时使用的缓存过期天数
+            max_entries: 槽位数（已存在的共享内存以其创建时的槽位数为准）
+            max_bytes: 共享内存最大字节数，None 表示只按 max_entries 分配
+            margin_seconds: 在 Token 的 et 之前提前失效的秒数
+            margin_ratio: 提前失效时间占 Token 有效期的最大比例
+            probe: 线性探测的槽位数
+        """
+        num_slots = max_entries
+        if max_bytes is not None:
+            num_slots = min(num_slots, max(1, (max_bytes - _HEADER_SIZE) // SLOT_SIZE))
+
+        self.name = name
+        self.expire_days = expire_days
+        self.margin_seconds = margin_seconds
+        self.margin_ratio = margin_ratio
+        self.probe = probe
+        self.store = None
+        self.hits = 0
+        self.misses = 0
+        self.oversize = 0
+        self._purge_cursor = 0
+        # 预序列化响应体只保存在当前进程: key -> (Token, {变体: 响应体})，Token 变化后失效
+        self._bodies: Dict[str, Tuple[str, Dict[str, bytes]]] = {}
+
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a+b")
+
+        with self._write_lock():
+            try:
+                self._shm = SharedMemory(name=name, create=True, size=_HEADER_SIZE + num_slots * SLOT_SIZE)
+                self._shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+                _HEADER.pack_into(self._shm.buf, 0, _MAGIC, num_slots, SLOT_SIZE, 1, 0, 0)
+            except FileExistsError:
+                self._shm = SharedMemory(name=name)
+            magic, num_slots, slot_size, _, _, _ = _HEADER.unpack_from(self._shm.buf, 0)
+            if magic != _MAGIC or slot_size != SLOT_SIZE:
+                raise ValueError(f"共享内存 '{name}' 的布局不兼容")
+
+        # 共享内存的生命周期与主机一致，不随任何单个 worker 退出而删除
+        try:
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+
+        self._buf = self._shm.buf
+        self.max_entries = num_slots
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        获取缓存的 Token
+
+        参数:
+            key: 缓存键
+
+        返回:
+            Token 字符串，如果不存在或已过期则返回 None
+        """
+        key_bytes = key.encode("utf-8")
+        found = self._find(key_bytes, _hash_key(key_bytes))
+        if found is None:
+            self.misses += 1
+            return None
+
+        index, entry = found
+        if time.time() >= entry[2]:
+            with self._write_lock():
+                self._remove_if(index, key_bytes)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[5].decode("utf-8")
+
+    def set(self, key: str, token: str) -> None:
+        """
+        设置缓存
+
+        参数:
+            key: 缓存键
+            token: Token 字符串
+        """
+        now = time.time()
+        expire_at = compute_expire_at(token, now, self.margin_seconds, self.margin_ratio,
+                                      self.expire_days * 24 * 3600)
+        if expire_at <= now:
+            return
+
+        key_bytes = key.encode("utf-8")
+        token_bytes = token.encode("utf-8")
+        if len(key_bytes) > _KEY_MAX or len(token_bytes) > _TOKEN_MAX:
+            self.oversize += 1
+            return
+
+        key_hash = _hash_key(key_bytes)
+        with self._write_lock():
+            generation = self._generation()
+            target = free = victim = None
+            free_is_new = False
+            victim_expire_at = float("inf")
+
+            for index in self._probe_indexes(key_hash):
+                entry = self._read(index)
+                if entry is None or entry[0] != generation:
+                    if free is None or not free_is_new:
+                        free, free_is_new = index, True
+                elif entry[4] == key_bytes:
+                    target = index
+                    break
+                elif entry[2] <= now:
+                    if free is None:
+                        free = index
+                elif entry[2] < victim_expire_at:
+                    victim, victim_expire_at = index, entry[2]
+
+            if target is None:
+                if free is not None:
+                    target = free
+                    if free_is_new:
+                        self._add_header(_COUNT_OFFSET, 1)
+                else:
+                    # 探测范围内没有空位，淘汰最早失效的条目
+                    target = victim
+                    self._add_header(_EVICT_OFFSET, 1)
+
+            self._write(target, generation, key_hash, expire_at, now, key_bytes, token_bytes)
+
+    def get_or_create(self, key: str, generate: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        获取缓存的 Token，不存在时调用 generate 生成并写入（不跨进程合并，不同 worker 可能各自生成一次）
+
+        参数:
+            key: 缓存键
+            generate: 生成 Token 的函数
+
+        返回:
+            (Token, 是否命中缓存)
+        """
+        token = self.get(key)
+        if token is not None:
+            return token, True
+        token = generate()
+        self.set(key, token)
+        return token, False
+
+    def get_response(self, key: str, variant: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        获取缓存的 Token 及当前进程保存的预序列化响应体
+
+        参数:
+            key: 缓存键
+            variant: 响应体变体
+
+        返回:
+            (Token, 响应体)，Token 不存在时均为 None，尚未保存响应体时响应体为 None
+        """
+        token = self.get(key)
+        if token is None:
+            return None, None
+        cached = self._bodies.get(key)
+        if cached is None or cached[0] != token:
+            return token, None
+        return token, cached[1].get(variant)
+
+    def set_response(self, key: str, token: str, variant: str, body: bytes) -> None:
+        """
+        在当前进程保存 Token 的预序列化响应体（其它 worker 更新 Token 后按 Token 比较自动失效）
+
+        参数:
+            key: 缓存键
+            token: 响应体对应的 Token
+            variant: 响应体变体
+            body: 序列化后的响应体
+        """
+        cached = self._bodies.get(key)
+        if cached is None or cached[0] != token:
+            if len(self._bodies) >= self.max_entries:
+                self._bodies.clear()
+            cached = self._bodies[key] = (token, {})
+        if len(cached[1]) < MAX_RESPONSE_BODIES:
+            cached[1][variant] = body
+
+    def refresh(self, key: str) -> bool:
+        """
+        删除缓存中的指定 key（对所有 worker 立即生效）
+
+        参数:
+            key: 缓存键
+
+        返回:
+            True 如果删除成功，False 如果不存在
+        """
+        self._bodies.pop(key, None)
+        key_bytes = key.encode("utf-8")
+        found = self._find(key_bytes, _hash_key(key_bytes))
+        if found is None:
+            return False
+        with self._write_lock():
+            return self._remove_if(found[0], key_bytes)
+
+    def clear(self) -> None:
+        """清空所有缓存（递增代号，旧条目对所有 worker 立即失效）"""
+        self._bodies.clear()
+        with self._write_lock():
+            _U64.pack_into(self._buf, _GEN_OFFSET, self._generation() + 1)
+            _I64.pack_into(self._buf, _COUNT_OFFSET, 0)
+
+    def close(self) -> None:
+        """断开当前进程与共享内存的连接"""
+        self._buf = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self) -> None:
+        """删除共享内存（所有 worker 停止后调用）"""
+        # SharedMemory.unlink() 会向 resource_tracker 注销，先重新登记以保持计数一致
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+
+    def get_expire_at(self, key: str) -> Optional[float]:
+        """
+        获取缓存条目的失效时间
+
+        参数:
+            key: 缓存键
+
+        返回:
+            失效时间戳，不存在时返回 None
+        """
+        key_bytes = key.encode("utf-8")
+        found = self._find(key_bytes, _hash_key(key_bytes))
+        return found[1][2] if found is not None else None
+
+    def purge_expired(self) -> int:
+        """
+        删除已过期的条目，每次只扫描固定数量的槽位
+
+        返回:
+            删除的条目数
+        """
+        now = time.time()
+        removed = 0
+        with self._write_lock():
+            generation = self._generation()
+            start = self._purge_cursor
+            end = min(start + _PURGE_WINDOW, self.max_entries)
+            for index in range(start, end):
+                entry = self._read(index)
+                if entry is not None and entry[0] == generation and entry[2] <= now:
+                    self._clear_slot(index)
+                    self._add_header(_COUNT_OFFSET, -1)
+                    removed += 1
+            self._purge_cursor = end % self.max_entries
+        return removed
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有缓存信息（不含已过期条目）"""
+        now = time.time()
+        generation = self._generation()
+        result = {}
+        for index in range(self.max_entries):
+            entry = self._read(index)
+            if entry is None or entry[0] != generation or entry[2] <= now:
+                continue
+            result[entry[4].decode("utf-8")] = {
+                'token': entry[5].decode("utf-8"),
+                'timestamp': entry[3],
+                'expire_at': entry[2],
+                'size': SLOT_SIZE
+            }
+        return result
+
+    def scan(self, cursor: int = 0, limit: int = 100, prefix: str = "",
+             max_scan: int = SCAN_MAX_SLOTS) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        按槽位顺序分页列出未过期的条目（不含 Token），语义同 TokenCache.scan；
+        只读不加锁，与其他进程的写入并发时按 seqlock 读取
+
+        参数:
+            cursor: 上一页返回的游标，0 表示从头开始
+            limit: 最多返回的条目数
+            prefix: key 前缀过滤
+            max_scan: 最多检查的槽位数
+
+        返回:
+            (条目列表, 下一页游标)，遍历结束时游标为 None
+        """
+        now = time.time()
+        generation = self._generation()
+        prefix_bytes = prefix.encode("utf-8")
+        end = min(self.max_entries, cursor + max_scan)
+        entries = []
+        index = cursor
+        while index < end and len(entries) < limit:
+            entry = self._read(index)
+            index += 1
+            if entry is None or entry[0] != generation or entry[2] <= now or not entry[4].startswith(prefix_bytes):
+                continue
+            entries.append({
+                "key": entry[4].decode("utf-8"),
+                "timestamp": entry[3],
+                "expire_at": entry[2],
+                "size": SLOT_SIZE
+            })
+        return entries, index if index < self.max_entries else None
+
+    def expiry_distribution(self, sample: int = EXPIRY_SAMPLE) -> Dict[str, Any]:
+        """
+        按槽位等间隔采样估算条目的剩余有效期分布
+
+        参数:
+            sample: 最多采样的槽位数
+
+        返回:
+            见 token_cache.expiry_distribution
+        """
+        generation = self._generation()
+        step = max(1, self.max_entries // sample)
+        expire_times = []
+        for index in range(0, self.max_entries, step):
+            entry = self._read(index)
+            if entry is not None and entry[0] == generation:
+                expire_times.append(entry[2])
+        count = _I64.unpack_from(self._buf, _COUNT_OFFSET)[0]
+        return expiry_distribution(expire_times, time.time(), count)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（命中/未命中为当前进程计数，其余为全局计数）"""
+        total = self.hits + self.misses
+        return {
+            "count": _I64.unpack_from(self._buf, _COUNT_OFFSET)[0],
+            "bytes": self._shm.size,
+            "max_entries": self.max_entries,
+            "max_bytes": self._shm.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": _U64.unpack_from(self._buf, _EVICT_OFFSET)[0],
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "oversize": self.oversize,
+            "shm_name": self.name,
+            "store": None
+        }
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """跨进程写锁（线程锁 + 文件锁）"""
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _generation(self) -> int:
+        """读取当前代号"""
+        return _U64.unpack_from(self._buf, _GEN_OFFSET)[0]
+
+    def _add_header(self, offset: int, delta: int) -> None:
+        """修改头部计数（需持有写锁）"""
+        _I64.pack_into(self._buf, offset, _I64.unpack_from(self._buf, offset)[0] + delta)
+
+    def _probe_indexes(self, key_hash: int) -> Iterator[int]:
+        """线性探测的槽位序列"""
+        num_slots = self.max_entries
+        for i in range(min(self.probe, num_slots)):
+            yield (key_hash + i) % num_slots
+
+    def _read(self, index: int, key_hash: Optional[int] = None) -> Optional[Tuple[int, int, float, float, bytes, bytes]]:
+        """
+        按 seqlock 协议读取槽位
+
+        参数:
+            index: 槽位下标
+            key_hash: 指定时只读取哈希匹配的槽位
+
+        返回:
+            (代号, key 哈希, 失效时间, 写入时间, key, token)，空槽位或读取失败返回 None
+        """
+        buf = self._buf
+        offset = _HEADER_SIZE + index * SLOT_SIZE
+        data = offset + _SLOT_HEAD_SIZE
+        for _ in range(_READ_RETRIES):
+            seq, generation, slot_hash, expire_at, timestamp, key_len, token_len = _SLOT.unpack_from(buf, offset)
+            if seq & 1:
+                continue
+            if key_len == 0 or (key_hash is not None and slot_hash != key_hash):
+                return None
+            if key_len > _KEY_MAX or token_len > _TOKEN_MAX:
+                continue
+            key = bytes(buf[data:data + key_len])
+            token = bytes(buf[data + _KEY_MAX:data + _KEY_MAX + token_len])
+            if _U64.unpack_from(buf, offset)[0] == seq:
+                return generation, slot_hash, expire_at, timestamp, key, token
+        return None
+
+    def _find(self, key_bytes: bytes, key_hash: int) -> Optional[Tuple[int, tuple]]:
+        """在探测范围内查找 key，返回 (槽位下标, 槽位内容)"""
+        generation = self._generation()
+        for index in self._probe_indexes(key_hash):
+            entry = self._read(index, key_hash)
+            if entry is not None and entry[0] == generation and entry[4] == key_bytes:
+                return index, entry
+        return None
+
+    def _write(self, index: int, generation: int, key_hash: int, expire_at: float,
+               timestamp: float, key_bytes: bytes, token_bytes: bytes) -> None:
+        """按 seqlock 协议写入槽位（需持有写锁）"""
+        buf = self._buf
+        offset = _HEADER_SIZE + index * SLOT_SIZE
+        data = offset + _SLOT_HEAD_SIZE
+        seq = _U64.unpack_from(buf, offset)[0]
+        _U64.pack_into(buf, offset, seq + 1)
+        _SLOT.pack_into(buf, offset, seq + 1, generation, key_hash, expire_at, timestamp,
+                        len(key_bytes), len(token_bytes))
+        buf[data:data + len(key_bytes)] = key_bytes
+        buf[data + _KEY_MAX:data + _KEY_MAX + len(token_bytes)] = token_bytes
+        _U64.pack_into(buf, offset, seq + 2)
+
+    def _clear_slot(self, index: int) -> None:
+        """将槽位标记为空（需持有写锁）"""
+        self._write(index, 0, 0, 0.0, 0.0, b"", b"")
+
+    def _remove_if(self, index: int, key_bytes: bytes) -> bool:
+        """槽位仍保存该 key 时将其删除（需持有写锁）"""
+        entry = self._read(index)
+        if entry is None or entry[0] != self._generation() or entry[4] != key_bytes:
+            return False
+        self._clear_slot(index)
+        self._add_header(_COUNT_OFFSET, -1)
+        return True
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token 签名器模块
+所有 Token 生成和校验共用的签名引擎，支持 sha1、sha256、md5，
+缓存已解码密钥和预置 HMAC 状态，每次签名只需 copy() + update + digest
+"""
+
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from mqtt.config import get_token_config
+from mqtt.metrics import sign_seconds
+
+# Token 版本
+TOKEN_VERSION = "2018-10-31"
+
+# 默认签名方法
+TOKEN_METHOD = "sha1"
+
+# OneNET 支持的签名方法
+SIGN_METHODS = {
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "md5": hashlib.md5
+}
+
+# 签名结果 Base64 后需要 URL 编码的字符
+_SIGN_QUOTE = str.maketrans({"+": "%2B", "/": "%2F", "=": "%3D"})
+
+# 每种方法在 Token 中 et 之后、sign 之前的固定片段
+_METHOD_SEGMENTS = {method: f"&method={method}&sign=" for method in SIGN_METHODS}
+
+
+def key_fingerprint(access_key: Union[str, bytes]) -> str:
+    """
+    计算访问密钥指纹，用于索引缓存而不保存密钥本身
+
+    参数:
+        access_key: Base64 编码的密钥字符串，或已解码的密钥字节
+
+    返回:
+        32 位十六进制指纹字符串
+    """
+    if isinstance(access_key, str):
+        data = b"b64:" + access_key.encode("utf-8")
+    else:
+        data = b"raw:" + access_key
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def compute_expire_time(expire_hours: int, now: Optional[float] = None, bucket_seconds: Optional[int] = None) -> int:
+    """
+    计算 Token 的过期时间戳
+
+    启用时间桶对齐时 et 向上取整到桶边界，有效期不短于 expire_hours，
+    同一时间桶内相同资源和密钥在任何节点上都生成相同的 Token
+
+    参数:
+        expire_hours: Token 有效期（小时）
+        now: 当前时间戳，不传则使用 time.time()（传入未来时间可预先计算下一个时间桶的 Token）
+        bucket_seconds: 时间桶（秒），不传则使用配置中的 expire_bucket_seconds，0 表示不对齐
+
+    返回:
+        过期时间戳（秒）
+    """
+    et = int(time.time() if now is None else now) + expire_hours * 3600
+    if bucket_seconds is None:
+        bucket_seconds = get_token_config()["expire_bucket_seconds"]
+    if bucket_seconds > 0:
+        et = -(-et // bucket_seconds) * bucket_seconds
+    return et
+
+
+def check_method(method: str) -> str:
+    """
+    校验签名方法
+
+    参数:
+        method: 签名方法名称
+
+    返回:
+        签名方法名称
+
+    异常:
+        ValueError: 不支持的签名方法
+    """
+    if method not in SIGN_METHODS:
+        raise ValueError(f"不支持的签名方法: {method}（可选 {', '.join(SIGN_METHODS)}）")
+    return method
+
+
+@lru_cache(maxsize=4096)
+def resource_templates(res: str, method: str = TOKEN_METHOD) -> Tuple[bytes, str]:
+    """
+    预计算资源路径相关的签名后缀和 Token 前缀
+
+    参数:
+        res: 资源路径（如 products/{product_id}/devices/{device_id}）
+        method: 签名方法
+
+    返回:
+        (签名串中 et 之后的字节, Token 中 et 之前的 URL 编码前缀)
+    """
+    sign_suffix = f"\n{method}\n{res}\n{TOKEN_VERSION}".encode("utf-8")
+    token_prefix = f"version={TOKEN_VERSION}&res={quote(res, safe='')}&et="
+    return sign_suffix, token_prefix
+
+
+class PreparedSigner:
+    """
+    预置密钥和签名方法的签名器
+
+    构造时完成密钥解码后的 HMAC 初始化，每次签名只需 copy() + 一次 update + digest，
+    签名串和 Token 的固定部分都来自预编码模板
+    """
+
+    __slots__ = ("method", "_mac", "_segment")
+
+    def __init__(self, access_key: bytes, method: str = TOKEN_METHOD):
+        """
+        初始化签名器
+
+        参数:
+            access_key: 解码后的访问密钥
+            method: 签名方法（sha1、sha256 或 md5）
+
+        异常:
+            ValueError: 不支持的签名方法
+        """
+        self.method = check_method(method)
+        self._mac = hmac.new(access_key, digestmod=SIGN_METHODS[method])
+        self._segment = _METHOD_SEGMENTS[method]
+
+    def sign(self, res: str, expire_time: int) -> str:
+        """
+        生成 Token
+
+        参数:
+            res: 资源路径
+            expire_time: 过期时间戳（秒）
+
+        返回:
+            Token 字符串
+        """
+        start = time.perf_counter()
+        sign_suffix, token_prefix = resource_templates(res, self.method)
+
+        # 签名顺序: et + "\n" + method + "\n" + res + "\n" + version
+        et = str(expire_time)
+        mac = self._mac.copy()
+        mac.update(et.encode("ascii") + sign_suffix)
+        sign_encoded = base64.b64encode(mac.digest()).decode("ascii").translate(_SIGN_QUOTE)
+
+        token = f"{token_prefix}{et}{self._segment}{sign_encoded}"
+        sign_seconds.observe(time.perf_counter() - start)
+        return token
+
+    def sign_many(self, resources: Iterable[str], expire_time: int) -> List[str]:
+        """
+        使用同一个过期时间批量生成 Token
+
+        et 只编码一次，循环内不做方法和模板以外的查找，签名耗时按批次平均计入监控
+
+        参数:
+            resources: 资源路径列表
+            expire_time: 过期时间戳（秒）
+
+        返回:
+            与 resources 顺序一致的 Token 列表
+        """
+        start = time.perf_counter()
+        method = self.method
+        segment = self._segment
+        base = self._mac
+        et = str(expire_time)
+        et_bytes = et.encode("ascii")
+        b64encode = base64.b64encode
+
+        tokens = []
+        for res in resources:
+            sign_suffix, token_prefix = resource_templates(res, method)
+            mac = base.copy()
+            mac.update(et_bytes + sign_suffix)
+            sign_encoded = b64encode(mac.digest()).decode("ascii").translate(_SIGN_QUOTE)
+            tokens.append(f"{token_prefix}{et}{segment}{sign_encoded}")
+
+        if tokens:
+            sign_seconds.observe((time.perf_counter() - start) / len(tokens), len(tokens))
+        return tokens
+
+    def digest(self, res: str, expire_time: int) -> bytes:
+        """
+        计算原始签名（用于校验 Token）
+
+        参数:
+            res: 资源路径（未 URL 编码）
+            expire_time: 过期时间戳（秒）
+
+        返回:
+            HMAC 签名字节
+        """
+        mac = self._mac.copy()
+        mac.update(str(expire_time).encode("ascii") + resource_templates(res, self.method)[0])
+        return mac.digest()
+
+
+class SignerRegistry:
+    """按密钥指纹和签名方法索引的签名器 LRU 缓存（线程安全，签名可能在工作线程中执行）"""
+
+    def __init__(self, max_size: int = 1024):
+        """
+        初始化注册表
+
+        参数:
+            max_size: 最多缓存的签名器数量，默认 1024
+        """
+        self._signers: "OrderedDict[str, PreparedSigner]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, access_key: Union[str, bytes], method: str = TOKEN_METHOD) -> PreparedSigner:
+        """
+        获取访问密钥和签名方法对应的签名器，不存在时解码密钥并创建
+
+        参数:
+            access_key: Base64 编码的密钥字符串，或已解码的密钥字节
+            method: 签名方法（sha1、sha256 或 md5）
+
+        返回:
+            PreparedSigner 实例
+
+        异常:
+            ValueError: 密钥不是合法的 Base64、解码后为空，或不支持的签名方法
+        """
+        cache_key = key_fingerprint(access_key)
+        if method != TOKEN_METHOD:
+            cache_key = f"{cache_key}:{method}"
+        with self._lock:
+            signer = self._signers.get(cache_key)
+            if signer is not None:
+                self.hits += 1
+                self._signers.move_to_end(cache_key)
+                return signer
+            self.misses += 1
+
+        # 解码密钥和初始化 HMAC 不持锁；并发创建同一个签名器时后写入的覆盖先写入的，结果相同
+        check_method(method)
+        key = base64.b64decode(access_key, validate=True) if isinstance(access_key, str) else access_key
+        if not key:
+            raise ValueError("access_key 为空")
+        signer = PreparedSigner(key, method)
+        with self._lock:
+            self._signers[cache_key] = signer
+            self._signers.move_to_end(cache_key)
+            if len(self._signers) > self.max_size:
+                self._signers.popitem(last=False)
+        return signer
+
+    def clear(self) -> None:
+        """清空所有签名器"""
+        with self._lock:
+            self._signers.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中率统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._signers),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# 创建全局签名器注册表
+registry = SignerRegistry(max_size=1024)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+请求合并模块
+同一个 key 的并发缓存未命中只执行一次生成，其余请求等待同一个结果
+"""
+
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """按 key 合并并发调用"""
+
+    def __init__(self):
+        """初始化合并器"""
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行 fn，同一 key 已有执行中的调用时等待其结果
+
+        fn 在独立的任务中执行，发起调用的请求被取消（如客户端断开）时只取消它自己的等待，
+        生成继续进行，其它等待者照常拿到结果
+
+        参数:
+            key: 合并键
+            fn: 无参函数，可以返回普通值或 awaitable
+
+        返回:
+            (结果, 是否复用了其它请求的结果)
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.get_running_loop().create_task(self._run(key, fn))
+        # 所有等待者都已取消时读取异常，避免 "exception was never retrieved" 警告
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = task
+        self.leaders += 1
+        return await asyncio.shield(task), False
+
+    async def _run(self, key: str, fn: Callable[[], Any]) -> Any:
+        """执行 fn 并在结束后移除合并记录"""
+        try:
+            result = fn()
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+
+# 创建全局合并器
+flights = SingleFlight()
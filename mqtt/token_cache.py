@@ -6,22 +6,160 @@ Token 缓存模块
 提供 Token 缓存、自动刷新和强制刷新功能
 """
 
+import bisect
+import heapq
+import sys
 import time
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Iterable, List, Tuple
+
+from mqtt.cache_store import SQLiteTokenStore
+from mqtt.config import get_cache_config
+from mqtt.signer import TOKEN_METHOD, key_fingerprint
+
+# 每个缓存条目除 key/token 字符串外的近似内存开销（字节）
+_ENTRY_OVERHEAD = 360
+
+# 每个条目最多保存的预序列化响应体数量（不同路由回显的设备名称可能不同）
+MAX_RESPONSE_BODIES = 4
+
+# 单次 scan 最多检查的槽位数，保证每次调用耗时与缓存规模无关
+SCAN_MAX_SLOTS = 4096
+
+# 过期时间分布默认采样的槽位数
+EXPIRY_SAMPLE = 4096
+
+# 过期时间分布区间: (剩余秒数上界, 标签)，超出最后一个上界的计入 ">30d"
+EXPIRY_BUCKETS = (
+    (0, "expired"),
+    (3600, "<1h"),
+    (6 * 3600, "1h-6h"),
+    (86400, "6h-1d"),
+    (7 * 86400, "1d-7d"),
+    (30 * 86400, "7d-30d"),
+)
+
+
+def make_key(res: str, access_key: str, expire_hours: int, method: str = TOKEN_METHOD) -> str:
+    """
+    生成缓存键，只包含密钥指纹，不保存密钥本身
+
+    参数:
+        res: 资源路径
+        access_key: 访问密钥（Base64 编码）
+        expire_hours: Token 有效期（小时）
+        method: 签名方法
+
+    返回:
+        缓存键字符串，格式: {res}|{fingerprint}|{expire_hours}h，非默认签名方法时追加 |{method}
+    """
+    key = f"{res}|{key_fingerprint(access_key)}|{expire_hours}h"
+    return key if method == TOKEN_METHOD else f"{key}|{method}"
+
+
+def parse_expire_time(token: str) -> Optional[int]:
+    """
+    从 Token 中解析 et 字段
+
+    参数:
+        token: Token 字符串
+
+    返回:
+        过期时间戳（秒），解析失败返回 None
+    """
+    start = token.find("&et=")
+    if start < 0:
+        return None
+    start += 4
+    end = token.find("&", start)
+    value = token[start:end] if end >= 0 else token[start:]
+    return int(value) if value.isdigit() else None
+
+
+def compute_expire_at(token: str, now: float, margin_seconds: float, margin_ratio: float,
+                      fallback_seconds: float) -> float:
+    """
+    计算缓存条目的失效时间
+
+    参数:
+        token: Token 字符串
+        now: 当前时间戳
+        margin_seconds: 在 et 之前提前失效的秒数
+        margin_ratio: 提前失效时间占 Token 剩余有效期的最大比例
+        fallback_seconds: 无法解析 et 时的缓存秒数
+
+    返回:
+        失效时间戳，取 Token 的 et 减去安全余量
+    """
+    expire_time = parse_expire_time(token)
+    if expire_time is None:
+        return now + fallback_seconds
+
+    lifetime = expire_time - now
+    margin = min(margin_seconds, lifetime * margin_ratio)
+    return expire_time - margin
+
+
+def expiry_distribution(expire_times: Iterable[float], now: float, total: int) -> Dict[str, Any]:
+    """
+    统计失效时间样本的分布，并按条目总数估算各区间的条目数
+
+    参数:
+        expire_times: 采样得到的失效时间戳
+        now: 当前时间戳
+        total: 缓存条目总数
+
+    返回:
+        {"sampled": 样本数, "buckets": {区间标签: 估算条目数}}，区间按剩余有效期划分，
+        "expired" 为已过期但尚未清理的条目
+    """
+    bounds = [bound for bound, _ in EXPIRY_BUCKETS]
+    labels = [label for _, label in EXPIRY_BUCKETS] + [">30d"]
+    counts = [0] * len(labels)
+    sampled = 0
+    for expire_at in expire_times:
+        counts[bisect.bisect_left(bounds, expire_at - now)] += 1
+        sampled += 1
+    scale = total / sampled if sampled else 0
+    return {
+        "sampled": sampled,
+        "buckets": {label: round(count * scale) for label, count in zip(labels, counts)}
+    }
 
 
 class TokenCache:
-    """Token 缓存类"""
+    """Token 缓存类（有界 LRU）"""
 
-    def __init__(self, expire_days: int = 29):
+    def __init__(self, expire_days: int = 29, max_entries: int = 100000,
+                 max_bytes: Optional[int] = None, margin_seconds: int = 86400,
+                 margin_ratio: float = 0.1, store: Optional[SQLiteTokenStore] = None):
         """
         初始化缓存
 
         参数:
-            expire_days: 缓存过期天数，默认 29 天
+            expire_days: Token 中无法解析 et 时使用的缓存过期天数，默认 29 天
+            max_entries: 最大条目数，超出时淘汰最久未使用的条目
+            max_bytes: 近似最大内存占用（字节），None 表示不限制
+            margin_seconds: 在 Token 的 et 之前提前失效的秒数，默认 1 天
+            margin_ratio: 提前失效时间占 Token 有效期的最大比例，避免短期 Token 无法缓存
+            store: 可选的持久化存储，内存未命中时按需加载，写入异步落盘
         """
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 槽位 -> key，条目删除后槽位复用，位置不随 LRU 顺序变化，供 scan 游标和采样使用
+        self._slot_keys: List[Optional[str]] = []
+        self._free_slots: List[int] = []
+        # (失效时间, key) 小顶堆，用于主动清理过期条目；条目更新后旧记录惰性跳过
+        self._expiry_heap: List[Tuple[float, str]] = []
         self.expire_days = expire_days
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.margin_seconds = margin_seconds
+        self.margin_ratio = margin_ratio
+        self.store = store
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def get(self, key: str) -> Optional[str]:
         """
@@ -33,16 +171,21 @@ class TokenCache:
         返回:
             Token 字符串，如果不存在或已过期则返回 None
         """
-        if key not in self.cache:
+        cached = self.cache.get(key)
+        if cached is None and self.store is not None:
+            cached = self._load(key)
+        if cached is None:
+            self.misses += 1
             return None
 
-        cached = self.cache[key]
-
-        # 检查是否过期（29 天）
-        if self._is_expired(cached['timestamp'], self.expire_days):
-            del self.cache[key]
+        # 检查是否过期（et 减去安全余量）
+        if time.time() >= cached['expire_at']:
+            self._remove(key)
+            self.misses += 1
             return None
 
+        self.cache.move_to_end(key)
+        self.hits += 1
         return cached['token']
 
     def set(self, key: str, token: str) -> None:
@@ -53,10 +196,73 @@ class TokenCache:
             key: 缓存键
             token: Token 字符串
         """
-        self.cache[key] = {
-            'token': token,
-            'timestamp': time.time()
-        }
+        now = time.time()
+        expire_at = self._expire_at(token, now)
+        if expire_at <= now:
+            return
+
+        self._insert(key, token, now, expire_at)
+        if self.store is not None:
+            self.store.put(key, token, expire_at)
+
+    def get_or_create(self, key: str, generate: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        获取缓存的 Token，不存在时调用 generate 生成并写入（单线程使用，多线程请使用 ShardedTokenCache）
+
+        参数:
+            key: 缓存键
+            generate: 生成 Token 的函数
+
+        返回:
+            (Token, 是否命中缓存)
+        """
+        token = self.get(key)
+        if token is not None:
+            return token, True
+        token = generate()
+        self.set(key, token)
+        return token, False
+
+    def get_response(self, key: str, variant: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        获取缓存的 Token 及其预序列化响应体（命中统计与 get 相同）
+
+        参数:
+            key: 缓存键
+            variant: 响应体变体（同一 Token 在不同路由下的响应内容标识）
+
+        返回:
+            (Token, 响应体)，Token 不存在时均为 None，尚未保存响应体时响应体为 None
+        """
+        token = self.get(key)
+        if token is None:
+            return None, None
+        bodies = self.cache[key].get('bodies')
+        return token, bodies.get(variant) if bodies else None
+
+    def set_response(self, key: str, token: str, variant: str, body: bytes) -> None:
+        """
+        为已缓存的 Token 保存预序列化响应体，Token 被替换后随条目一起失效
+
+        参数:
+            key: 缓存键
+            token: 响应体对应的 Token，与当前缓存的 Token 不同时忽略
+            variant: 响应体变体
+            body: 序列化后的响应体
+        """
+        entry = self.cache.get(key)
+        if entry is None or entry['token'] != token:
+            return
+        bodies = entry.get('bodies')
+        if bodies is None:
+            bodies = entry['bodies'] = {}
+        elif variant in bodies or len(bodies) >= MAX_RESPONSE_BODIES:
+            return
+        bodies[variant] = body
+        size = sys.getsizeof(variant) + sys.getsizeof(body)
+        entry['size'] += size
+        self.bytes += size
+        self._evict()
 
     def refresh(self, key: str) -> bool:
         """
@@ -68,33 +274,236 @@ class TokenCache:
         返回:
             True 如果删除成功，False 如果不存在
         """
+        if self.store is not None:
+            self.store.delete(key)
         if key in self.cache:
-            del self.cache[key]
+            self._remove(key)
             return True
         return False
 
     def clear(self) -> None:
         """清空所有缓存"""
         self.cache.clear()
+        self._expiry_heap.clear()
+        self._slot_keys.clear()
+        self._free_slots.clear()
+        self.bytes = 0
+        if self.store is not None:
+            self.store.clear()
+
+    def close(self) -> None:
+        """关闭持久化存储，写入所有待处理变更"""
+        if self.store is not None:
+            self.store.close()
+
+    def get_expire_at(self, key: str) -> Optional[float]:
+        """
+        获取缓存条目的失效时间
+
+        参数:
+            key: 缓存键
+
+        返回:
+            失效时间戳，不存在时返回 None
+        """
+        cached = self.cache.get(key)
+        return cached['expire_at'] if cached is not None else None
+
+    def purge_expired(self) -> int:
+        """
+        主动删除所有已过期的条目
+
+        返回:
+            删除的条目数
+        """
+        now = time.time()
+        removed = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expire_at, key = heapq.heappop(heap)
+            cached = self.cache.get(key)
+            if cached is not None and cached['expire_at'] == expire_at:
+                self._remove(key)
+                self.evictions += 1
+                removed += 1
+        return removed
 
     def get_all(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有缓存信息"""
-        return self.cache.copy()
+        """获取所有缓存信息（不含已过期条目和预序列化响应体）"""
+        self.purge_expired()
+        return {
+            key: {name: value for name, value in entry.items() if name not in ('bodies', 'slot')}
+            for key, entry in self.cache.items()
+        }
 
-    def _is_expired(self, timestamp: float, expire_days: int) -> bool:
+    def scan(self, cursor: int = 0, limit: int = 100, prefix: str = "",
+             max_scan: int = SCAN_MAX_SLOTS) -> Tuple[List[Dict[str, Any]], Optional[int]]:
         """
-        检查是否过期
+        按槽位顺序分页列出未过期的条目（不含 Token 和响应体）
+
+        每次最多检查 max_scan 个槽位，匹配的条目较少时可能返回不足 limit 条甚至空页，
+        此时按返回的游标继续即可；整个遍历期间一直存在的条目恰好返回一次
 
         参数:
-            timestamp: 时间戳
-            expire_days: 过期天数
+            cursor: 上一页返回的游标，0 表示从头开始
+            limit: 最多返回的条目数
+            prefix: key 前缀过滤
+            max_scan: 最多检查的槽位数
 
         返回:
-            True 如果已过期
+            (条目列表, 下一页游标)，遍历结束时游标为 None
+        """
+        now = time.time()
+        slot_keys = self._slot_keys
+        end = min(len(slot_keys), cursor + max_scan)
+        entries = []
+        slot = cursor
+        while slot < end and len(entries) < limit:
+            key = slot_keys[slot]
+            slot += 1
+            if key is None or not key.startswith(prefix):
+                continue
+            entry = self.cache[key]
+            if entry['expire_at'] <= now:
+                continue
+            entries.append({
+                "key": key,
+                "timestamp": entry['timestamp'],
+                "expire_at": entry['expire_at'],
+                "size": entry['size']
+            })
+        return entries, slot if slot < len(slot_keys) else None
+
+    def expiry_distribution(self, sample: int = EXPIRY_SAMPLE) -> Dict[str, Any]:
         """
-        expire_seconds = expire_days * 24 * 3600
-        return (time.time() - timestamp) > expire_seconds
+        按槽位等间隔采样估算条目的剩余有效期分布
+
+        参数:
+            sample: 最多采样的槽位数
+
+        返回:
+            见 expiry_distribution
+        """
+        slot_keys = self._slot_keys
+        step = max(1, len(slot_keys) // sample)
+        cache = self.cache
+        expire_times = (cache[key]['expire_at'] for key in slot_keys[::step] if key is not None)
+        return expiry_distribution(expire_times, time.time(), len(cache))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "count": len(self.cache),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "store": self.store.stats() if self.store is not None else None
+        }
+
+    def _expire_at(self, token: str, now: float) -> float:
+        """计算缓存条目的失效时间"""
+        return compute_expire_at(token, now, self.margin_seconds, self.margin_ratio,
+                                 self.expire_days * 24 * 3600)
+
+    def _insert(self, key: str, token: str, timestamp: float, expire_at: float) -> Dict[str, Any]:
+        """写入内存条目并按上限淘汰"""
+        if key in self.cache:
+            self._remove(key)
+
+        size = sys.getsizeof(key) + sys.getsizeof(token) + _ENTRY_OVERHEAD
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_keys[slot] = key
+        else:
+            slot = len(self._slot_keys)
+            self._slot_keys.append(key)
+        entry = {
+            'token': token,
+            'timestamp': timestamp,
+            'expire_at': expire_at,
+            'size': size,
+            'slot': slot
+        }
+        self.cache[key] = entry
+        self.bytes += size
+        heapq.heappush(self._expiry_heap, (expire_at, key))
+        self._evict()
+        self._compact_heap()
+        return entry
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        """从持久化存储按需加载条目到内存"""
+        row = self.store.load(key)
+        if row is None:
+            return None
+        token, expire_at = row
+        return self._insert(key, token, time.time(), expire_at)
+
+    def _remove(self, key: str) -> None:
+        """删除条目并更新内存统计"""
+        entry = self.cache.pop(key)
+        self.bytes -= entry['size']
+        self._free_slot(entry['slot'])
+
+    def _evict(self) -> None:
+        """按 LRU 顺序淘汰超出条目数或内存上限的条目"""
+        while self.cache and (
+            len(self.cache) > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, entry = self.cache.popitem(last=False)
+            self.bytes -= entry['size']
+            self._free_slot(entry['slot'])
+            self.evictions += 1
+
+    def _free_slot(self, slot: int) -> None:
+        """释放条目占用的槽位"""
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def _compact_heap(self) -> None:
+        """过期堆中失效记录过多时重建，保持堆大小与条目数同阶"""
+        if len(self._expiry_heap) > 2 * len(self.cache) + 1024:
+            self._expiry_heap = [(entry['expire_at'], key) for key, entry in self.cache.items()]
+            heapq.heapify(self._expiry_heap)
+
+
+def create_cache(config: Dict[str, Any]):
+    """
+    根据配置创建缓存实例
+
+    参数:
+        config: 缓存配置，shm_name 非空时使用跨进程共享内存缓存，
+                compact 为真时使用紧凑内存缓存，shards 大于 1 时按分片加锁（线程安全），
+                persist_path 非空时启用 SQLite 持久化
+
+    返回:
+        TokenCache、CompactTokenCache、ShardedTokenCache 或 SharedMemoryTokenCache 实例
+    """
+    options = dict(config)
+    shm_name = options.pop("shm_name", None)
+    persist_path = options.pop("persist_path", None)
+    compact = options.pop("compact", False)
+    shards = options.pop("shards", 0)
+    if shm_name:
+        from mqtt.shm_cache import SharedMemoryTokenCache
+        return SharedMemoryTokenCache(shm_name, **options)
+
+    store = SQLiteTokenStore(persist_path) if persist_path else None
+    cache_class = TokenCache
+    if compact:
+        from mqtt.compact_cache import CompactTokenCache
+        cache_class = CompactTokenCache
+    if shards > 1:
+        from mqtt.sharded_cache import ShardedTokenCache
+        return ShardedTokenCache(shards, cache_class, store=store, **options)
+    return cache_class(store=store, **options)
 
 
 # 创建全局缓存实例
-cache = TokenCache(expire_days=29)
+cache = create_cache(get_cache_config())
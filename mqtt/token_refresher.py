@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token 提前刷新模块
+后台任务按失效时间顺序在缓存过期前重新生成 Token，并主动清理过期条目
+"""
+
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mqtt.config import get_refresh_config
+from mqtt.token_cache import TokenCache, cache as default_cache
+
+logger = logging.getLogger(__name__)
+
+# 每刷新多少个 Token 让出一次事件循环
+_YIELD_EVERY = 100
+
+
+class TokenRefresher:
+    """Token 提前刷新调度器"""
+
+    def __init__(self, cache: TokenCache, margin_seconds: int = 3600,
+                 jitter_seconds: int = 1800, purge_interval: int = 60):
+        """
+        初始化调度器
+
+        参数:
+            cache: 要维护的 TokenCache 实例
+            margin_seconds: 在缓存失效前多少秒刷新
+            jitter_seconds: 额外随机提前的最大秒数，分散刷新时间
+            purge_interval: 过期条目清理间隔（秒）
+        """
+        self.cache = cache
+        self.margin_seconds = margin_seconds
+        self.jitter_seconds = jitter_seconds
+        self.purge_interval = purge_interval
+        # (刷新时间, key) 小顶堆；_scheduled 记录每个 key 当前有效的刷新时间
+        self._heap: List[Tuple[float, str]] = []
+        self._scheduled: Dict[str, float] = {}
+        self._generators: Dict[str, Callable[[], str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.failures = 0
+        self.purged = 0
+
+    def track(self, key: str, generate: Callable[[], str]) -> None:
+        """
+        登记需要提前刷新的缓存条目
+
+        generate 会一直保留到条目被淘汰，只登记由注册表配置生成的 Token，
+        不要传入捕获调用方密钥的函数
+
+        参数:
+            key: 缓存键
+            generate: 重新生成 Token 的函数
+        """
+        self._generators[key] = generate
+        self._schedule(key)
+        if len(self._generators) > 2 * self.cache.max_entries:
+            self._prune()
+
+    def untrack(self, key: str) -> None:
+        """
+        取消缓存条目的提前刷新
+
+        参数:
+            key: 缓存键
+        """
+        self._generators.pop(key, None)
+        self._scheduled.pop(key, None)
+
+    def clear(self) -> None:
+        """取消所有条目的提前刷新"""
+        self._heap.clear()
+        self._scheduled.clear()
+        self._generators.clear()
+
+    def start(self) -> None:
+        """在当前事件循环中启动后台刷新任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台刷新任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """获取刷新统计信息"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "tracked": len(self._generators),
+            "refreshed": self.refreshed,
+            "failures": self.failures,
+            "purged": self.purged,
+            "next_refresh_at": self._heap[0][0] if self._heap else None
+        }
+
+    def _schedule(self, key: str) -> None:
+        """根据缓存条目的失效时间计算带抖动的刷新时间并入堆"""
+        expire_at = self.cache.get_expire_at(key)
+        if expire_at is None:
+            self.untrack(key)
+            return
+
+        remaining = expire_at - time.time()
+        lead = self.margin_seconds + random.uniform(0, self.jitter_seconds)
+        # 短期 Token 最多提前一半有效期刷新
+        refresh_at = expire_at - min(lead, remaining / 2)
+        self._scheduled[key] = refresh_at
+        heapq.heappush(self._heap, (refresh_at, key))
+
+    def _prune(self) -> None:
+        """移除已被缓存淘汰的条目，并重建堆"""
+        for key in [key for key in self._generators if self.cache.get_expire_at(key) is None]:
+            self.untrack(key)
+        self._heap = [(refresh_at, key) for key, refresh_at in self._scheduled.items()]
+        heapq.heapify(self._heap)
+
+    async def _refresh_due(self) -> None:
+        """刷新所有已到期的条目"""
+        now = time.time()
+        count = 0
+        while self._heap and self._heap[0][0] <= now:
+            refresh_at, key = heapq.heappop(self._heap)
+            if self._scheduled.get(key) != refresh_at:
+                continue
+            del self._scheduled[key]
+
+            generate = self._generators.get(key)
+            if generate is None or self.cache.get_expire_at(key) is None:
+                # 条目已被删除或淘汰，不再刷新
+                self._generators.pop(key, None)
+                continue
+
+            try:
+                self.cache.set(key, generate())
+                self.refreshed += 1
+                self._schedule(key)
+            except Exception:
+                self.failures += 1
+                self._generators.pop(key, None)
+                logger.exception("Token 提前刷新失败: %s", key)
+
+            count += 1
+            if count % _YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+    async def _run(self) -> None:
+        """后台循环：刷新到期条目并定期清理过期条目"""
+        next_purge = 0.0
+        while True:
+            now = time.time()
+            if now >= next_purge:
+                self.purged += self.cache.purge_expired()
+                next_purge = now + self.purge_interval
+
+            await self._refresh_due()
+
+            now = time.time()
+            delay = next_purge - now
+            if self._heap:
+                delay = min(delay, self._heap[0][0] - now)
+            await asyncio.sleep(max(delay, 0.05))
+
+
+# 创建全局刷新调度器
+refresher = TokenRefresher(default_cache, **get_refresh_config())
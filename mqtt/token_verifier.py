@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token 校验模块
+解析并校验 OneNET MQTT Token，已校验通过的 Token 缓存到其 et 为止
+"""
+
+import base64
+import hmac
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import unquote
+
+from mqtt import device_registry
+from mqtt.signer import SIGN_METHODS, TOKEN_METHOD, TOKEN_VERSION, key_fingerprint, registry
+
+
+def parse_token(token: str) -> Tuple[str, str, int, str, str]:
+    """
+    按固定字段顺序解析 Token，不构建中间字典
+
+    参数:
+        token: Token 字符串，格式: version=...&res=...&et=...&method=...&sign=...
+
+    返回:
+        (version, res（已 URL 解码）, et, method, sign（保持 URL 编码）)
+
+    异常:
+        ValueError: Token 格式无效时抛出
+    """
+    parts = token.split("&")
+    if len(parts) != 5:
+        raise ValueError("Token 格式无效")
+    version, res, et, method, sign = parts
+    if not (version.startswith("version=") and res.startswith("res=") and et.startswith("et=")
+            and method.startswith("method=") and sign.startswith("sign=")):
+        raise ValueError("Token 格式无效")
+    return version[8:], unquote(res[4:]), int(et[3:]), method[7:], sign[5:]
+
+
+def check_signature(res: str, expire_time: int, sign: str, access_key: str, method: str = TOKEN_METHOD) -> bool:
+    """
+    以常量时间比较 Token 签名
+
+    参数:
+        res: 资源路径（已 URL 解码）
+        expire_time: 过期时间戳（秒）
+        sign: Token 中的 sign 字段（URL 编码）
+        access_key: 访问密钥（Base64 编码）
+        method: 签名方法（sha1、sha256 或 md5）
+
+    返回:
+        True 如果签名匹配
+    """
+    try:
+        actual = base64.b64decode(unquote(sign), validate=True)
+    except ValueError:
+        return False
+    expected = registry.get(access_key, method).digest(res, expire_time)
+    return hmac.compare_digest(expected, actual)
+
+
+def _resource_access_key(res: str) -> str:
+    """
+    根据资源路径从设备注册表查找产品访问密钥
+
+    参数:
+        res: products/{product_id} 或 products/{product_id}/devices/{device_id}
+
+    返回:
+        访问密钥（Base64 编码）
+
+    异常:
+        ValueError: 资源路径无效或产品不存在时抛出
+    """
+    parts = res.split("/")
+    if parts[0] != "products" or len(parts) not in (2, 4) or (len(parts) == 4 and parts[2] != "devices"):
+        raise ValueError(f"资源路径无效: {res}")
+    product = device_registry.registry.get_product(parts[1])
+    if product is None:
+        raise ValueError(f"产品 '{parts[1]}' 不存在")
+    return product["access_key"]
+
+
+class TokenVerifier:
+    """Token 校验器（带已校验 Token 的 LRU 缓存）"""
+
+    def __init__(self, max_entries: int = 100000):
+        """
+        初始化校验器
+
+        参数:
+            max_entries: 最多缓存的已校验 Token 数量
+        """
+        # 密钥指纹:Token -> (et, res)
+        self._verified: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        # 缓存内容所依据的设备注册表索引，注册表重新加载（密钥轮换、产品删除）后整体失效
+        self._index = device_registry.registry.index
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token: str, access_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        校验 Token
+
+        缓存键包含实际用于校验的密钥指纹，产品密钥轮换后用旧密钥签名的 Token 不会再命中缓存
+
+        参数:
+            token: Token 字符串
+            access_key: 访问密钥（Base64 编码），不传则根据 res 从设备注册表查找产品密钥
+
+        返回:
+            校验结果字典: valid、res、et、cached，失败时包含 error
+        """
+        index = device_registry.registry.index
+        if index is not self._index:
+            self.clear()
+            self._index = index
+        now = time.time()
+
+        try:
+            version, res, expire_time, method, sign = parse_token(token)
+            key = access_key if access_key is not None else _resource_access_key(res)
+        except ValueError as e:
+            self.misses += 1
+            return {"valid": False, "error": str(e), "cached": False}
+        cache_key = f"{key_fingerprint(key)}:{token}"
+
+        cached = self._verified.get(cache_key)
+        if cached is not None:
+            if cached[0] > now:
+                self.hits += 1
+                self._verified.move_to_end(cache_key)
+                return {"valid": True, "res": cached[1], "et": cached[0], "cached": True}
+            del self._verified[cache_key]
+
+        self.misses += 1
+        try:
+            if version != TOKEN_VERSION:
+                raise ValueError("Token 版本不支持")
+            if method not in SIGN_METHODS:
+                raise ValueError(f"不支持的签名方法: {method}")
+            if expire_time <= now:
+                raise ValueError("Token 已过期")
+            if not check_signature(res, expire_time, sign, key, method):
+                raise ValueError("Token 签名无效")
+        except ValueError as e:
+            return {"valid": False, "error": str(e), "cached": False}
+
+        # 只缓存校验通过的 Token，避免无效 Token 占满缓存
+        self._verified[cache_key] = (expire_time, res)
+        if len(self._verified) > self.max_entries:
+            self._verified.popitem(last=False)
+        return {"valid": True, "res": res, "et": expire_time, "cached": False}
+
+    def clear(self) -> None:
+        """清空已校验 Token 缓存"""
+        self._verified.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取校验缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._verified),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# 创建全局校验器
+verifier = TokenVerifier(max_entries=100000)
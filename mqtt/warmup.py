@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+启动预热模块
+服务启动时准备所有产品密钥的签名器，并行生成注册表中所有设备的 Token 写入缓存，
+完成前就绪检查返回未就绪，负载均衡器只在预热完成后转发流量
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from mqtt import bulk, device_registry, onenet_token, token_cache, token_refresher
+from mqtt.config import get_warmup_config
+from mqtt.signer import compute_expire_time, registry, resource_templates
+from mqtt.token_cache import make_key
+
+logger = logging.getLogger(__name__)
+
+# 设备数超过该值时分块交给签名进程池并行生成
+_POOL_THRESHOLD = bulk.CHUNK_SIZE
+
+
+def sign_resources(access_key: str, method: str, expire_time: int, resources: List[str]) -> List[str]:
+    """
+    为一组资源路径生成 Token（可在签名进程池中运行）
+
+    参数:
+        access_key: 访问密钥（Base64 编码）
+        method: 签名方法
+        expire_time: 过期时间戳（秒）
+        resources: 资源路径列表
+
+    返回:
+        与 resources 顺序一致的 Token 列表
+    """
+    return registry.get(access_key, method).sign_many(resources, expire_time)
+
+
+class Warmer:
+    """启动预热任务及就绪状态"""
+
+    def __init__(self, enabled: bool = True, expire_hours: int = 720, max_devices: Optional[int] = None):
+        """
+        初始化预热任务
+
+        参数:
+            enabled: 是否预热，False 时启动后立即就绪
+            expire_hours: 预热 Token 的有效期（小时）
+            max_devices: 最多预热的设备数，None 表示不超过缓存容量
+        """
+        self.enabled = enabled
+        self.expire_hours = expire_hours
+        self.max_devices = max_devices
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.signers = 0
+        self.devices = 0
+        self.duration: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        """预热结束（成功或失败）后即为就绪，失败时请求回退到按需生成"""
+        return self.state in ("ready", "failed", "disabled")
+
+    def start(self) -> None:
+        """在当前事件循环中启动预热任务"""
+        if not self.enabled:
+            self.state = "disabled"
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        """取消未完成的预热任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run(self) -> None:
+        """执行预热，异常只记录日志，不影响服务启动"""
+        self.state = "running"
+        start = time.perf_counter()
+        try:
+            self.signers = self._prepare_signers()
+            self.devices = await self._fill_cache()
+        except asyncio.CancelledError:
+            self.state = "pending"
+            raise
+        except Exception as e:
+            logger.exception("启动预热失败，Token 将在首次请求时生成")
+            self.error = str(e)
+            self.state = "failed"
+        else:
+            self.state = "ready"
+        finally:
+            self.duration = round(time.perf_counter() - start, 3)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取预热状态"""
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "signers": self.signers,
+            "devices": self.devices,
+            "duration": self.duration,
+            "error": self.error
+        }
+
+    def _prepare_signers(self) -> int:
+        """解码所有产品密钥并缓存预置签名器"""
+        products = device_registry.registry.index.products
+        for product in products.values():
+            registry.get(product["access_key"], product["method"])
+        return len(products)
+
+    def _plan(self) -> Dict[Tuple[str, str], List[Tuple[str, str]]]:
+        """
+        列出需要预热的设备
+
+        返回:
+            (access_key, method) -> [(设备名称, 资源路径)]，被默认产品同名设备遮蔽的设备不预热
+        """
+        index = device_registry.registry.index
+        limit = self.max_devices
+        if limit is None:
+            limit = token_cache.cache.max_entries - 1
+        plan: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        count = 0
+        for product_id, product in index.products.items():
+            for record in index.iter_range(product_id):
+                if count >= limit:
+                    return plan
+                # 按名称访问的路由只能取到全局索引中的设备
+                if index.get(record.name) is not record:
+                    continue
+                res = f"products/{product_id}/devices/{record.device_id}"
+                plan.setdefault((product["access_key"], product["method"]), []).append((record.name, res))
+                count += 1
+        return plan
+
+    async def _fill_cache(self) -> int:
+        """并行生成默认产品和所有设备的 Token 并写入缓存"""
+        cache = token_cache.cache
+        refresher = token_refresher.refresher
+        expire_hours = self.expire_hours
+        expire_time = compute_expire_time(expire_hours)
+
+        # 默认产品 Token
+        key = onenet_token.product_cache_key(expire_hours)
+        if cache.get_expire_at(key) is None:
+            cache.set(key, onenet_token.generate_product_token(expire_hours))
+            refresher.track(key, lambda: onenet_token.generate_product_token(expire_hours))
+
+        plan = self._plan()
+        total = sum(len(items) for items in plan.values())
+        # 设备较少时直接在主进程签名，省去进程池启动和结果传输的开销
+        use_pool = total > _POOL_THRESHOLD and (os.cpu_count() or 1) > 1
+        loop = asyncio.get_running_loop()
+        jobs = []
+        for (access_key, method), items in plan.items():
+            for i in range(0, len(items), bulk.CHUNK_SIZE):
+                chunk = items[i:i + bulk.CHUNK_SIZE]
+                resources = [res for _, res in chunk]
+                if use_pool:
+                    job = loop.run_in_executor(bulk.get_pool(), sign_resources, access_key, method,
+                                               expire_time, resources)
+                else:
+                    job = resources
+                jobs.append((access_key, method, chunk, job))
+
+        warmed = 0
+        for access_key, method, chunk, job in jobs:
+            tokens = await job if use_pool else sign_resources(access_key, method, expire_time, job)
+            for (name, res), token in zip(chunk, tokens):
+                # 模板在主进程中同样预热，后续刷新和校验不再重新计算
+                resource_templates(res, method)
+                key = make_key(res, access_key, expire_hours, method)
+                cache.set(key, token)
+                refresher.track(key, lambda name=name: onenet_token.generate_device_token(name, expire_hours))
+                warmed += 1
+            # 每块写入后让出事件循环，不阻塞已到达的请求
+            await asyncio.sleep(0)
+        return warmed
+
+
+# 创建全局预热任务
+warmer = Warmer(**get_warmup_config())
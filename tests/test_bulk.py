@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量 Token 生成测试: 行切分、行号和错误行
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from mqtt import bulk
+
+ACCESS_KEY = "h7uDwVvrrRlRzX07xVHT/deJGZsHyZ+7zd1tBfc5G10="
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def _lines(*parts, **kwargs):
+    async def collect():
+        return [item async for item in bulk.iter_lines(_chunks(*parts), **kwargs)]
+    return asyncio.run(collect())
+
+
+def _bulk(*parts, fmt="csv"):
+    async def collect():
+        chunks = [chunk async for chunk in bulk.stream_tokens(_chunks(*parts), fmt, "p1", ACCESS_KEY, 2000000000)]
+        return [json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines()]
+    return asyncio.run(collect())
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pool():
+    yield
+    bulk.shutdown_pool()
+
+
+def test_line_numbers_count_blank_lines():
+    assert _lines(b"a\n\n", b"\nb\r\nc") == [(1, "a", ""), (4, "b", ""), (5, "c", "")]
+
+
+def test_lines_split_across_chunks():
+    assert _lines(b"ab", b"c\nd", b"e\n") == [(1, "abc", ""), (2, "de", "")]
+
+
+def test_invalid_utf8_is_reported_per_line():
+    result = _lines(b"a\n\xff\xfe\nb\n")
+    assert result[0] == (1, "a", "")
+    assert result[1][:2] == (2, None) and "UTF-8" in result[1][2]
+    assert result[2] == (3, "b", "")
+
+
+def test_overlong_line_is_rejected_without_buffering():
+    result = _lines(b"a\n", b"x" * 10, b"x" * 10, b"\nb\n", b"y" * 30, max_line=16)
+    assert [(line_no, text) for line_no, text, _ in result] == [(1, "a"), (2, None), (3, "b"), (4, None)]
+    assert "超过 16 字节" in result[1][2]
+
+
+def test_stream_tokens_reports_error_lines_and_keeps_valid_ones():
+    results = _bulk(b"device_id\nd1\n\n\n\xff\nd2\n")
+    assert [item.get("device") for item in results] == ["d1", None, "d2"]
+    assert results[1]["line"] == 5
+    assert "UTF-8" in results[1]["error"]
+    assert all(item["token"].startswith("version=") for item in (results[0], results[2]))
+
+
+def test_stream_tokens_ndjson_error_line_number():
+    results = _bulk(b'"d1"\n\n\n{"x": 1}\n', fmt="ndjson")
+    assert results[0]["device"] == "d1"
+    assert results[1]["line"] == 4
+    assert "device_id" in results[1]["error"]
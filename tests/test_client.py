@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+客户端测试: 流式批量接口在输入远大于套接字缓冲时不会死锁
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+import commonserv_client
+from commonserv_client import AsyncTokenClient, TokenClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACCESS_KEY = "h7uDwVvrrRlRzX07xVHT/deJGZsHyZ+7zd1tBfc5G10="
+
+# 约 10MB 请求体、50MB 响应，远大于回环连接两端的套接字缓冲
+BULK_DEVICES = 300000
+
+
+@pytest.fixture(scope="module")
+def server():
+    """在子进程中启动服务（关闭预热和准入控制），返回 base_url"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, COMMONSERV_WARMUP="0", COMMONSERV_ADMISSION="0")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(f"{base_url}/health")
+                break
+            except httpx.TransportError:
+                if time.time() > deadline or process.poll() is not None:
+                    raise RuntimeError("服务启动失败")
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _devices():
+    for i in range(BULK_DEVICES):
+        yield f"device-{i:07d}-with-a-longer-name"
+    yield {"device_id": ""}
+
+
+def _run_with_timeout(fn, timeout=120):
+    """在线程中执行 fn，超时视为死锁"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "流式批量请求超时（疑似死锁）"
+    return result[0]
+
+
+def _check(results):
+    assert len(results) == BULK_DEVICES + 1
+    assert results[0]["device"] == "device-0000000-with-a-longer-name"
+    assert results[BULK_DEVICES - 1]["device"] == f"device-{BULK_DEVICES - 1:07d}-with-a-longer-name"
+    assert all("token" in result for result in results[:BULK_DEVICES])
+    # 错误行号按整个输入计数，而不是子请求内的行号
+    assert results[-1]["line"] == BULK_DEVICES + 1
+
+
+def test_bulk_bodies_are_bounded():
+    chunks = list(commonserv_client._bulk_bodies(f"d{i}" for i in range(10000)))
+    assert len(chunks) > 1
+    assert all(len(body) <= commonserv_client.BULK_REQUEST_BYTES for _, body in chunks)
+    assert [offset for offset, _ in chunks][1] == chunks[0][1].count(b"\n")
+    assert sum(body.count(b"\n") for _, body in chunks) == 10000
+
+
+def test_sync_bulk_larger_than_socket_buffers(server):
+    def run():
+        with TokenClient(server) as client:
+            return list(client.bulk_tokens("p1", ACCESS_KEY, _devices()))
+
+    _check(_run_with_timeout(run))
+
+
+def test_async_bulk_larger_than_socket_buffers(server):
+    async def collect():
+        async with AsyncTokenClient(server) as client:
+            return [result async for result in client.bulk_tokens("p1", ACCESS_KEY, _devices())]
+
+    _check(_run_with_timeout(lambda: asyncio.run(collect())))
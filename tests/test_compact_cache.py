@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+紧凑缓存测试: 与参考字典一致、CLOCK 淘汰、资源路径表和后缀表的回收
+"""
+
+import random
+import sys
+import time
+
+from mqtt.compact_cache import _RESOURCE_OVERHEAD, CompactTokenCache
+from mqtt.signer import key_fingerprint, registry
+from mqtt.token_cache import make_key
+
+ACCESS_KEY = "h7uDwVvrrRlRzX07xVHT/deJGZsHyZ+7zd1tBfc5G10="
+
+
+def _entry(device, access_key=ACCESS_KEY, method="sha1"):
+    res = f"products/p1/devices/{device}"
+    token = registry.get(access_key, method).sign(res, int(time.time()) + 30 * 86400)
+    return make_key(res, access_key, 720, method), token
+
+
+def test_matches_reference_dict():
+    cache = CompactTokenCache(max_entries=10 ** 6)
+    expected = {}
+    rnd = random.Random(7)
+    for _ in range(3000):
+        key, token = _entry(f"d{rnd.randrange(500)}", method=rnd.choice(("sha1", "sha256", "md5")))
+        if rnd.random() < 0.2:
+            assert cache.refresh(key) == (key in expected)
+            expected.pop(key, None)
+        else:
+            cache.set(key, token)
+            expected[key] = token
+    assert cache.count == len(expected)
+    for key, token in expected.items():
+        assert cache.get(key) == token
+    assert {key: entry["token"] for key, entry in cache.get_all().items()} == expected
+
+
+def test_unsplittable_token_is_stored_raw():
+    cache = CompactTokenCache()
+    cache.set("products/p1/devices/d1|fp|1h", "opaque-token")
+    assert cache.get("products/p1/devices/d1|fp|1h") == "opaque-token"
+    assert cache.stats()["raw"] == 1
+
+
+def test_clock_eviction_keeps_referenced_entries():
+    cache = CompactTokenCache(max_entries=100)
+    entries = [_entry(f"d{i}") for i in range(100)]
+    for key, token in entries:
+        cache.set(key, token)
+    # 第一次淘汰时指针扫过一轮，清零所有访问位后淘汰最早的条目
+    cache.set(*_entry("n0"))
+    assert cache.get(entries[0][0]) is None
+    for key, _ in entries[1:51]:
+        cache.get(key)
+    for i in range(1, 50):
+        cache.set(*_entry(f"n{i}"))
+    assert cache.count == 100
+    assert cache.evictions == 50
+    assert all(cache.get(key) == token for key, token in entries[1:51])
+    assert all(cache.get(key) is None for key, _ in entries[51:])
+
+
+def test_resource_table_is_rebuilt():
+    cache = CompactTokenCache(max_entries=100)
+    for i in range(5000):
+        cache.set(*_entry(f"d{i}"))
+    assert cache.count == 100
+    assert len(cache._resources) <= 2 * 100 + 1024
+    for i in range(4900, 5000):
+        key, token = _entry(f"d{i}")
+        assert cache.get(key) == token
+
+
+def test_suffixes_are_reclaimed():
+    cache = CompactTokenCache(max_entries=100)
+    keys = [f"k{i}".encode() for i in range(5000)]
+    for i, access_key in enumerate(keys):
+        cache.set(*_entry(f"d{i % 10}", access_key))
+    assert cache.count == 100
+    assert cache.stats()["suffixes"] == 100
+    assert len(cache._suffixes) <= 101
+    key, token = _entry("d9", keys[-1])
+    assert cache.get(key) == token
+    assert key_fingerprint(keys[-1]) in key
+
+    cache.clear()
+    for i, access_key in enumerate(keys[:10]):
+        key, token = _entry(f"d{i}", access_key)
+        cache.set(key, token)
+        cache.refresh(key)
+    assert cache.count == 0
+    assert cache.stats()["suffixes"] == 0
+    # 条目和后缀都已释放，只剩资源路径表的占用
+    assert cache.bytes == sum(sys.getsizeof(res) + _RESOURCE_OVERHEAD for res in cache._resources)
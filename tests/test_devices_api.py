@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+设备列表接口测试: 游标校验、分页和 ndjson 流式输出
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from mqtt import device_registry
+
+DEVICES = 2500
+
+
+@pytest.fixture(scope="module")
+def client():
+    registry = device_registry.DeviceRegistry()
+    registry.index = device_registry.build_index({
+        "product_id": "p1",
+        "access_key": "h7uDwVvrrRlRzX07xVHT/deJGZsHyZ+7zd1tBfc5G10=",
+        "devices": {f"dev{i:05d}": {} for i in range(DEVICES)}
+    })
+    original = device_registry.registry
+    device_registry.registry = registry
+    try:
+        with TestClient(main.app) as client:
+            yield client
+    finally:
+        device_registry.registry = original
+
+
+@pytest.mark.parametrize("cursor", ["@@@", "!", "=", "a b", "A"])
+def test_invalid_cursor_is_rejected(client, cursor):
+    response = client.get("/mqtt/onenet/v1/devices", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "cursor 无效"
+
+
+def test_non_utf8_cursor_is_rejected(client):
+    response = client.get("/mqtt/onenet/v1/devices", params={"cursor": "_w"})
+    assert response.status_code == 400
+
+
+def test_pages_cover_all_devices(client):
+    names = []
+    cursor = None
+    while True:
+        params = {"limit": 1000}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get("/mqtt/onenet/v1/devices", params=params).json()["data"]
+        names += data["devices"]
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+    assert len(names) == DEVICES
+    assert names == sorted(set(names))
+
+
+def test_ndjson_streams_from_cursor(client):
+    cursor = main._encode_cursor("DEV00099")
+    response = client.get("/mqtt/onenet/v1/devices", params={"format": "ndjson", "cursor": cursor})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == DEVICES - 100
+    assert lines[0]["device"] == "DEV00100"
+    assert lines[-1]["device"] == f"DEV{DEVICES - 1:05d}"
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共享内存缓存测试: 跨实例可见、清空代号和 seqlock 读取
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+import pytest
+
+from mqtt.shm_cache import _HEADER_SIZE, _U64, SLOT_SIZE, SharedMemoryTokenCache
+
+TOKENS = ("A" * 40, "B" * 280)
+
+
+@pytest.fixture
+def name():
+    name = f"cstest_{uuid.uuid4().hex[:8]}"
+    yield name
+    cache = SharedMemoryTokenCache(name, max_entries=64)
+    cache.close()
+    cache.unlink()
+    os.unlink(os.path.join(tempfile.gettempdir(), f"{name}.lock"))
+
+
+def _writer(name, key, stop_at):
+    cache = SharedMemoryTokenCache(name, max_entries=64)
+    i = 0
+    while time.time() < stop_at:
+        cache.set(key, TOKENS[i % 2])
+        i += 1
+    cache.close()
+
+
+def test_entries_are_shared_between_instances(name):
+    first = SharedMemoryTokenCache(name, max_entries=64)
+    second = SharedMemoryTokenCache(name, max_entries=1024)
+    try:
+        assert second.max_entries == 64
+        first.set("k1", "token-1")
+        assert second.get("k1") == "token-1"
+        assert second.refresh("k1")
+        assert first.get("k1") is None
+
+        first.set("k2", "token-2")
+        second.clear()
+        assert first.get("k2") is None
+        assert first.stats()["count"] == 0
+    finally:
+        first.close()
+        second.close()
+
+
+def test_read_during_write_is_retried_then_skipped(name):
+    cache = SharedMemoryTokenCache(name, max_entries=64)
+    try:
+        cache.set("k1", "token-1")
+        index = next(index for index in range(cache.max_entries) if cache._read(index) is not None)
+        offset = _HEADER_SIZE + index * SLOT_SIZE
+        seq = _U64.unpack_from(cache._buf, offset)[0]
+        # 奇数 seq 表示写入进行中，读者不能返回槽位内容
+        _U64.pack_into(cache._buf, offset, seq + 1)
+        assert cache._read(index) is None
+        assert cache.get("k1") is None
+        _U64.pack_into(cache._buf, offset, seq + 2)
+        assert cache.get("k1") == "token-1"
+    finally:
+        cache.close()
+
+
+def test_concurrent_writer_never_produces_torn_reads(name):
+    cache = SharedMemoryTokenCache(name, max_entries=64)
+    cache.set("hot", TOKENS[0])
+    stop_at = time.time() + 1.0
+    writer = multiprocessing.get_context("fork").Process(target=_writer, args=(name, "hot", stop_at))
+    writer.start()
+    seen = set()
+    try:
+        while time.time() < stop_at:
+            token = cache.get("hot")
+            if token is not None:
+                assert token in TOKENS
+                seen.add(token)
+    finally:
+        writer.join()
+        cache.close()
+    assert writer.exitcode == 0
+    assert seen
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+签名器测试: 多线程下的签名器 LRU 和签名耗时直方图、无效密钥
+"""
+
+import threading
+
+import pytest
+
+from mqtt.metrics import Histogram
+from mqtt.onenet_token_custom import generate_device_tokens_custom
+from mqtt.signer import SignerRegistry
+
+THREADS = 8
+
+
+def _run_threads(work):
+    errors = []
+
+    def run(index):
+        try:
+            work(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_registry_lru_under_threads():
+    registry = SignerRegistry(max_size=4)
+    keys = [bytes([i]) * 16 for i in range(16)]
+
+    def work(index):
+        for i in range(5000):
+            signer = registry.get(keys[(i * (index + 1)) % len(keys)])
+            signer.sign("products/p1", 2000000000)
+
+    _run_threads(work)
+    stats = registry.stats()
+    assert stats["size"] <= 4
+    assert stats["hits"] + stats["misses"] == THREADS * 5000
+
+
+def test_histogram_counts_under_threads():
+    histogram = Histogram((0.5, 1.0))
+
+    def work(index):
+        for _ in range(20000):
+            histogram.observe(0.75)
+
+    _run_threads(work)
+    assert histogram.counts == [0, THREADS * 20000, 0]
+
+
+def test_invalid_access_keys_are_rejected():
+    registry = SignerRegistry()
+    for access_key in ("!!!", "", "abc", "aGVsbG8=\n!", b""):
+        with pytest.raises(ValueError):
+            registry.get(access_key)
+    assert registry.stats()["size"] == 0
+
+
+def test_batch_reports_invalid_key_per_item():
+    valid = "h7uDwVvrrRlRzX07xVHT/deJGZsHyZ+7zd1tBfc5G10="
+    results = generate_device_tokens_custom([
+        ("p1", "d1", valid),
+        ("p1", "d2", "!!!"),
+        ("p1", "d3", ""),
+        ("p1", "d4", valid, "sha256"),
+    ])
+    assert "token" in results[0] and "token" in results[3]
+    assert results[1]["error"].startswith("access_key 无效")
+    assert results[2]["error"].startswith("access_key 无效")
+    assert "token" not in results[1] and "token" not in results[2]
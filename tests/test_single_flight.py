@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+请求合并测试: 并发未命中只生成一次
+"""
+
+import asyncio
+import threading
+
+import main
+from mqtt import single_flight
+
+
+def test_concurrent_misses_coalesce():
+    calls = []
+    lock = threading.Lock()
+
+    def generate():
+        with lock:
+            calls.append(1)
+        return "token"
+
+    async def run():
+        return await asyncio.gather(*(main._load_token("test|coalesce|1h", generate) for _ in range(200)))
+
+    leaders, coalesced = single_flight.flights.leaders, single_flight.flights.coalesced
+    try:
+        results = asyncio.run(run())
+    finally:
+        main.token_cache.cache.refresh("test|coalesce|1h")
+        main.token_refresher.refresher.clear()
+    assert len(calls) == 1
+    assert all(token == "token" for token, _ in results)
+    assert sum(shared for _, shared in results) == 199
+    assert single_flight.flights.leaders - leaders == 1
+    assert single_flight.flights.coalesced - coalesced == 199
+    assert single_flight.flights.stats()["inflight"] == 0
+
+
+def test_error_is_shared_and_not_cached():
+    async def run():
+        def generate():
+            raise ValueError("boom")
+        return await asyncio.gather(*(main._load_token("test|error|1h", generate) for _ in range(5)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert main.token_cache.cache.get("test|error|1h") is None
+
+
+def test_leader_cancellation_does_not_fail_waiters():
+    flights = single_flight.SingleFlight()
+
+    async def run():
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return "token"
+
+        leader = asyncio.create_task(flights.do("k", load))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(flights.do("k", load)) for _ in range(5)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        assert leader.cancelled()
+        return results
+
+    assert asyncio.run(run()) == [("token", True)] * 5
+    assert flights.stats() == {"inflight": 0, "leaders": 1, "coalesced": 5}
+
+
+def test_generation_finishes_after_all_callers_cancel():
+    flights = single_flight.SingleFlight()
+    finished = []
+
+    async def run():
+        async def load():
+            await asyncio.sleep(0.01)
+            finished.append(1)
+            return "token"
+
+        caller = asyncio.create_task(flights.do("k", load))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert finished == [1]
+    assert flights.stats()["inflight"] == 0
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+提前刷新测试: 只跟踪注册表配置的 Token，不保留调用方传入的密钥
+"""
+
+from fastapi.testclient import TestClient
+
+import main
+from mqtt import onenet_token, onenet_token_custom
+
+ACCESS_KEY = "THNRWXNxUWxjSWNUOXNoN0pNalBGR3pKVHd3TDBkbjQ="
+
+
+def test_custom_tokens_are_not_tracked():
+    refresher = main.token_refresher.refresher
+    with TestClient(main.app) as client:
+        assert client.get("/mqtt/onenet/v1/token/custom/device", params={
+            "product_id": "p-refresh", "device_id": "d1", "access_key": ACCESS_KEY
+        }).status_code == 200
+        assert client.get("/mqtt/onenet/v1/token/product", params={
+            "product_id": "p-refresh", "access_key": ACCESS_KEY, "refresh": True
+        }).status_code == 200
+        assert client.get("/mqtt/onenet/v1/token/device/mo", params={"refresh": True}).status_code == 200
+
+        for key in (onenet_token_custom.device_cache_key_custom("p-refresh", "d1", ACCESS_KEY, 720),
+                    onenet_token_custom.product_cache_key_custom("p-refresh", ACCESS_KEY, 720)):
+            assert main.token_cache.cache.get(key) is not None
+            assert key not in refresher._generators
+        assert onenet_token.device_cache_key("mo") in refresher._generators
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token 校验缓存测试: 密钥轮换和产品删除后缓存的校验结果必须失效
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from mqtt import device_registry
+from mqtt.signer import registry as signer_registry
+from mqtt.token_verifier import TokenVerifier
+
+OLD_KEY = "h7uDwVvrrRlRzX07xVHT/deJGZsHyZ+7zd1tBfc5G10="
+NEW_KEY = "THNRWXNxUWxjSWNUOXNoN0pNalBGR3pKVHd3TDBkbjQ="
+RES = "products/p1/devices/d1"
+
+
+def _write_registry(path, products):
+    """写入注册表文件并推进修改时间，保证 reload 检测到变化"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"products": products}, f)
+    mtime = os.stat(path).st_mtime + 1
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """使用临时文件注册表替换全局注册表"""
+    path = str(tmp_path / "registry.json")
+    _write_registry(path, [{"product_id": "p1", "access_key": OLD_KEY, "devices": {"d1": {}}}])
+    registry = device_registry.DeviceRegistry(path)
+    monkeypatch.setattr(device_registry, "registry", registry)
+    return registry
+
+
+def _token(access_key):
+    return signer_registry.get(access_key).sign(RES, int(time.time()) + 3600)
+
+
+def test_rotated_key_invalidates_cached_result(registry):
+    verifier = TokenVerifier()
+    token = _token(OLD_KEY)
+    assert verifier.verify(token)["valid"]
+    assert verifier.verify(token)["cached"]
+
+    _write_registry(registry.path, [{"product_id": "p1", "access_key": NEW_KEY, "devices": {"d1": {}}}])
+    assert registry.reload()
+
+    result = verifier.verify(token)
+    assert not result["valid"]
+    assert result["error"] == "Token 签名无效"
+    assert verifier.verify(_token(NEW_KEY))["valid"]
+
+
+def test_removed_product_revokes_cached_result(registry):
+    verifier = TokenVerifier()
+    token = _token(OLD_KEY)
+    assert verifier.verify(token)["valid"]
+
+    _write_registry(registry.path, [{"product_id": "p2", "access_key": OLD_KEY}])
+    assert registry.reload()
+
+    result = verifier.verify(token)
+    assert not result["valid"]
+    assert "不存在" in result["error"]
+    assert verifier.stats()["size"] == 0
+
+
+def test_cache_key_includes_explicit_access_key(registry):
+    verifier = TokenVerifier()
+    token = _token(OLD_KEY)
+    assert verifier.verify(token, OLD_KEY)["valid"]
+    assert verifier.verify(token, OLD_KEY)["cached"]
+    assert not verifier.verify(token, NEW_KEY)["valid"]
+
+
+def test_clear_cache_endpoint_clears_verifier(registry):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    token = _token(OLD_KEY)
+    assert main.token_verifier.verifier.verify(token)["valid"]
+    with TestClient(main.app) as client:
+        assert client.delete("/mqtt/onenet/v1/cache").status_code == 200
+    assert main.token_verifier.verifier.stats()["size"] == 0
+
+
+@pytest.mark.parametrize("junk", ["%21", "%20", "!!", "%0A"])
+def test_malformed_signature_is_rejected(registry, junk):
+    verifier = TokenVerifier()
+    token = _token(OLD_KEY)
+    assert verifier.verify(token)["valid"]
+    # 宽松解码会丢弃非 Base64 字符，附加的垃圾字符不能让签名仍然通过
+    result = verifier.verify(token + junk)
+    assert not result["valid"]
+    assert result["error"] == "Token 签名无效"